@@ -11,10 +11,12 @@ h.add_rashba(.2)
 h.add_zeeman([0.,0.,0.3])
 g.write()
 t1 = time.clock()
-dm = densitymatrix.full_dm(h,use_fortran=False)
+dm = densitymatrix.full_dm(h)
 t2 = time.clock()
-dmf = densitymatrix.full_dm(h,use_fortran=True)
+es,vs = np.linalg.eigh(h.intra) # eigenvectors as columns
+vs = vs[:,es<0.] # occupied states
+dmf = np.conjugate(vs)@vs.T # reference density matrix
 t3 = time.clock()
 print("Error = ",np.sum(np.abs(dm-dmf)))
-print("Time Fortran = ",t3-t2)
-print("Time Python = ",t2-t1)
+print("Time full_dm = ",t2-t1)
+print("Time diagonalization = ",t3-t2)
@@ -8,6 +8,15 @@ from .algebratk import sparsetensor
 
 maxsize = 10000
 
+maxbatch = 2e7 # array elements stored at once by the batched routines
+
+
+def batch_size(size,budget=None):
+    """Number of items of a given size (in array elements) treated at
+    once, so that each batch stays within the memory budget"""
+    if budget is None: budget = maxbatch
+    return max([1,int(budget/size)])
+
 
 def hermitian(m):
     return np.transpose(np.conjugate(m))
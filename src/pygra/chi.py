@@ -1,6 +1,7 @@
 import numpy as np
 import scipy.linalg as lg
 from . import parallel
+from . import algebra
 from numba import jit
 
 try:
@@ -61,15 +62,101 @@ def chargechi_nowf(h,i=0,j=0,es=np.linspace(-3.0,3.0,100),delta=0.01,temp=1e-7):
 def chargechi_row(h,i=0,es=np.linspace(-3.0,3.0,100),delta=1e-6,temp=1e-7):
     """Compute charge response function"""
     if h.dimensionality!=0: raise
-    hk = h.get_hk_gen() # get generator
-    m = hk(0) # get Hamiltonian
-    esh,ws = lg.eigh(m)
-    ws = np.transpose(ws)
-    out = [] # store
     if i<0: raise
-    f = lambda j: chif90.elementchi(ws,esh,ws,esh,es,i+1,j+1,temp,delta)
-    out = parallel.pcall(f,range(m.shape[0])) # parallel call
-    return np.array(out)
+    out = chi_matrix(h,es=es,delta=delta,temp=temp,rows=[i])
+    return out[:,0,:].T # (n,nes)
+
+
+
+def fermi_occupation(es,temp=1e-7):
+    """Occupation of the states, with the Fermi energy at zero"""
+    from scipy.special import expit
+    return expit(-np.array(es)/max([temp,1e-12])) # Fermi Dirac
+
+
+
+def pair_products(wa,wb,mode=None):
+    """Products conj(wa_a(i))*wb_b(i) of two sets of states (columns),
+    resolved in orbitals (mode=None), or summed over the spin
+    in each site (mode="charge" or "sz")"""
+    p = np.conjugate(wa)[:,:,None]*wb[:,None,:] # (n,na,nb)
+    if mode is None: return p
+    p = p.reshape((p.shape[0]//2,2)+p.shape[1:]) # spin up and down
+    if mode=="charge": return p[:,0] + p[:,1]
+    elif mode=="sz": return p[:,0] - p[:,1]
+    else: raise
+
+
+
+def chi_engine(esa,wa,esb,wb,omegas,delta=1e-2,temp=1e-7,rows=None,
+                 mode=None,nchunk=None,nw=20,out=None):
+    """Susceptibility chi_ij(w) between the states a (esa,wa) and the
+    states b (esb,wb), eigenvectors as columns. For each frequency it is
+    computed as W diag((fb-fa)/(Ea-Eb-w+i delta)) W^dagger, with W the
+    pair products, chunking over the states a and the frequencies.
+    The occupations are Fermi-Dirac, instead of the linear ramp of
+    width 2*temp of the Fortran routine, which agree for small temp"""
+    omegas = np.array(omegas,dtype=float) # frequencies
+    fa,fb = fermi_occupation(esa,temp),fermi_occupation(esb,temp)
+    n = wa.shape[0] if mode is None else wa.shape[0]//2 # number of sites
+    if rows is None: rows = range(n) # all the rows
+    rows = np.array(rows,dtype=int)
+    if out is None:
+      out = np.zeros((len(omegas),len(rows),n),dtype=complex)
+    if nchunk is None: nchunk = algebra.batch_size(n*len(esb)) # states
+    for i in range(0,len(esa),nchunk): # loop over chunks of states
+      df = (fb[None,:] - fa[i:i+nchunk,None]).reshape(-1) # occupations
+      ic = np.abs(df)>1e-10 # only pairs with different occupation
+      if not np.any(ic): continue # next chunk
+      de = (esa[i:i+nchunk,None] - esb[None,:]).reshape(-1)[ic] # energies
+      p = pair_products(wa[:,i:i+nchunk],wb,mode=mode) # pair products
+      p = p.reshape((p.shape[0],-1))[:,ic] # (n,npairs)
+      pr = p[rows,:] # rows requested
+      pd = np.conjugate(p.T) # W^dagger
+      is_real = not np.iscomplexobj(p) # real wavefunctions
+      for j in range(0,len(omegas),nw): # loop over chunks of frequencies
+        ws = omegas[j:j+nw] # frequencies of this chunk
+        fs = df[ic][:,None]/(de[:,None] - ws[None,:] + 1j*delta)
+        for k in range(len(ws)):
+          if is_real: # two real products are cheaper than a complex one
+            out[j+k] += (pr*fs[:,k].real)@pd + 1j*((pr*fs[:,k].imag)@pd)
+          else: out[j+k] += (pr*fs[:,k])@pd
+    return out
+
+
+
+def chi_matrix(h,es=np.linspace(-3.0,3.0,100),delta=1e-2,temp=1e-7,
+                 rows=None,mode=None,nchunk=None):
+    """Full susceptibility matrix chi_ij(w) of a zero dimensional system,
+    or only the rows given, returns an array (nes,nrows,n).
+    mode None uses orbitals, mode "charge" or "sz" sites"""
+    if h.dimensionality!=0: raise
+    if mode is not None and not h.has_spin: raise
+    from .htk.eigenvectors import get_bloch_eigenvectors
+    (esh,ws) = get_bloch_eigenvectors(h,[[0.,0.,0.]]) # diagonalize
+    return chi_engine(esh[0],ws[0],esh[0],ws[0],es,delta=delta,temp=temp,
+                        rows=rows,mode=mode,nchunk=nchunk)
+
+
+
+def chi_q(h,q=[0.,0.,0.],es=np.linspace(-3.0,3.0,100),nk=10,delta=1e-2,
+            temp=1e-7,rows=None,mode=None,nchunk=None):
+    """Susceptibility chi_ij(q,w) of a periodic system, with i,j
+    orbitals (or sites) of the unit cell, returns an array (nes,nrows,n)"""
+    from .klist import kmesh
+    from .htk.eigenvectors import get_bloch_eigenvectors
+    if mode is not None and not h.has_spin: raise
+    ks = np.array(kmesh(h.dimensionality,nk=nk)) # kpoints
+    q = np.array(q,dtype=float) # wavevector
+    out = None
+    nc = algebra.batch_size(h.intra.shape[0]**2) # kpoints in each batch
+    for i in range(0,len(ks),nc): # loop over batches of kpoints
+      (esk,wsk) = get_bloch_eigenvectors(h,ks[i:i+nc]) # states at k
+      (eskq,wskq) = get_bloch_eigenvectors(h,ks[i:i+nc]+q) # states at k+q
+      for j in range(len(esk)):
+        out = chi_engine(esk[j],wsk[j],eskq[j],wskq[j],es,delta=delta,
+                temp=temp,rows=rows,mode=mode,nchunk=nchunk,out=out)
+    return out/len(ks) # normalize
 
 
 
@@ -0,0 +1,127 @@
+# library to build long range density-density interactions
+from __future__ import print_function,division
+import numpy as np
+from scipy.sparse import csr_matrix
+from scipy.special import erfc,erf
+from .neighbor import neighbor_pairs
+
+
+def screened_coulomb(vc=1.0,screening=4.0):
+    """Return a vectorized Yukawa kernel vc*exp(-r/screening)/r,
+    vanishing at r=0. screening=None gives the bare Coulomb one"""
+    def vfun(dr):
+        dr = np.array(dr,dtype=float)
+        out = np.zeros(dr.shape) # initialize
+        ii = dr>1e-4 # exclude the onsite term
+        out[ii] = vc/dr[ii]
+        if screening is not None: out[ii] *= np.exp(-dr[ii]/screening)
+        return out
+    return vfun
+
+
+def gate_screened_coulomb(vc=1.0,d=10.0,nimages=40):
+    """Return a vectorized Coulomb kernel screened by two metallic
+    gates at a distance d, using the image charges"""
+    def vfun(dr):
+        dr = np.array(dr,dtype=float)
+        out = np.zeros(dr.shape) # initialize
+        ii = dr>1e-4 # exclude the onsite term
+        for n in range(-nimages,nimages+1): # sum over the images
+          out[ii] += (-1)**n/np.sqrt(dr[ii]**2 + (n*2*d)**2)
+        return vc*out
+    return vfun
+
+
+def lattice_directions(g,rcut):
+    """Return the cell directions that have sites within rcut"""
+    if g.dimensionality==0: return [(0,0,0)]
+    n = g.dimensionality
+    A = np.array([g.a1,g.a2,g.a3])[0:n] # lattice vectors
+    P = np.linalg.pinv(A) # cartesian to fractional coordinates
+    fr = np.array(g.r).dot(P) # fractional coordinates of the sites
+    spread = np.max(fr,axis=0) - np.min(fr,axis=0) # extent of the cell
+    nmax = np.ceil(rcut*np.sqrt(np.sum(P*P,axis=0)) + spread).astype(int)
+    ns = [range(-nmax[i],nmax[i]+1) for i in range(n)]
+    ns += [[0] for i in range(3-n)] # no periodicity
+    return [(i,j,k) for i in ns[0] for j in ns[1] for k in ns[2]]
+
+
+def coulomb_kernel(g,vfun=None,vc=1.0,rcut=8.0,screening=4.0,vcut=1e-4,
+                     ewald=False,eta=None,tol=1e-10):
+    """Return the interaction between the sites of the unit cell and the
+    sites of the neighboring cells, as a dictionary with a sparse matrix
+    for each cell direction. The pairs come from a cutoff neighbor list,
+    and vfun takes an array of distances. With ewald=True the bare Coulomb
+    interaction is summed over the whole lattice, and folded in (0,0,0).
+    The folded kernel only gives the right Hartree term, since the Fock
+    term needs the interaction resolved by cell direction"""
+    if ewald: return {(0,0,0):csr_matrix(vc*ewald_matrix(g,eta=eta,tol=tol))}
+    if vfun is None: vfun = screened_coulomb(vc=vc,screening=screening)
+    nat = len(g.r) # number of sites
+    out = dict() # dictionary
+    for d in lattice_directions(g,rcut): # loop over directions
+      rj = np.array(g.replicas(d)) # positions in that cell
+      ii,jj,ds = neighbor_pairs(g.r,rj,rcut) # pairs within the cutoff
+      vs = np.array(vfun(ds)) # evaluate all the interactions at once
+      ic = np.abs(vs)>vcut # sizable interactions
+      if not np.any(ic): continue # next direction
+      m = csr_matrix((vs[ic],(ii[ic],jj[ic])),shape=(nat,nat))
+      out[d] = m # store
+    if len(out)==0: out[(0,0,0)] = csr_matrix((nat,nat)) # empty
+    for d in list(out): # enforce that v(-d) = v(d)^T
+      d2 = (-d[0],-d[1],-d[2])
+      if d2 not in out: out[d2] = out[d].T.tocsr()
+    return out
+
+
+def ewald_matrix(g,eta=None,tol=1e-10):
+    """Coulomb potential between sites i and j summed over all the
+    lattice vectors, phi_ij = sum_R 1/|r_j + R - r_i|, for 2d and 3d
+    lattices. A neutralizing background is included, and R=0 is excluded
+    for i=j. 2d lattices are assumed to be in the xy plane"""
+    if g.dimensionality not in [2,3]: raise # not implemented
+    r = np.array(g.r) # positions
+    nat = len(r) # number of sites
+    a1,a2,a3 = np.array(g.a1),np.array(g.a2),np.array(g.a3)
+    if g.dimensionality==2: area = np.abs(np.cross(a1,a2)[2]) # area
+    else: area = np.abs(np.dot(a1,np.cross(a2,a3))) # volume
+    if eta is None: eta = np.sqrt(np.pi)/area**(1./g.dimensionality)
+    lt = np.sqrt(-np.log(tol)) # decay in units of eta
+    # real space part, short ranged
+    out = np.zeros((nat,nat)) # initialize
+    rc = lt/eta # cutoff in real space
+    for d in lattice_directions(g,rc):
+      ii,jj,ds = neighbor_pairs(r,np.array(g.replicas(d)),rc,rmin=1e-6)
+      np.add.at(out,(ii,jj),erfc(eta*ds)/ds)
+    out -= 2.*eta/np.sqrt(np.pi)*np.identity(nat) # remove the self term
+    # reciprocal space part, long ranged
+    dr = r[None,:,:] - r[:,None,:] # r_j - r_i
+    if g.dimensionality==3:
+      B = 2.*np.pi*np.linalg.inv(np.array([a1,a2,a3])).T # reciprocal vectors
+    else:
+      B = 2.*np.pi*np.linalg.inv(np.array([a1[0:2],a2[0:2]])).T
+      B = np.concatenate([B,np.zeros((2,1))],axis=1) # in plane vectors
+    gmax = 2.*eta*lt # cutoff in reciprocal space
+    nmax = [int(gmax/np.sqrt(b.dot(b)))+1 for b in B]
+    ns = [range(-n,n+1) for n in nmax] + [[0] for i in range(3-len(B))]
+    for n1 in ns[0]:
+      for n2 in ns[1]:
+        for n3 in ns[2]:
+          if n1==0 and n2==0 and n3==0: continue # skip G=0
+          G = n1*B[0] + n2*B[1] + (n3*B[2] if len(B)==3 else 0.)
+          g2 = G.dot(G) ; gn = np.sqrt(g2)
+          if gn>gmax: continue
+          c = np.cos(dr.dot(G)) # cos(G r)
+          if g.dimensionality==3:
+            out += 4.*np.pi/area*np.exp(-g2/(4.*eta**2))/g2*c
+          else:
+            z = dr[:,:,2] # out of plane distances
+            f = np.exp(np.minimum(gn*z,700.))*erfc(gn/(2.*eta) + eta*z) # z dependence
+            f += np.exp(np.minimum(-gn*z,700.))*erfc(gn/(2.*eta) - eta*z)
+            out += np.pi/(area*gn)*c*f
+    # neutralizing background
+    if g.dimensionality==3: out -= np.pi/(eta**2*area)
+    else:
+      z = dr[:,:,2] # out of plane distances
+      out -= 2.*np.pi/area*(z*erf(eta*z) + np.exp(-(eta*z)**2)/(eta*np.sqrt(np.pi)))
+    return out
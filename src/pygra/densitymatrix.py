@@ -10,27 +10,62 @@ except:
   print("Fortran routines not working in densitymatrix.py")
  
 
-def full_dm(h,use_fortran=True,nk=10,fermi=0.0,delta=1e-2,ds=None):
-  if h.dimensionality == 0: fac = 1.
-  elif h.dimensionality == 1: fac = 1./nk
-  elif h.dimensionality == 2: fac = 1./nk**2
-  elif h.dimensionality == 3: fac = 1./nk**3
-  else: raise
-  if ds is None: # no directions required
-    es,vs = h.get_eigenvectors(nk=nk) # get eigenvectors
-    es = es - fermi # shift by the Fermi energy
-    if use_fortran:
-      dm = density_matrixf90.density_matrix(np.array(es),np.array(vs),delta)
-      return dm*fac
-    else:
-      return np.matrix(full_dm_python(h.intra.shape[0],es,np.array(vs)))*fac # call hte function
-  else: # directions required
-    es,vs,ks = h.get_eigenvectors(nk=nk,kpoints=True) # get eigenvectors
+def full_dm(h,nk=10,fermi=0.0,ds=None,time_reversal=False,smearing=None):
+  """Return the density matrix of the unit cell, or the density
+  matrices for the directions ds, using a mesh of kpoints"""
+  from .klist import kmesh,irreducible_kmesh
+  if time_reversal and h.dimensionality>0: # use half of the kmesh
+    if not is_real(h): raise # rho(-k) = conj(rho(k)) requires this
+    kp,ws = irreducible_kmesh(h,nk=nk,time_reversal=True,
+               ops=[np.identity(3)],check=False) # kpoints not related by TR
+  else:
+    kp = np.array(kmesh(h.dimensionality,nk=nk)) # kpoints
+    ws = np.zeros(len(kp)) + 1./len(kp) # weights
+  if ds is None: dirs = [[0,0,0]] # only the local one
+  else: dirs = ds
+  out = dm_kmesh(h,kp,ws,dirs,fermi=fermi,smearing=smearing)
+  if time_reversal and h.dimensionality>0: # real density matrices
+    out = out.real + 0j
+  if ds is None: return np.matrix(out[0])
+  else: return [o for o in out] # return all the density matrices
+
+
+def is_real(h):
+  """Check if all the matrices of a Hamiltonian are real"""
+  from .multicell import turn_multicell
+  hm = turn_multicell(h) # multicell form
+  ms = [hm.intra] + [t.m for t in hm.hopping] # all the matrices
+  return np.max([np.max(np.abs(np.array(m.imag))) if m.size>0 else 0.
+               for m in ms])<1e-10
+
+
+def dm_kmesh(h,kp,ws,ds,fermi=0.0,smearing=None,nchunk=None):
+  """Accumulate the density matrices for the directions ds, using the
+  kpoints kp with weights ws. Each kpoint contributes
+  conj(V) diag(f) V^T, with f the occupations, computed in batches"""
+  from . import multicell
+  kp = np.array(kp) ; ws = np.array(ws)
+  n = h.intra.shape[0] # dimensionality
+  if nchunk is None: nchunk = algebra.batch_size(n*n) # bound the memory
+  hs = multicell.hopping_stack(h) # stack all the hoppings, only once
+  dirs = np.array([np.round(d).astype(int) for d in ds]) # directions
+  out = np.zeros((len(dirs),n,n),dtype=complex) # output
+  for i in range(0,len(kp),nchunk): # loop over chunks of kpoints
+    ks = kp[i:i+nchunk] # kpoints of this chunk
+    hks = multicell.stack2hk(hs,ks,h.dimensionality,n) # Hamiltonians
+    es,vs = np.linalg.eigh(hks) # diagonalize all of them
     es = es - fermi # shift by the Fermi energy
-    ks = np.array(ks) # to array
-    n = h.intra.shape[0] # dimensionality
-    out = [full_dm_python_d(n,es,vs,ks,d)*fac for d in ds] # compute all the DM
-    return out # return all the density matrices
+    if smearing is None: fs = (es<0.).astype(float) # occupations
+    else: fs = 1./(np.exp(np.clip(es/smearing,-100,100))+1.) # Fermi-Dirac
+    nocc = np.max(np.sum(fs>1e-12,axis=1)) # highest occupied state
+    if nocc==0: continue # nothing occupied
+    vo = vs[:,:,0:nocc] # (partially) occupied states
+    vf = np.conjugate(vo)*fs[:,None,0:nocc] # times the occupations
+    rhok = vf@np.transpose(vo,(0,2,1)) # rho(k) for all the kpoints
+    phis = multicell.bloch_phases(h.dimensionality,ks,dirs) # phases
+    phis = phis*ws[i:i+nchunk][:,None] # times the weights
+    out += np.tensordot(phis.T,rhok,axes=(1,0)) # accumulate
+  return out
 
 
 
@@ -89,7 +124,7 @@ def restricted_dm(h,use_fortran=True,mode="KPM",pairs=[],
   """Calculate certain elements of the density matrix"""
   if h.dimensionality != 0 : raise
   if mode=="full": # full inversion and then select
-    dm = full_dm(h,use_fortran=use_fortran) # Full DM
+    dm = full_dm(h) # Full DM
     outm = np.array([dm[j,i] for (i,j) in pairs]) # get the desired ones
     return outm # return elements
   elif mode=="KPM": # use Kernel polynomial method
@@ -51,11 +51,11 @@ def dos_surface(h,output_file="DOS.OUT",
   if h.dimensionality!=1: raise # only for 1d
   fo = open(output_file,"w")
   fo.write("# energy, DOS surface, DOS bulk\n")
-  for e in energies: # loop over energies
-    print("Done",e)
-    gb,gs = green.green_renormalization(h.intra,h.inter,energy=e,delta=delta)
-    gb = -gb.trace()[0,0].imag
-    gs = -gs.trace()[0,0].imag
+  gbs,gss = green.green_renormalization_multienergy(h.intra,h.inter,
+                energies=energies,delta=delta) # all the energies
+  for (e,gb,gs) in zip(energies,gbs,gss): # loop over energies
+    gb = -np.trace(gb).imag
+    gs = -np.trace(gs).imag
     fo.write(str(e)+"     "+str(gs)+"    "+str(gb)+"\n")
   fo.close()
 
@@ -182,8 +182,9 @@ def dos1d_sites(h,sites=[0],scale=10.,nk=100,npol=100,info=False,ewindow=None):
 
 
 def calculate_dos_hkgen(hkgen,ks,ndos=100,delta=None,
-         is_sparse=False,numw=10,window=None,energies=None):
-  """Calculate density of states using the ks given on input"""
+         is_sparse=False,numw=10,window=None,energies=None,weights=None):
+  """Calculate density of states using the ks given on input,
+  optionally with a weight for each kpoint (summing to one)"""
   if not is_sparse: # if not is sparse
       m = hkgen([0,0,0]) # get the matrix
       if algebra.issparse(m): 
@@ -213,6 +214,9 @@ def calculate_dos_hkgen(hkgen,ks,ndos=100,delta=None,
 #  es = es.reshape(len(es)*len(es[0])) # 1d array
   es = np.array(es) # convert to array
   nk = len(ks) # number of kpoints
+  if weights is not None: # weight of each eigenvalue
+    w = np.concatenate([np.zeros(len(o))+wk*nk for (o,wk) in zip(out,weights)])
+  else: w = None
   if energies is not None: # energies given on input
     xs = energies
   else:
@@ -220,7 +224,7 @@ def calculate_dos_hkgen(hkgen,ks,ndos=100,delta=None,
       xs = np.linspace(np.min(es)-.5,np.max(es)+.5,ndos) # create x
     else:
       xs = np.linspace(-window,window,ndos) # create x
-  ys = calculate_dos(es,xs,delta) # use the Fortran routine
+  ys = calculate_dos(es,xs,delta,w=w) # use the Fortran routine
   ys /= nk # normalize by the number of k-points
   ys *= 1./np.pi # normalization of the Lorentzian
   write_dos(xs,ys) # write in file
@@ -229,16 +233,26 @@ def calculate_dos_hkgen(hkgen,ks,ndos=100,delta=None,
 
 
 
-def dos_kmesh(h,nk=10,delta=1e-3,random=False,
+def dos_kmesh(h,nk=10,delta=1e-3,random=False,ibz=False,
         energies=np.linspace(-1,1,200),**kwargs):
-    """Compute the DOS in a k-mesh by using the bandstructure function"""
+    """Compute the DOS in a k-mesh by using the bandstructure function,
+    if ibz is True only the irreducible wedge of the mesh is used"""
     ks = kmesh(h.dimensionality,nk=nk)
+    kw = np.ones(len(ks)) # weight of each kpoint
     if random: ks = [np.random.random(3) for k in ks]
+    elif ibz: # irreducible kpoints
+      from .klist import irreducible_kmesh
+      ks,kw = irreducible_kmesh(h,nk=nk)
+      kw = kw*len(kmesh(h.dimensionality,nk=nk)) # relative weights
     # compute band structure
     out = h.get_bands(kpath=ks,write=False,**kwargs) 
     if len(out)==2: w = None
     else: w = out[2]
-    ys = calculate_dos(out[1],energies,delta,w=w)/len(ks)
+    if ibz: # add the weights of the kpoints
+      wk = kw[np.round(out[0]).astype(int)] # weight of each energy
+      if w is None: w = wk
+      else: w = w*wk
+    ys = calculate_dos(out[1],energies,delta,w=w)/np.sum(kw)
     ys *= 1./np.pi # normalization of the Lorentzian
     write_dos(energies,ys) # write in file
     print("\nDOS finished")
@@ -254,22 +268,26 @@ def dos_kmesh(h,nk=10,delta=1e-3,random=False,
 
 def dos2d(h,use_kpm=False,scale=10.,nk=100,ntries=1,delta=None,
           ndos=2000,random=True,kpm_window=1.0,
-          window=None,energies=None,**kwargs):
+          window=None,energies=None,ibz=False,**kwargs):
   """ Calculate density of states of a 2d system"""
   if h.dimensionality!=2: raise # only for 2d
   ks = []
   from .klist import kmesh
   ks = kmesh(h.dimensionality,nk=nk)
+  weights = None # uniform weights
   if random:
     ks = [np.random.random(2) for ik in ks]
     print("Random k-mesh")
+  elif ibz and not use_kpm: # irreducible wedge of the mesh
+    from .klist import irreducible_kmesh
+    ks,weights = irreducible_kmesh(h,nk=nk)
   if not use_kpm: # conventional method
     hkgen = h.get_hk_gen() # get generator
     if delta is None: delta = 6./nk
 # conventiona algorithm
     (xs,ys) = calculate_dos_hkgen(hkgen,ks,ndos=ndos,delta=delta,
                           is_sparse=h.is_sparse,window=window,
-                          energies=energies,**kwargs) 
+                          energies=energies,weights=weights,**kwargs) 
     write_dos(xs,ys) # write in file
     return (xs,ys)
   else: # use the kpm
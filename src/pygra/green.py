@@ -3,6 +3,7 @@ import numpy as np
 import scipy.linalg as lg
 from . import multicell
 from . import algebra
+from collections import OrderedDict
 
 
 #try:
@@ -277,7 +278,7 @@ def gauss_inverse(m,i=0,j=0,test=False):
   """ Calculates the inverso of a block diagonal
       matrix """
   if test: # check whether the inversion worked 
-    return block_inverse(m,i=i,j=j)
+    return rgf_inverse(m,i=i,j=j)
   nb = len(m) # number of blocks
   ca = [None for ii in range(nb)]
   ua = [None for ii in range(nb-1)]
@@ -326,6 +327,102 @@ def block_inverse(m,i=0,j=0):
 
 
 
+def tridiagonal_blocks(m):
+  """Return the diagonal, upper and lower blocks of a block
+  tridiagonal matrix given as a list of lists, as dense arrays"""
+  nb = len(m) # number of blocks
+  def dense(mij,i,j):
+    if mij is None: # zero block
+      return np.zeros((m[i][i].shape[0],m[j][j].shape[1]),dtype=complex)
+    return np.array(algebra.todense(mij),dtype=complex)
+  ad = [dense(m[ii][ii],ii,ii) for ii in range(nb)] # diagonal
+  au = [dense(m[ii][ii+1],ii,ii+1) for ii in range(nb-1)] # upper
+  al = [dense(m[ii+1][ii],ii+1,ii) for ii in range(nb-1)] # lower
+  return ad,au,al
+
+
+
+def rgf_inverse(m,i=0,j=0):
+  """ Calculate a certain element of the inverse of a block tridiagonal
+  matrix with the recursive Green function method, without
+  building the full matrix"""
+  nb = len(m) # number of blocks
+  if i<0: i += nb 
+  if j<0: j += nb 
+  ad,au,al = tridiagonal_blocks(m) # get the blocks
+  if i<j: # reverse the order of the blocks
+    ad,au,al = ad[::-1],al[::-1],au[::-1]
+    i,j = nb-1-i,nb-1-j
+  # left connected Green function up to j-1
+  sl = ad[j]*0.0 # selfenergy from the left
+  if j>0:
+    gl = np.linalg.inv(ad[0])
+    for k in range(1,j): gl = np.linalg.inv(ad[k] - al[k-1]@gl@au[k-1])
+    sl = al[j-1]@gl@au[j-1]
+  # right connected Green functions down to j+1
+  grs = dict() # storage of the ones needed
+  sr = ad[j]*0.0 # selfenergy from the right
+  if j<nb-1:
+    gr = np.linalg.inv(ad[nb-1])
+    if nb-1<=i: grs[nb-1] = gr # store
+    for k in range(nb-2,j,-1):
+      gr = np.linalg.inv(ad[k] - au[k]@gr@al[k])
+      if k<=i: grs[k] = gr # store
+    sr = au[j]@gr@al[j]
+  g = np.linalg.inv(ad[j] - sl - sr) # diagonal element
+  for k in range(j+1,i+1): g = -grs[k]@al[k-1]@g # move down
+  return np.matrix(g)
+
+
+
+def rgf_gn1(ad,au,al):
+  """Element (N,1) of the inverse of a block tridiagonal matrix,
+  blocks can be stacks of matrices, e.g. for several energies"""
+  g = np.linalg.inv(ad[0]) # left connected Green function
+  q = g # product of the left connected Green functions
+  for k in range(1,len(ad)):
+    g = np.linalg.inv(ad[k] - al[k-1]@g@au[k-1]) # left connected
+    q = -g@al[k-1]@q
+  return q
+
+
+
+def rgf_diagonal(ad,au,al):
+  """Diagonal of the inverse of a block tridiagonal matrix,
+  blocks can be stacks of matrices, returns the diagonals of
+  each diagonal block"""
+  nb = len(ad) # number of blocks
+  gls = [np.linalg.inv(ad[0])] # left connected Green functions
+  for k in range(1,nb):
+    gls.append(np.linalg.inv(ad[k] - al[k-1]@gls[k-1]@au[k-1]))
+  g = gls[nb-1] # last full Green function
+  out = [np.diagonal(g,axis1=-2,axis2=-1)] # store diagonal
+  for k in range(nb-2,-1,-1): # backwards sweep
+    gl = gls[k]
+    g = gl + gl@au[k]@g@al[k]@gl
+    out.append(np.diagonal(g,axis1=-2,axis2=-1))
+    gls[k] = None # free memory
+  return out[::-1]
+
+
+
+def rgf_first_column(ad,au,al):
+  """Generator with the blocks (k,1) of the inverse of a block
+  tridiagonal matrix, blocks can be stacks of matrices"""
+  nb = len(ad) # number of blocks
+  grs = [None for k in range(nb)] # right connected Green functions
+  grs[nb-1] = np.linalg.inv(ad[nb-1])
+  for k in range(nb-2,-1,-1):
+    grs[k] = np.linalg.inv(ad[k] - au[k]@grs[k+1]@al[k])
+  g = grs[0] # first diagonal element
+  yield g
+  for k in range(1,nb):
+    g = -grs[k]@al[k-1]@g # move down
+    grs[k-1] = None # free memory
+    yield g
+
+
+
 def green_renormalization(intra,inter,energy=0.0,nite=None,
                             error=0.000001,info=False,delta=0.001,
                             use_fortran = use_fortran):
@@ -336,31 +433,102 @@ def green_renormalization(intra,inter,energy=0.0,nite=None,
     (ge,gb) = greenf90.renormalization(intra,inter,energy,error,delta)
     return np.matrix(gb),np.matrix(ge)
   else:
-    e = np.matrix(np.identity(intra.shape[0])) * (energy + 1j*delta)
-    ite = 0
-    alpha = inter.copy()
-    beta = inter.H.copy()
-    epsilon = intra.copy()
-    epsilon_s = intra.copy()
-    while True: # implementation of Eq 11
-      einv = (e - epsilon).I # inverse
-      epsilon_s = epsilon_s + alpha @ einv @ beta
-      epsilon = epsilon + alpha * einv @ beta + beta @ einv @ alpha
-      alpha = alpha @ einv @ alpha  # new alpha
-      beta = beta @ einv @ beta  # new beta
-      ite += 1
-      # stop conditions
-      if not nite is None:
-        if ite > nite:  break 
-      else:
-        if np.max(np.abs(alpha))<error and np.max(np.abs(beta))<error: break
-    if info:
-      print("Converged in ",ite,"iterations")
-    g_surf = (e - epsilon_s).I # surface green function
-    g_bulk = (e - epsilon).I  # bulk green function 
-    return g_bulk,g_surf
+    gb,gs = green_renormalization_multienergy(intra,inter,energies=[energy],
+                   delta=delta,nite=nite,info=info)
+    return np.matrix(gb[0]),np.matrix(gs[0])
+
+
+
+selfenergy_cache_size = 2e6 # matrix elements stored in the cache
+selfenergy_cache = OrderedDict() # LRU cache of lead Green functions
 
 
+def lead_fingerprint(intra,inter):
+  """Return a key identifying a semi-infinite lead, since intra and
+  inter are the k-dependent matrices, the kpoint is included"""
+  from hashlib import sha1
+  key = sha1(str(intra.shape).encode()) # initialize
+  key.update(intra.tobytes()) # onsite matrix
+  key.update(inter.tobytes()) # hopping matrix
+  return key.hexdigest()
+
+
+def clear_selfenergy_cache():
+  """Remove all the stored Green functions"""
+  selfenergy_cache.clear()
+
+
+def green_renormalization_multienergy(intra,inter,energies=[0.0],
+        delta=0.001,nite=None,info=False):
+  """Bulk and surface Green functions of a semi-infinite chain for a
+  whole grid of energies, all the energies are decimated at once
+  using stacked linear solves, and stored in an LRU cache holding
+  at most selfenergy_cache_size matrix elements.
+  Returns two arrays of shape (ne,n,n)"""
+  error = delta/100
+  intra = np.array(algebra.todense(intra),dtype=complex) # dense array
+  inter = np.array(algebra.todense(inter),dtype=complex) # dense array
+  energies = np.array(energies,dtype=float).reshape(-1) # energies
+  n,ne = intra.shape[0],len(energies)
+  gb = np.zeros((ne,n,n),dtype=complex) # bulk Green functions
+  gs = np.zeros((ne,n,n),dtype=complex) # surface Green functions
+  fp = lead_fingerprint(intra,inter) # fingerprint of the lead
+  keys = [(fp,e,delta,nite) for e in energies] # keys for the cache
+  todo = [] # energies to compute
+  for i in range(ne):
+    if keys[i] in selfenergy_cache: # already computed
+      selfenergy_cache.move_to_end(keys[i]) # most recently used
+      gb[i],gs[i] = selfenergy_cache[keys[i]]
+    else: todo.append(i)
+  todo = np.array(todo,dtype=int)
+  if len(todo)>0:
+    gb[todo],gs[todo] = decimation(intra,inter,energies[todo],delta,
+                                     error=error,nite=nite,info=info)
+  if selfenergy_cache_size>0: # store in the cache
+    nmax = algebra.batch_size(2*n*n,budget=selfenergy_cache_size) # entries
+    for i in todo:
+      selfenergy_cache[keys[i]] = (gb[i].copy(),gs[i].copy())
+    while len(selfenergy_cache)>nmax:
+      selfenergy_cache.popitem(last=False) # remove the oldest one
+  return gb,gs
+
+
+def decimation(intra,inter,energies,delta,error=1e-6,nite=None,info=False):
+  """Renormalization of a semi-infinite chain for several energies,
+  implementation of Eq 11 of J. Phys. F 15 (1985) 851-858 with stacked
+  matrices. Energies that converged are removed from the stack"""
+  n,ne = intra.shape[0],len(energies)
+  e = (energies + 1j*delta)[:,None,None]*np.identity(n)[None,:,:]
+  alpha = np.repeat(inter[None,:,:],ne,axis=0)
+  beta = np.repeat(algebra.dagger(inter)[None,:,:],ne,axis=0)
+  epsilon = np.repeat(intra[None,:,:],ne,axis=0)
+  epsilon_s = epsilon.copy()
+  active = np.arange(ne) # energies not converged yet
+  ite = 0
+  while len(active)>0: # implementation of Eq 11
+    a,b = alpha[active],beta[active]
+    # einv @ alpha and einv @ beta with a single stacked solve
+    x = np.linalg.solve(e[active] - epsilon[active],np.concatenate([a,b],axis=2))
+    ia,ib = x[:,:,0:n],x[:,:,n:2*n]
+    aib = a@ib
+    epsilon_s[active] += aib
+    epsilon[active] += aib + b@ia
+    alpha[active] = a@ia  # new alpha
+    beta[active] = b@ib  # new beta
+    ite += 1
+    # stop conditions
+    if not nite is None:
+      if ite > nite:  break
+    else:
+      err = np.maximum(np.max(np.abs(alpha[active]),axis=(1,2)),
+                       np.max(np.abs(beta[active]),axis=(1,2)))
+      active = active[err>=error] # remove converged energies
+  if info:
+    print("Converged in ",ite,"iterations")
+  g_surf = np.linalg.inv(e - epsilon_s) # surface green function
+  g_bulk = np.linalg.inv(e - epsilon)  # bulk green function
+  return g_bulk,g_surf
+
 
 def bloch_selfenergy(h,nk=100,energy = 0.0, delta = 0.01,mode="full",
                          error=0.00001):
@@ -585,18 +753,28 @@ def interface_multienergy(h1,h2,k=[0.0,0.,0.],energies=[0.0],delta=0.01,
 
 
 
-def surface_multienergy(h1,k=[0.0,0.,0.],energies=[0.0],reverse=True,**kwargs):
+def surface_multienergy(h1,k=[0.0,0.,0.],energies=[0.0],reverse=True,
+        delta=0.01,hs=None,**kwargs):
   """Get the Green function of an interface"""
-  from scipy.sparse import csc_matrix as csc
-  from scipy.sparse import bmat
-  fun1 = green_kchain_evaluator(h1,k=k,
-                   only_bulk=False,reverse=reverse,
-                   **kwargs) # surface green function 
-  out = [] # output
-  for energy in energies: # loop
-    gs1,sf1 = fun1(energy)
-    out.append([sf1,gs1])
-  return out # return output
+  (ons,hop) = get1dhamiltonian(h1,k,reverse=reverse) # get 1D Hamiltonian
+  gb,gs = green_renormalization_multienergy(ons,hop,energies=energies,
+                                              delta=delta) # all energies
+  if hs is not None: # surface matrix provided
+    if callable(hs): ons2 = ons + hs(k)
+    else: ons2 = ons + hs
+    gs = surface_dyson_multienergy(ons2,hop,gs,energies,delta)
+  return [[np.matrix(sf1),np.matrix(gs1)] for (sf1,gs1) in zip(gs,gb)]
+
+
+
+def surface_dyson_multienergy(ons,hop,gs,energies,delta):
+  """Replace the surface layer of a semi-infinite chain, for
+  a stack of surface Green functions"""
+  ons = np.array(algebra.todense(ons),dtype=complex)
+  hop = np.array(algebra.todense(hop),dtype=complex)
+  ez = (np.array(energies)+1j*delta)[:,None,None]*np.identity(ons.shape[0])
+  sigma = hop@gs@algebra.dagger(hop) # selfenergies
+  return np.linalg.inv(ez - ons - sigma) # Dyson equation
 
 
 
@@ -90,6 +90,12 @@ class hamiltonian():
     """ Generate kdependent hamiltonian"""
     if self.is_multicell: return multicell.hk_gen(self) # for multicell
     else: return hk_gen(self) # for normal cells
+  def get_hk_batch(self,ks):
+    """Return the Bloch Hamiltonians for many kpoints at once"""
+    return multicell.get_hk_batch(self,ks)
+  def get_eigh_batch(self,ks,**kwargs):
+    """Diagonalize the Bloch Hamiltonians for many kpoints at once"""
+    return multicell.eigh_batch(self,ks,**kwargs)
   def get_ldos(self,**kwargs):
       from . import ldos
       return ldos.ldos(self,**kwargs)
@@ -377,12 +383,12 @@ class hamiltonian():
       """Add a crystal field term to the Hamiltonian"""
       from . import crystalfield
       crystalfield.hartree(self,v=v) 
-  def add_peierls(self,mag_field,new=False):
+  def add_peierls(self,mag_field,**kwargs):
       """
       Add magnetic field
       """
       from .peierls import add_peierls
-      add_peierls(self,mag_field=mag_field,new=new)
+      add_peierls(self,mag_field=mag_field,**kwargs)
   def add_inplane_bfield(self,**kwargs):
       """Add in-plane magnetic field"""
       from .peierls import add_inplane_bfield
@@ -145,6 +145,10 @@ class heterostructure():
       f = lambda k: self.generate(k).didv(energy=energy,delta=delta)
       return np.mean([f(x) for x in np.linspace(0.,1.,nk,endpoint=False)])
     else: raise
+  def landauer_rgf(self,energies=[0.0],delta=None):
+    """ Return the Landauer transmission for several energies"""
+    if delta is None: delta = self.delta # set the own delta
+    return landauer_rgf(self,energies=energies,delta=delta)
   def block2full(self,sparse=False):
     """Put in full form"""
     return block2full(self,sparse=sparse)
@@ -1037,6 +1041,84 @@ def effective_tridiagonal_hamiltonian(intra,selfl,selfr,
 
 
 
+def get_selfenergies_multienergy(hetero,energies,delta=0.0001):
+   """Left and right selfenergies for a set of energies, as
+   arrays of shape (ne,n,n)"""
+   energies = np.array(energies).reshape(-1) # array
+   if hetero.interpolated_selfenergy: # use the interpolation
+     selfl = np.array([hetero.get_selfenergy(e,lead=0) for e in energies])
+     selfr = np.array([hetero.get_selfenergy(e,lead=1) for e in energies])
+     return selfl,selfr
+   gb,gl = green.green_renormalization_multienergy(hetero.left_intra,
+              hetero.left_inter,energies=energies,delta=delta)
+   gb,gr = green.green_renormalization_multienergy(hetero.right_intra,
+              hetero.right_inter,energies=energies,delta=delta)
+   col = np.array(hetero.left_coupling*hetero.scale_lc) # left coupling
+   cor = np.array(hetero.right_coupling*hetero.scale_rc) # right coupling
+   selfl = col@gl@np.conjugate(col.T) # left selfenergy
+   selfr = cor@gr@np.conjugate(cor.T) # right selfenergy
+   return selfl,selfr
+
+
+def rgf_blocks(hetero,energies,delta=0.0001):
+   """Blocks of E - H - Sigma of the central part for a set of
+   energies, the diagonal blocks are arrays of shape (ne,n,n)"""
+   energies = np.array(energies).reshape(-1) # array
+   if hetero.block_diagonal: intra = hetero.central_intra
+   else: intra = [[hetero.central_intra]] # a single block
+   hd,hu,hl = green.tridiagonal_blocks(intra) # blocks of the Hamiltonian
+   selfl,selfr = get_selfenergies_multienergy(hetero,energies,delta=delta)
+   ez = (energies + 1j*delta)[:,None,None] # complex energies
+   ad = [ez*np.identity(m.shape[0])[None,:,:] - m for m in hd] # E - H
+   ad[0] = ad[0] - selfl # left selfenergy
+   ad[-1] = ad[-1] - selfr # right selfenergy
+   return ad,[-m for m in hu],[-m for m in hl],selfl,selfr
+
+
+def landauer_rgf(hetero,energies=[0.0],delta=0.0001):
+   """ Calculates transmission using Landauer formula and the recursive
+   Green function method, for a set of energies at once"""
+   ad,au,al,selfl,selfr = rgf_blocks(hetero,energies,delta=delta)
+   gammal = 1j*(selfl - np.conjugate(np.transpose(selfl,(0,2,1))))
+   gammar = 1j*(selfr - np.conjugate(np.transpose(selfr,(0,2,1))))
+   gcn1 = green.rgf_gn1(ad,au,al) # element N,1 for all the energies
+   gcn1H = np.conjugate(np.transpose(gcn1,(0,2,1)))
+   return np.trace(gammar@gcn1@gammal@gcn1H,axis1=1,axis2=2).real
+
+
+def central_ldos_rgf(hetero,energies=[0.0],delta=0.0001):
+   """Local density of states of the central part with the recursive
+   Green function method, returns an array (ne,norbitals)"""
+   ad,au,al,selfl,selfr = rgf_blocks(hetero,energies,delta=delta)
+   ds = green.rgf_diagonal(ad,au,al) # diagonal of the Green function
+   return -np.concatenate(ds,axis=1).imag
+
+
+def bond_currents_rgf(hetero,energies=[0.0],delta=0.0001):
+   """Bond currents in the central part for electrons injected from the
+   left lead, summed over the energies (e.g. the bias window).
+   Returns the currents inside each block and between consecutive
+   blocks, with j_ab = -2 Im(H_ab A_ba) the current flowing from a to b"""
+   ad,au,al,selfl,selfr = rgf_blocks(hetero,energies,delta=delta)
+   gammal = 1j*(selfl - np.conjugate(np.transpose(selfl,(0,2,1))))
+   if hetero.block_diagonal: intra = hetero.central_intra
+   else: intra = [[hetero.central_intra]] # a single block
+   hd,hu,hl = green.tridiagonal_blocks(intra) # blocks of the Hamiltonian
+   def dagger(m): return np.conjugate(np.transpose(m,(0,2,1)))
+   jintra,jinter = [],[] # currents inside and between blocks
+   gm = None # previous block of the column
+   for (k,g) in enumerate(green.rgf_first_column(ad,au,al)):
+     gg = g@gammal # G_k1 Gamma_L
+     akk = gg@dagger(g) # spectral function injected from the left
+     jintra.append(-2*np.sum((hd[k]*np.transpose(akk,(0,2,1))).imag,axis=0))
+     if gm is not None: # current from the previous block
+       akm = gg@dagger(gm) # block (k,k-1) of the spectral function
+       jm = (hu[k-1]*np.transpose(akm,(0,2,1))).imag
+       jinter.append(-2*np.sum(jm,axis=0))
+     gm = g # store
+   return jintra,jinter
+
+
 def build(h1,h2,central=None,lc=1.0,rc=1.0,**kwargs):
   """Create a heterostructure, works also for 2d"""
   if central is None: central = [h1,h2] # list
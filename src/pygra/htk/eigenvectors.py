@@ -24,10 +24,14 @@ def get_eigenvectors(h,nk=10,kpoints=False,k=None,sparse=False,numw=None):
         fk = lambda k: slg.eigsh(csc(f(k)),k=numw,which="LM",sigma=0.0,tol=1e-5)
         vvs = parallel.pcall(fk,kp)
     else: # dense Hamiltonians
-      if parallel.cores>1: # in parallel
-#        vvs = parallel.multieigh([f(k) for k in kp]) # multidiagonalization
+      if parallel.cores>1 and not algebra.accelerate: # in parallel
+        vvs = list(zip(*parallel.eigh_batch(h,kp))) # shared memory
+      elif parallel.cores>1: # in parallel
         vvs = parallel.pcall(lambda k: algebra.eigh(f(k)),kp)
-      else: vvs = [algebra.eigh(f(k)) for k in kp] # 
+      elif algebra.accelerate: vvs = [algebra.eigh(f(k)) for k in kp] #
+      else: # batched diagonalization
+        from ..multicell import eigh_batch
+        vvs = list(zip(*eigh_batch(h,kp))) # eigenvalues and eigenvectors
     nume = sum([len(v[0]) for v in vvs]) # number of eigenvalues calculated
     eigvecs = np.zeros((nume,h.intra.shape[0]),dtype=np.complex) # eigenvectors
     eigvals = np.zeros(nume) # eigenvalues
@@ -64,3 +68,17 @@ def get_eigenvectors(h,nk=10,kpoints=False,k=None,sparse=False,numw=None):
     raise
 
 
+def get_bloch_eigenvectors(h,ks):
+  """Eigenvalues (nk,n) and Bloch eigenvectors (nk,n,n), as columns,
+  of a list of kpoints, diagonalized in batches"""
+  ks = np.array(ks) # kpoints
+  if h.dimensionality==0: # only one Hamiltonian
+    m = h.intra.todense() if hasattr(h.intra,"todense") else h.intra
+    m = np.array(m) # dense array
+    if not np.any(np.imag(m)): m = np.real(m) # real eigenvectors
+    (e,v) = np.linalg.eigh(m)
+    return (np.array([e for k in ks]),np.array([v for k in ks]))
+  return parallel.eigh_batch(h,ks) # shared memory if parallel
+
+
+
@@ -88,9 +88,10 @@ def write_surface_1d(h,energies=None,delta=None,
   if delta is None: delta = (max(energies)-min(energies))/len(energies)
   h = h.get_no_multicell()
   fo  = open("SURFACE_DOS.OUT","w") # open file
-  for energy in energies:
-      gs,sf = green.green_renormalization(h.intra,h.inter,
-              energy=energy,delta=delta) # surface green function 
+  gbs,sfs = green.green_renormalization_multienergy(h.intra,h.inter,
+              energies=energies,delta=delta) # surface green functions
+  for (energy,gs,sf) in zip(energies,gbs,sfs):
+      gs,sf = np.matrix(gs),np.matrix(sf) # convert
       if operator is None: op = np.identity(h.intra.shape[0]) # identity matrix
       elif callable(operator): op = callable(op)
       else: op = operator # assume a matrix
@@ -105,24 +106,45 @@ def write_surface_1d(h,energies=None,delta=None,
 
 
 def write_surface_2d(h,energies=None,klist=None,delta=0.01,
-                         operator=None,hs=None):
-  bout = [] # empty list, bulk
-  sout = [] # empty list, surface
+                         operator=None,hs=None,adaptive=False,levels=3):
+  """Write the bulk and surface spectral functions of a 2d system.
+  With adaptive=True the kpoints are refined only where the spectral
+  functions change, starting from the kpoints in klist"""
   if klist is None: klist = np.linspace(-.5,.5,50)
   if energies is None: energies = np.linspace(-.5,.5,50)
-  fo  = open("KDOS.OUT","w") # open file
-  for k in klist:
+  if operator is None: op = np.identity(h.intra.shape[0]) # identity matrix
+  else: op = operator # a matrix, or a function of the kpoint
+  def kdos_k(k): # surface and bulk spectral functions for a kpoint
     print("Doing k-point",k)
-    for energy in energies:
-      gs,sf = green.green_kchain(h,k=k,energy=energy,delta=delta,
-                       only_bulk=False,hs=hs) # surface green function 
-      if operator is None: op = np.identity(h.intra.shape[0]) # identity matrix
-      elif callable(operator): op = callable(op)
-      else: op = operator # assume a matrix
-      db = -(gs*op).trace()[0,0].imag # bulk
-      ds = -(sf*op).trace()[0,0].imag # surface
-      fo.write(str(k)+"   "+str(energy)+"   "+str(ds)+"   "+str(db)+"\n")
-      fo.flush()
+    opk = op(k) if callable(op) else op # operator in this kpoint
+    (ons,hop) = green.get1dhamiltonian(h,k) # get 1D Hamiltonian
+    gbs,sfs = green.green_renormalization_multienergy(ons,hop,
+                       energies=energies,delta=delta) # all the energies
+    if hs is not None: # surface matrix provided
+      if callable(hs): ons2 = hs(k)
+      else: ons2 = hs
+      sfs = green.surface_dyson_multienergy(ons2,hop,sfs,energies,delta)
+    ds,db = [],[]
+    for (gs,sf) in zip(gbs,sfs):
+      gs,sf = np.matrix(gs),np.matrix(sf) # convert
+      db.append(-(gs*opk).trace()[0,0].imag) # bulk
+      ds.append(-(sf*opk).trace()[0,0].imag) # surface
+    return np.array(ds),np.array(db)
+  if adaptive: # refine the kpoints where the spectral function changes
+    from .klist import adaptive_kmesh
+    def f(ks): return [np.concatenate(kdos_k([k[0],0.,0.])) for k in ks]
+    bounds = [[np.min(klist),np.max(klist)]] # interval
+    nk = max([1,(len(klist)-1)//2**levels]) # initial grid
+    ks,out = adaptive_kmesh(f,bounds=bounds,nk=nk,levels=levels)
+    ks = ks[:,0] # kpoints
+    out = [(o[0:len(energies)],o[len(energies):]) for o in out]
+  else:
+    ks = klist
+    out = [kdos_k(k) for k in klist]
+  fo  = open("KDOS.OUT","w") # open file
+  for (k,(ds,db)) in zip(ks,out):
+    for (energy,d1,d2) in zip(energies,ds,db):
+      fo.write(str(k)+"   "+str(energy)+"   "+str(d1)+"   "+str(d2)+"\n")
   fo.close()
 
 
@@ -1,7 +1,9 @@
 from __future__ import print_function
 import numpy as np
-from scipy.sparse import csc_matrix,bmat
+from scipy.sparse import csc_matrix,bmat,issparse
+from collections import OrderedDict
 import time
+from . import algebra
 
 def timeit(method):
     def timed(*args, **kw):
@@ -64,59 +66,145 @@ def floquet_tauz(m,n=20):
 
 
 
-def current(data,voltage,n=3):
-  """Apply the formula from San Jose NJP"""
+cache_size = 2e6 # matrix elements stored in each cache
+
+
+def cached_selfenergy(selfgen,size=None):
+  """Return a function that stores the selfenergies already computed,
+  so harmonics sharing the same energy e+m*omega are computed once.
+  At most size matrix elements are stored"""
+  if size is None: size = cache_size
+  cache = OrderedDict() # LRU cache
+  def f(e):
+    key = np.round(e,10) # energy as key
+    if key in cache:
+      cache.move_to_end(key) # most recently used
+      return cache[key]
+    out = np.array(algebra.todense(selfgen(e)),dtype=complex) # compute
+    cache[key] = out
+    if len(cache)>algebra.batch_size(out.size,budget=size):
+      cache.popitem(last=False) # remove the oldest one
+    return out
+  return f
+
+
+def less_selfenergy(s,e):
+  """Selfenergy with the < symbol, at zero temperature"""
+  if e<0.: return s*0.
+  else: return -(s-np.conjugate(s.T))
+
+
+def floquet_blocks(ham,self_l,self_r,delta=0.01,size=None):
+  """Return a function with the blocks entering the current at a
+  Floquet energy e+m*omega: the diagonal block of the inverse Green
+  function, the left selfenergy, the < selfenergies and the sites of
+  the leads. They only depend on e+m*omega, so they are stored and
+  reused when the number of harmonics is increased, keeping at most
+  size matrix elements"""
+  if size is None: size = cache_size
+  ham = np.asarray(algebra.todense(ham)) # dense array
+  nmax = algebra.batch_size(4*ham.size,budget=size) # stored energies
+  iden = np.identity(ham.shape[0],dtype=complex) # identity matrix
+  cache = OrderedDict() # LRU cache
+  def f(eb):
+    key = np.round(eb,10) # energy as key
+    if key in cache:
+      cache.move_to_end(key) # most recently used
+      return cache[key]
+    sl,sr = self_l(eb),self_r(eb) # selfenergies
+    d = (eb+1j*delta)*iden - ham - sl - sr # diagonal block
+    sll = less_selfenergy(sl,eb) # left < selfenergy
+    sless = less_selfenergy(sl+sr,eb) # total < selfenergy
+    pl = np.nonzero(np.abs(sl)>0.)[0] # sites of the left lead
+    p = np.nonzero((np.abs(sl)+np.abs(sr))>0.)[0] # sites of both leads
+    out = (d,sl,sll,sless,pl,p)
+    cache[key] = out
+    if len(cache)>nmax: cache.popitem(last=False) # remove the oldest one
+    return out
+  return f
+
+
+def floquet_current_density(e,ham,trl,omega,self_l,self_r,tauz,
+                              n=3,delta=0.01,blocks=None):
+  """Current density at energy e, using the block tridiagonal structure
+  of the Floquet Hamiltonian in the harmonic index. The blocks of the
+  Green function are obtained by recursion from both ends, and only
+  the rows in the sites coupled to the left lead are propagated.
+  blocks is an optional floquet_blocks function shared between calls"""
+  trl = np.asarray(algebra.todense(trl)) # dense arrays
+  tauz = np.asarray(algebra.todense(tauz))
+  if blocks is None: blocks = floquet_blocks(ham,self_l,self_r,delta=delta)
+  nh = 2*n+1 # number of harmonics
+  ebar = [e+i*omega for i in range(-n,n+1)] # floquet energies
+  bs = [blocks(eb) for eb in ebar] # stored blocks of each harmonic
+  ds,sl,sll,sless = [[b[j] for b in bs] for j in range(4)]
+  up,dn = -trl,-np.conjugate(trl.T) # couplings between harmonics
+  inv = np.linalg.inv # inverse
+  gl,gr = [None]*nh,[None]*nh # left and right connected
+  gl[0],gr[nh-1] = inv(ds[0]),inv(ds[nh-1])
+  for i in range(1,nh): gl[i] = inv(ds[i] - dn@gl[i-1]@up)
+  for i in range(nh-2,-1,-1): gr[i] = inv(ds[i] - up@gr[i+1]@dn)
+  pl = np.unique(np.concatenate([b[4] for b in bs])) # left lead sites
+  p = np.unique(np.concatenate([b[5] for b in bs])) # lead sites
+  if len(pl)==0: return 0.0
+  ugr = [up@g for g in gr] # for the column recursion to the right
+  dgl = [dn@g for g in gl] # for the column recursion to the left
+  lk = [np.any(s) for s in sless] # harmonics with less selfenergy
+  ix = np.ix_ # submatrix
+  out = 0.0j
+  for i in range(nh): # loop over harmonics
+    d = ds[i].copy() # dressed diagonal block
+    if i>0: d -= dn@gl[i-1]@up
+    if i<nh-1: d -= up@gr[i+1]@dn
+    gii = inv(d)[pl,:] # rows of the lead sites
+    ta = (np.conjugate(sl[i].T)@tauz)[ix(pl,pl)] # selfenergy times tauz
+    out += np.trace(gii[:,pl]@(sll[i]@tauz)[ix(pl,pl)]) # G sigma<
+    def add(g,k): # contribution of G< = G sigma< G^dagger
+      if not lk[k]: return 0.0
+      gp = g[:,p] # columns of the lead sites
+      return np.trace(gp@sless[k][ix(p,p)]@np.conjugate(gp.T)@ta)
+    out += add(gii,i)
+    g = gii
+    for k in range(i+1,nh): # G_ik with k>i
+      g = -g@ugr[k]
+      out += add(g,k)
+    g = gii
+    for k in range(i-1,-1,-1): # G_ik with k<i
+      g = -g@dgl[k]
+      out += add(g,k)
+  return out.real
+
+
+def converged_current_density(e,ham,trl,omega,self_l,self_r,tauz,n=3,
+                                delta=0.01,tol=0.01,nmax=200):
+  """Current density increasing the number of harmonics until
+  converged, returns the current density and the harmonics used.
+  The diagonal blocks and selfenergies of each harmonic are reused
+  between truncations, the connected Green functions are not"""
+  blocks = floquet_blocks(ham,self_l,self_r,delta=delta) # stored blocks
+  r0 = -1000 # initial value
+  while True:
+    r1 = floquet_current_density(e,ham,trl,omega,self_l,self_r,tauz,n=n,
+                                   delta=delta,blocks=blocks)
+    dr = np.abs(r0-r1)/(np.abs(r0)+np.abs(r1)+1e-30) # difference
+    if dr<tol or n>=nmax: return r1,n
+    r0 = r1 ; n += 1 # next iteration
+
+
+def current(data,voltage,n=3,ne=60):
+  """Apply the formula from San Jose NJP. The selfenergies are cached,
+  so harmonics sharing the same energy are computed only once"""
   omega = voltage # frequency
-  self_l = data.self_l  # self energy, callable
-  self_r = data.self_r  # self energy, callable
-  ham = data.ham  # Hamiltonian, matrix
-  delta = data.delta  # Hamiltonian, matrix
-  tfreq = data.tfreq # Hamiltonian, matrix
-  tauz = data.tauz  # Hamiltonian, matrix
-  def intfun(e,n=n): # function to integrate
-    ftauz = floquet_tauz(tauz,n=n)
-    fh = floquet_hamiltonian(ham,tfreq,omega,n=n) # floquet hamiltonian
-# identity matrix
-    iden = np.matrix(np.identity(fh.shape[0],dtype=np.complex)) 
-    sr = floquet_selfenergy(self_r,e,omega,n=n,less=False) 
-    sl = floquet_selfenergy(self_l,e,omega,n=n,less=False) 
-    sR_less = floquet_selfenergy(self_r,e,omega,n=n,less=True) 
-    sL_less = floquet_selfenergy(self_l,e,omega,n=n,less=True) 
-    gr = (iden*(e+1j*delta) - fh - sr - sl).I # retarded green function
-    gless = gr*(sL_less+sR_less)*gr.H # less green function
-    val = (gr*sL_less + gless*sl.H)*ftauz
-    curr = val.trace()[0,0] # add contribution
-    return curr.real # return real part
-  nglobal = n # set the global n 
-  # function to decide the n to use afterwards
-  def deciden(e,n=n,r0=-1000):
-    r1 = intfun(e,n) # call the function
-    dr = np.abs(r0-r1)/(np.abs(r0)+np.abs(r1)) # difference
-    if dr<0.01: 
-      return n
-    else: return deciden(e,n=n+1,r0=r1) # recall
-  nnew = deciden(voltage/2.,n=n) # update n
-  def convfun(e,n=nnew,r0=-1000):
-    """Converged function"""
-    r1 = intfun(e,n) # call the function
-    dr = np.abs(r0-r1)/(np.abs(r0)+np.abs(r1)) # difference
-    if dr<0.01: 
-      print("Converged with ",n,r1)
-      return r1
-    else: return convfun(e,n=n+1,r0=r1) # recall
-  print(convfun(0.2,n=4))
-#  exit()
-  from scipy.integrate import quad
-  xs = np.linspace(0.,omega,60) # interval
-  ys = [convfun(x) for x in xs] # integrand
-#  from parallel import pcall
-#  ys = pcall(intfun,xs,cores=5) # return ys
-  np.savetxt("TEST_"+str(voltage)+".OUT",np.matrix([xs,ys]).T)
+  self_l = cached_selfenergy(data.self_l) # self energy, callable
+  self_r = cached_selfenergy(data.self_r) # self energy, callable
+  def convfun(e,n): # converged current density
+    return converged_current_density(e,data.ham,data.tfreq,omega,
+              self_l,self_r,data.tauz,n=n,delta=data.delta)
+  r,nnew = convfun(voltage/2.,n) # decide the number of harmonics
+  xs = np.linspace(0.,omega,ne) # interval
+  ys = [convfun(x,nnew)[0] for x in xs] # integrand
+  np.savetxt("TEST_"+str(voltage)+".OUT",np.array([xs,ys]).T)
   return np.trapz(ys,x=xs)
-#  return np.sum(ys)/20
-  curr,err = quad(convfun,0.0,omega,limit=10,epsrel=0.01)
-  print(curr,err)
-  return curr.real
 
 
 
@@ -3,6 +3,7 @@
 import numpy as np
 import scipy.linalg as lg
 from . import geometry
+from . import algebra
 
 
 def get_klist(g,ns,nk=100):
@@ -284,3 +285,122 @@ def kmesh(dimensionality,nk=10):
 
 
 
+
+
+def lattice_operations(g,tol=1e-4):
+  """Return the point group operations of the geometry, as integer
+  matrices M acting on the fractional coordinates of the positions,
+  f -> f M, and leaving the set of sites invariant"""
+  import itertools
+  dim = g.dimensionality
+  A = np.array([g.a1,g.a2,g.a3]) # lattice vectors as rows
+  G = A@A.T # metric of the lattice
+  fs = np.array(g.r)@lg.inv(A) # fractional coordinates
+  def key(f): # wrap in the unit cell and discretize
+    f = f.copy() ; f[:,0:dim] = f[:,0:dim]%1.0
+    f = np.round(f/tol).astype(int) ; f[:,0:dim] = f[:,0:dim]%int(round(1./tol))
+    return set(map(tuple,f))
+  sites = key(fs) # set of sites
+  ops = [] # list of operations
+  for m in itertools.product([-1,0,1],repeat=dim*dim): # candidates
+    M = np.identity(3,dtype=int) ; M[0:dim,0:dim] = np.reshape(m,(dim,dim))
+    if np.max(np.abs(M@G@M.T-G))>tol: continue # not an isometry
+    fm = fs@M # transformed positions
+    for t in fs - fm[0]: # global shifts mapping site 0 to each site
+      t[dim:] = 0.0 # only shifts in the periodic directions
+      if key(fm+t)==sites: # the geometry is invariant
+        ops.append(M) ; break
+  return ops
+
+
+def irreducible_kmesh(h,nk=10,time_reversal=True,ops=None,check=True):
+  """Return the kpoints of the irreducible wedge of a uniform mesh and
+  their weights (summing to one). The operations are detected from
+  the geometry, and if check is True only those leaving the spectrum
+  of the Hamiltonian invariant are kept"""
+  dim = h.dimensionality
+  if dim==0 or nk==1: return np.zeros((1,3)),np.ones(1)
+  if ops is None: ops = lattice_operations(h.geometry) # operations
+  ms = [np.round(M).astype(int)[0:dim,0:dim] for M in ops] # k -> k M^T
+  if time_reversal: ms = ms + [-M for M in ms] # add k -> -k
+  if check: # check that the spectrum is invariant
+    hkgen = h.get_hk_gen() # Hamiltonian generator
+    kr = np.random.random((3,3)) # random kpoints
+    ev = lambda k: np.linalg.eigvalsh(algebra.todense(hkgen(k))) # spectrum
+    es = [ev(k) for k in kr] # eigenvalues
+    def invariant(M):
+      for (k,e) in zip(kr,es):
+        k2 = k.copy() ; k2[0:dim] = M@k[0:dim] # transformed kpoint
+        if np.max(np.abs(ev(k2)-e))>1e-6:
+          return False
+      return True
+    ms = [M for M in ms if invariant(M)] # retain the good ones
+  ns = np.array(list(np.ndindex(*[nk for i in range(dim)]))) # indexes
+  base = nk**np.arange(dim)[::-1] # to linear index
+  inds = np.min([((ns@M.T)%nk)@base for M in ms]+[ns@base],axis=0) 
+  reps,ws = np.unique(inds,return_counts=True) # representatives
+  kp = np.zeros((len(reps),3)) # kpoints
+  kp[:,0:dim] = ns[reps]/nk # fractional coordinates
+  return kp,ws/len(ns) # kpoints and weights
+
+
+
+def adaptive_kmesh(f,bounds=[[-1.,1.],[-1.,1.]],nk=16,levels=4,
+                     wfrac=0.1,gfrac=0.1,nmax=None):
+    """Adaptive sampling of a function in a 1d or 2d box, using a
+    binary/quad tree. It starts from a coarse grid of nk cells per
+    direction, and only the cells where the function or its variation
+    are large (relative to the maximum) are subdivided. f takes an
+    array of points (N,d) and returns (N,) or (N,m) values.
+    Returns the scattered points (N,d) and the values"""
+    bounds = np.array(bounds,dtype=float) # box
+    d = len(bounds) # dimension
+    ntot = nk*2**levels # divisions of the finest grid
+    step = (bounds[:,1]-bounds[:,0])/ntot # finest step
+    vals = dict() # indicator at the points of the finest grid
+    data = dict() # values of the function
+    corners = np.array(np.meshgrid(*[[0,1] for i in range(d)],
+                         indexing="ij")).reshape((d,-1)).T # unit corners
+    s = 2**levels # size of the initial cells
+    cells = [np.array(c)*s for c in np.ndindex(*[nk for i in range(d)])]
+    for level in range(levels+1):
+      pts = [tuple(c + s*corners[i]) for c in cells 
+               for i in range(len(corners))] # corners of the cells
+      if s>1: pts += [tuple(c + s//2) for c in cells] # and centers
+      new = list(set([p for p in pts if p not in vals])) # to compute
+      if nmax is not None and len(vals)+len(new)>nmax: break # too many
+      if len(new)>0:
+        fs = f(bounds[:,0] + np.array(new)*step) # evaluate all at once
+        for (p,v) in zip(new,fs): 
+          data[p] = v ; vals[p] = np.max(np.abs(v)) # store
+      if s==1: break # finest level reached
+      vmax = max(vals.values()) # maximum value
+      vmin = min(vals.values()) # minimum value
+      refine = [] # cells to refine
+      for c in cells:
+        vs = [vals[tuple(c + s*ci)] for ci in corners]
+        vs.append(vals[tuple(c + s//2)]) # center
+        if max(vs)>wfrac*vmax or max(vs)-min(vs)>gfrac*(vmax-vmin):
+          refine.append(c)
+      s = s//2 # new size
+      cells = [c + s*ci for c in refine for ci in corners] # children
+      if len(cells)==0: break
+    ps = sorted(vals.keys()) # all the points
+    ks = bounds[:,0] + np.array(ps)*step # coordinates
+    return ks,np.array([data[p] for p in ps])
+
+
+
+def interpolate_kmap(ks,vs,nk=100,bounds=None):
+    """Interpolate scattered 2d data in a uniform grid, returns
+    the x, y and values of the grid as flat arrays"""
+    from scipy.interpolate import griddata
+    ks = np.array(ks)[:,0:2] # points
+    if bounds is None: 
+      bounds = [[np.min(ks[:,0]),np.max(ks[:,0])],
+                [np.min(ks[:,1]),np.max(ks[:,1])]]
+    xs = np.linspace(bounds[0][0],bounds[0][1],nk) # x grid
+    ys = np.linspace(bounds[1][0],bounds[1][1],nk) # y grid
+    xx,yy = np.meshgrid(xs,ys,indexing="ij") # grid
+    zz = griddata(ks,vs,(xx,yy),method="linear") # interpolate
+    return xx.reshape(-1),yy.reshape(-1),zz.reshape(-1)
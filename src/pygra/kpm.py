@@ -3,7 +3,7 @@ from __future__ import print_function,division
 import scipy.sparse.linalg as lg
 from scipy.sparse import csc_matrix as csc
 import numpy.random as rand
-from scipy.sparse import coo_matrix,csc_matrix,bmat
+from scipy.sparse import coo_matrix,csc_matrix,csr_matrix,bmat
 import numpy as np
 from scipy.signal import hilbert
 from . import algebra
@@ -16,6 +16,11 @@ except:
   use_fortran = False # use python routines
   print("FORTRAN library not present, using default python one")
 
+try: # in place sparse times dense products
+  from scipy.sparse import _sparsetools
+  use_sparsetools = True
+except: use_sparsetools = False
+
 
 
 
@@ -86,6 +91,122 @@ def python_kpm_moments_clear(v,m,n=100):
 
 
 
+def spmm_add(m,x,y):
+  """Perform y += m@x in place, m is a csr matrix and x,y
+  are C-ordered arrays with the vectors as columns"""
+  if use_sparsetools:
+    _sparsetools.csr_matvecs(m.shape[0],m.shape[1],x.shape[1],m.indptr,
+                               m.indices,m.data,x.ravel(),y.ravel())
+  else: y += m@x
+
+
+def kpm_moments_block(vs,m,n=100,A=None):
+  """Chebychev moments summed over a block of vectors, stored
+  as the columns of vs. All the vectors are advanced at once, so each
+  step of the recursion is a single sparse times dense product.
+  Without operator, 2n moments are returned using the
+  mu_2n and mu_2n+1 identities, otherwise n moments of A"""
+  m = csr_matrix(m,dtype=complex) # sparse matrix
+  m2 = m*2. # matrix entering the recursion
+  vs = np.array(vs,dtype=complex) # copy
+  if len(vs.shape)==1: vs = vs.reshape((len(vs),1)) # single vector
+  am = np.ascontiguousarray(vs) # vector number 0
+  a = np.zeros(am.shape,dtype=complex) # vector number 1
+  spmm_add(m,am,a) # a = m@am
+  if A is None:
+    mus = np.zeros(2*n,dtype=complex) # empty arrray for the moments
+    mu0 = np.vdot(am,am) # mu0
+    mu1 = np.vdot(a,am) # mu1
+    mus[0],mus[1] = mu0,mu1
+    for i in range(1,n):
+      am *= -1. # the buffer of the previous vector is reused
+      spmm_add(m2,a,am) # recursion relation, ap = 2*m@a - am
+      ap = am # rename
+      mus[2*i] = 2.*np.vdot(a,a) - mu0
+      mus[2*i+1] = 2.*np.vdot(ap,a) - mu1
+      am,a = a,ap # new variables
+  else:
+    Av = np.conjugate(np.asarray(A.T@np.conjugate(vs))) # A^dagger |v>
+    mus = np.zeros(n,dtype=complex) # empty arrray for the moments
+    mus[0] = np.vdot(Av,am) # mu0
+    mus[1] = np.vdot(Av,a) # mu1
+    for i in range(2,n):
+      am *= -1. # the buffer of the previous vector is reused
+      spmm_add(m2,a,am) # recursion relation
+      mus[i] = np.vdot(Av,am)
+      am,a = a,am # new variables
+  return mus
+
+
+
+
+def spectral_bounds(m):
+  """Bounds of the spectrum of a Hermitian matrix from the
+  Gershgorin circles, only needs the non zero elements"""
+  m = csr_matrix(m) # sparse matrix
+  d = m.diagonal().real # diagonal elements
+  r = np.array(np.abs(m).sum(axis=1)).reshape(-1) - np.abs(d) # radii
+  return (np.min(d-r),np.max(d+r))
+
+
+
+
+def evolution_coefficients(ts,scale,tol=1e-12):
+  """Chebychev coefficients of exp(-i x t), with x in [-1,1]
+  scaled by scale, for all the times at once"""
+  from scipy.special import jv
+  ts = np.array(ts,dtype=float) # times
+  x = scale*np.max(np.abs(ts)) # largest argument of the Bessel functions
+  n = int(x + 10*x**(1./3.) + 30) # beyond this J_n decays very fast
+  ns = np.arange(n) # orders
+  cs = jv(ns[:,None],scale*ts[None,:])*((-1j)**ns)[:,None] # (npol,nt)
+  cs[1:,:] *= 2. # prefactor of the expansion
+  ic = np.max(np.abs(cs),axis=1)>tol # relevant coefficients
+  n = np.max(ns[ic])+1 if np.any(ic) else 1 # truncate
+  return cs[0:n,:]
+
+
+
+
+def evolve(m,vs,ts,bounds=None,tol=1e-12):
+  """Apply exp(-i m t) to the vectors vs (columns) for all
+  the times ts, using the Chebychev expansion of the propagator.
+  Only sparse times dense products are used, and a single recursion
+  gives all the times. Returns an array (nt,n) or (nt,n,nv)"""
+  m = csr_matrix(m,dtype=complex) # sparse matrix
+  n = m.shape[0] # dimension
+  if bounds is None: bounds = spectral_bounds(m) # estimate the bounds
+  emin,emax = bounds
+  b = (emax+emin)/2. # center of the spectrum
+  a = (emax-emin)/2.*1.01 + 1e-7 # half width, with a safety margin
+  from scipy.sparse import identity
+  ms = (m - b*identity(n,dtype=complex,format="csr"))/a # scaled matrix
+  ms = csr_matrix(ms) # ensure csr
+  m2 = ms*2. # matrix entering the recursion
+  vs = np.array(vs,dtype=complex) # copy
+  single = len(vs.shape)==1 # single vector
+  if single: vs = vs.reshape((n,1))
+  ts = np.array(ts,dtype=float) # times
+  cs = evolution_coefficients(ts,a,tol=tol) # (npol,nt)
+  cs = cs*np.exp(-1j*b*ts)[None,:] # shift of the center
+  out = np.zeros((len(ts),)+vs.shape,dtype=complex) # storage
+  am = np.ascontiguousarray(vs) # T_0 |v>
+  for it in range(len(ts)): out[it] += cs[0,it]*am
+  if len(cs)==1: return out[:,:,0] if single else out
+  a1 = np.zeros(am.shape,dtype=complex) # T_1 |v>
+  spmm_add(ms,am,a1)
+  for it in range(len(ts)): out[it] += cs[1,it]*a1
+  for i in range(2,len(cs)):
+    am *= -1. # the buffer of the previous vector is reused
+    spmm_add(m2,a1,am) # recursion relation
+    for it in range(len(ts)): out[it] += cs[i,it]*am # accumulate
+    am,a1 = a1,am # new variables
+  if single: return out[:,:,0]
+  return out
+
+
+
+
 def get_momentsA(v,m,n=100,A=None):
   """ Get the first n moments of a certain vector
   using the Chebychev recursion relations"""
@@ -180,14 +301,16 @@ def get_moments_vivj_fortran(m0,vi,vj,n=100):
 
 
 
-def full_trace(m_in,n=200,use_fortran=use_fortran):
-  """ Get full trace of the matrix"""
-  m = csc(m_in) # saprse matrix
+def full_trace(m_in,n=200,nblock=100):
+  """ Get full trace of the matrix, using blocks of nblock sites"""
+  m = csr_matrix(m_in,dtype=complex) # sparse matrix
   nd = m.shape[0] # length of the matrix
-  mus = np.array([0.0j for i in range(2*n)])
-#  for i in range(ntries):
-  for i in range(nd):
-    mus += local_dos(m_in,i=i,n=n,use_fortran=use_fortran)
+  mus = np.zeros(2*n,dtype=complex)
+  for i0 in range(0,nd,nblock): # loop over blocks of sites
+    ii = np.arange(i0,min([nd,i0+nblock])) # sites in this block
+    vs = np.zeros((nd,len(ii)),dtype=complex)
+    vs[ii,ii-i0] = 1.0 # vectors only in those sites
+    mus += kpm_moments_block(vs,m,n=n)
   return mus/nd
 
 
@@ -252,29 +375,29 @@ def total_energy(m_in,scale=10.,npol=None,ne=500,ntries=20):
 
 
 
-def random_trace(m_in,ntries=20,n=200,fun=None,operator=None):
-  """ Calculates local DOS using the KPM"""
+def random_trace(m_in,ntries=20,n=200,fun=None,operator=None,nblock=20):
+  """ Calculates local DOS using the KPM, the random vectors
+  are computed in blocks of nblock vectors"""
   if fun is not None: # check that dimensions are fine
     v0 = fun()
     if len(v0) != m_in.shape[0]: raise
   if fun is None:
 #    def fun(): return rand.random(nd) -.5 + 1j*rand.random(nd) -.5j
     def fun(): return (rand.random(nd) - 0.5)*np.exp(2*1j*np.pi*rand.random(nd))
-  m = csc(m_in) # saprse matrix
+  m = csr_matrix(m_in,dtype=complex) # saprse matrix
   nd = m.shape[0] # length of the matrix
-  def pfun(x):
-    v = fun()
-    v = v/np.sqrt(v.dot(np.conjugate(v))) # normalize the vector
-#    v = csc(v).transpose()
+  def pfun(nv):
+    vs = np.array([fun() for i in range(nv)]).T # random vectors
+    vs = vs/np.sqrt(np.sum(np.abs(vs)**2,axis=0)) # normalize the vectors
     if operator is None:
-      mus = get_moments(v,m,n=n) # get the chebychev moments
+      mus = kpm_moments_block(vs,m,n=n) # get the chebychev moments
     else:
-      mus = get_momentsA(v,m,n=2*n,A=operator) # get the chebychev moments
+      mus = kpm_moments_block(vs,m,n=2*n,A=operator) # get the chebychev moments
     return mus
-#  from . import parallel
-#  out = [pfun(i) for i in range(ntries)] # perform all the computations
+  nvs = [nblock for i in range(ntries//nblock)] # vectors in each block
+  if ntries%nblock!=0: nvs.append(ntries%nblock) # remaining ones
   from . import parallel
-  out = parallel.pcall(pfun,range(ntries))
+  out = parallel.pcall(pfun,nvs)
   mus = np.zeros(out[0].shape,dtype=np.complex)
   for o in out: mus = mus + o # add contribution
   return mus/ntries
@@ -336,39 +336,32 @@ def broyden_solver(scf):
 
 
 
-def coulomb_interaction(g,vc=1.0,vcut=1e-4,vfun=None,has_spin=False,**kwargs):
+def coulomb_interaction(g,vc=1.0,vcut=1e-4,vfun=None,has_spin=False,
+                          rcut=4.0,**kwargs):
     """Return a list with the Coulomb interaction terms"""
     interactions = [] # empty list
     nat = len(g.r) # number of atoms
-    lat = np.sqrt(g.a1.dot(g.a1)) # size of the unit cell
-    rcut = 4.0
-    g.ncells = max([int(2*rcut/lat),1]) # number of unit cells to consider
-    ri = g.r # positions
-    if vfun is None: # no function provided
-        def vfun(dr):
-            if dr<1e-4: return 0.0
-            if dr>rcut: return 0.0
-            return vc/dr*np.exp(-dr/rcut)
-    for d in g.neighbor_directions(): # loop
-      rj = np.array(g.replicas(d)) # positions
-      for i in range(nat): # loop over atoms
-        for j in range(nat): # loop over atoms
-          dx = rj[j,0] - ri[i,0]
-          dy = rj[j,1] - ri[i,1]
-          dz = rj[j,2] - ri[i,2]
-          dr = dx*dx + dy*dy + dz*dz
-          dr = np.sqrt(dr) # square root
-          v = vfun(dr) # interaction
-          if v>1e-3: # sizeble interaction
-            if has_spin:
-              interactions.append(v_ij_density_spinless(2*i,2*j+1,2*nat,
-              g=v,d=[0,0,0]))
-            else:
-              interactions.append(v_ij_density_spinless(i,j,nat,
-              g=v,d=[0,0,0]))
+    m = folded_coulomb(g,vc=vc,vfun=vfun,rcut=rcut,vcut=1e-3).tocoo()
+    for (i,j,v) in zip(m.row,m.col,m.data): # loop over pairs
+        if has_spin:
+          interactions.append(v_ij_density_spinless(2*i,2*j+1,2*nat,
+          g=v,d=[0,0,0]))
+        else:
+          interactions.append(v_ij_density_spinless(i,j,nat,
+          g=v,d=[0,0,0]))
     return interactions
 
 
+def folded_coulomb(g,vc=1.0,vfun=None,rcut=4.0,vcut=1e-3):
+    """Coulomb interaction with all the neighboring cells,
+    summed in a single sparse matrix"""
+    from .coulomb import coulomb_kernel,screened_coulomb
+    if vfun is None: vfun = screened_coulomb(vc=vc,screening=rcut)
+    else: vfun = np.vectorize(vfun,otypes=[float]) # scalar function
+    v = coulomb_kernel(g,vfun=vfun,rcut=rcut,vcut=vcut) # neighbor list
+    return sum([v[d] for d in v]) # sum all the directions
+
+
 def coulomb_interaction_spinless(g,**kwargs):
     return coulomb_interaction(g,has_spin=False,**kwargs)
 
@@ -378,31 +371,14 @@ def coulomb_interaction_spinful(g,**kwargs):
 
 
 
-def fast_coulomb_interaction(g,vc=1.0,vcut=1e-4,vfun=None,has_spin=False,**kwargs):
+def fast_coulomb_interaction(g,vc=1.0,vcut=1e-4,vfun=None,has_spin=False,
+                               rcut=4.0,**kwargs):
     """Return a list with the Coulomb interaction terms, summed over sites"""
     interactions = [] # empty list
     nat = len(g.r) # number of atoms
-    lat = np.sqrt(g.a1.dot(g.a1)) # size of the unit cell
-    rcut = 4.0
-    g.ncells = max([int(2*rcut/lat),1]) # number of unit cells to consider
-    ri = g.r # positions
-    if vfun is None: # no function provided
-        def vfun(dr):
-            if dr<1e-4: return 0.0
-            if dr>rcut: return 0.0
-            return vc/dr*np.exp(-dr/rcut)
+    m = folded_coulomb(g,vc=vc,vfun=vfun,rcut=rcut,vcut=0.0).toarray()
     for i in range(nat): # loop over atoms
-      vjs = np.zeros(nat) # initialize
-      for d in g.neighbor_directions(): # loop
-        rj = np.array(g.replicas(d)) # positions
-        for j in range(nat): # loop over atoms
-          dx = rj[j,0] - ri[i,0]
-          dy = rj[j,1] - ri[i,1]
-          dz = rj[j,2] - ri[i,2]
-          dr = dx*dx + dy*dy + dz*dz
-          dr = np.sqrt(dr) # square root
-          vt = vfun(dr) # interaction
-          vjs[j] += vt # add contribution
+      vjs = m[i,:].real # interaction with the rest of the sites
       vjs[vjs<1e-4] = 0.0 # discard near zeros
       if np.sum(vjs)>1e-3: # sizable interaction
         print("Total Coulomb term",np.sum(vjs))
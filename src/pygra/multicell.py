@@ -1,6 +1,8 @@
 import numpy as np
 from scipy.sparse import csc_matrix,bmat,coo_matrix
 from . import parallel
+from . import algebra
+from .neighbor import close_enough
 
 
 def collect_hopping(h):
@@ -138,6 +140,71 @@ def hk_gen(h):
 
 
 
+def hopping_stack(h):
+  """Stack all the hoppings of a Hamiltonian in a single object,
+  returns the directions, the rows and columns of the union of all
+  the non zero elements, and a sparse matrix with the amplitudes
+  of each direction in each of those elements"""
+  if not h.is_multicell: h = turn_multicell(h) # multicell form
+  n = h.intra.shape[0] # dimension of the matrices
+  ms = [h.intra] + [t.m for t in h.hopping] # all the matrices
+  dirs = [np.zeros(3,dtype=int)] + [np.array(t.dir) for t in h.hopping]
+  dirs = np.array([np.round(d).astype(int) for d in dirs]) # directions
+  ms = [coo_matrix(m) for m in ms] # convert to COO
+  ims = np.concatenate([np.zeros(m.nnz,dtype=int)+i for (i,m) in enumerate(ms)])
+  rows = np.concatenate([m.row for m in ms]).astype(int)
+  cols = np.concatenate([m.col for m in ms]).astype(int)
+  data = np.concatenate([m.data for m in ms]).astype(complex)
+  ij,inds = np.unique(rows*n+cols,return_inverse=True) # union of elements
+  data = csc_matrix((data,(ims,inds)),shape=(len(ms),len(ij))) # amplitudes
+  return dirs,ij//n,ij%n,data
+
+
+def bloch_phases(dim,ks,dirs):
+  """Return the Bloch phases for a set of kpoints and directions,
+  as an array of shape (nk,ndirs)"""
+  ks = np.array(ks,dtype=float) # convert to array
+  if ks.ndim==1:
+    if dim==1: ks = ks.reshape((len(ks),1)) # floats
+    else: ks = np.array([ks]) # single kpoint
+  if dim==0: return np.ones((len(ks),len(dirs)),dtype=complex)
+  kd = ks[:,0:dim]@dirs[:,0:dim].T # scalar products
+  return np.exp(1j*np.pi*2.*kd) # return phases
+
+
+def get_hk_batch(h,ks,hs=None):
+  """Return the Bloch Hamiltonians for a set of kpoints, as an array
+  of shape (nk,n,n) that can be directly fed to numpy.linalg.eigh"""
+  if hs is None: hs = hopping_stack(h) # stack all the hoppings
+  return stack2hk(hs,ks,h.dimensionality,h.intra.shape[0])
+
+
+def stack2hk(hs,ks,dim,n):
+  """Bloch Hamiltonians from the output of hopping_stack"""
+  dirs,rows,cols,data = hs # extract
+  phis = bloch_phases(dim,ks,dirs) # Bloch phases
+  hkd = (data.T@phis.T).T # all the matrix elements, one contraction
+  out = np.zeros((phis.shape[0],n,n),dtype=complex) # output
+  out[:,rows,cols] = hkd # store the elements
+  return out
+
+
+def eigh_batch(h,ks,nchunk=None,eigvals_only=False):
+  """Diagonalize the Bloch Hamiltonians of a set of kpoints,
+  returns eigenvalues (nk,n) and eigenvectors (nk,n,n)"""
+  ks = np.array(ks) # convert to array
+  n = h.intra.shape[0] # dimension
+  if nchunk is None: nchunk = algebra.batch_size(n*n) # bound the memory
+  hs = hopping_stack(h) # stack all the hoppings, only once
+  es,vs = [],[] # empty lists
+  for i in range(0,len(ks),nchunk): # loop over chunks
+    hks = get_hk_batch(h,ks[i:i+nchunk],hs=hs) # Hamiltonians
+    if eigvals_only: es.append(np.linalg.eigvalsh(hks))
+    else:
+      (e,v) = np.linalg.eigh(hks) # diagonalize all of them
+      es.append(e) ; vs.append(v) # store
+  if eigvals_only: return np.concatenate(es)
+  return np.concatenate(es),np.concatenate(vs)
 
 
 
@@ -252,54 +319,56 @@ def clean(h,cutoff=0.0001):
 
 
 def supercell_hamiltonian(hin,nsuper=[1,1,1],sparse=True,ncut=3):
-  """ Create a ribbon hamiltonian object"""
-#  raise # there is something wrong with this function
-  print("This function might have something wrong")
+  """ Create a supercell hamiltonian object, each hopping is mapped
+  directly to its block of the supercell"""
   if not hin.is_multicell: h = turn_multicell(hin)
   else: h = hin # nothing otherwise
   hr = h.copy() # copy hamiltonian
   if sparse: hr.is_sparse = True # sparse output
   # stuff about geometry
   hr.geometry = h.geometry.supercell(nsuper) # create supercell
-  n = nsuper[0]*nsuper[1]*nsuper[2] # number of cells in the supercell
-  pos = [] # positions inside the supercell
-  for i in range(nsuper[0]):
-    for j in range(nsuper[1]):
-      for k in range(nsuper[2]):
-        pos.append(np.array([i,j,k])) # store position inside the supercell
-  zero = csc_matrix(np.zeros(h.intra.shape,dtype=np.complex)) # zero matrix
-  def superhopping(dr=[0,0,0]): 
+  ns = np.array(nsuper,dtype=int) # size of the supercell
+  n = ns[0]*ns[1]*ns[2] # number of cells in the supercell
+  no = h.intra.shape[0] # dimension of the unit cell
+  pos = np.array([[i,j,k] for i in range(ns[0]) for j in range(ns[1])
+                              for k in range(ns[2])]) # positions
+  ts = [(np.zeros(3,dtype=int),h.intra)] # intracell term
+  for t in h.hopping: # loop over hoppings
+    ts.append((np.round(np.array(t.dir)).astype(int),t.m))
+  blocks = dict() # pieces of each supercell hopping
+  for (d,m) in ts: # loop over hoppings
+    m = coo_matrix(m) # sparse form
+    if m.nnz==0: continue # skip empty matrices
+    rr = pos + d # cell reached from each cell
+    dr = rr//ns # direction of the supercell hopping
+    rr = rr - dr*ns # position inside the supercell
+    jj = (rr[:,0]*ns[1] + rr[:,1])*ns[2] + rr[:,2] # index of the cell
+    for key in set(map(tuple,dr)): # loop over supercell directions
+      ii = np.where(np.all(dr==key,axis=1))[0] # cells with this direction
+      rows = (ii[:,None]*no + m.row[None,:]).reshape(-1)
+      cols = (jj[ii][:,None]*no + m.col[None,:]).reshape(-1)
+      data = np.tile(m.data,len(ii))
+      if key not in blocks: blocks[key] = [] # initialize
+      blocks[key].append((rows,cols,data)) # store
+  def superhopping(key):
     """ Return a matrix with the hopping of the supercell"""
-    rs = [dr[0]*nsuper[0],dr[1]*nsuper[1],dr[2]*nsuper[2]] # supercell vector
-    intra = [[None for i in range(n)] for j in range(n)] # intracell term
-    for ii in range(n): intra[ii][ii] = zero.copy() # zero
-
-    for ii in range(n): # loop over cells
-      for jj in range(n): # loop over cells
-        d = pos[jj] + np.array(rs) -pos[ii] # distance
-      #  if d.dot(d)>ncut*ncut: continue # skip iteration
-        m = get_tij(h,rij=d) # get the matrix
-        if m is not None: 
-          intra[ii][jj] = csc_matrix(m) # store
-    intra = csc_matrix(bmat(intra)) # convert to matrix
-    if not sparse: intra = intra.todense() # dense matrix
-    return intra
-  # get the intra matrix
-  hr.intra = superhopping()
-  # now do the same for the interterm
+    if key not in blocks: out = csc_matrix((n*no,n*no),dtype=complex)
+    else:
+      rows,cols,data = [np.concatenate(x) for x in zip(*blocks[key])]
+      out = csc_matrix((data,(rows,cols)),shape=(n*no,n*no),
+                          dtype=complex) # duplicates are summed
+    if not sparse: out = out.todense() # dense matrix
+    return out
+  hr.intra = superhopping((0,0,0)) # get the intra matrix
   hoppings = [] # list of hopings
-  for i in range(-ncut,ncut+1): # loop over hoppings
-    for j in range(-ncut,ncut+1): # loop over hoppings
-      for k in range(-ncut,ncut+1): # loop over hoppings
-        if i==j==k==0: continue # skip the intraterm
-        dr = np.array([i,j,k]) # set as array
-        hopp = Hopping() # create object
-        hopp.m = superhopping(dr=dr) # get hopping of the supercell
-        hopp.dir = dr
-        if np.sum(np.abs(hopp.m))>0.00000001: # skip this matrix
-          hoppings.append(hopp)
-        else: pass
-      hr.hopping = hoppings # store the list
+  for key in sorted(blocks): # loop over directions
+    if key==(0,0,0): continue # skip the intraterm
+    hopp = Hopping() # create object
+    hopp.m = superhopping(key) # get hopping of the supercell
+    hopp.dir = np.array(key)
+    if np.sum(np.abs(hopp.m))>0.00000001: # skip this matrix
+      hoppings.append(hopp)
+  hr.hopping = hoppings # store the list
   return hr 
 
 
@@ -318,12 +387,14 @@ def parametric_hopping_hamiltonian(h,cutoff=5,fc=None,rcut=5.0):
       r = r.dot(r)
       if 0.9<r<1.1: return 1.0
       else: return 0.0
+  from .neighbor import is_vectorized
+  if is_vectorized(fc): rcut = fc.cutoff # range of the hopping
   r = h.geometry.r    # x coordinate 
   g = h.geometry
   h.is_multicell = True 
 # first neighbors hopping, all the matrices
   a1, a2, a3 = g.a1, g.a2, g.a3
-  h.intra = h.spinless2full(parametric_hopping(r,r,fc)) # intra matrix
+  h.intra = h.spinless2full(parametric_hopping(r,r,fc,cutoff=rcut)) # intra
   # generate directions
   dirs = h.geometry.neighbor_directions() # directions of the hoppings
   # generate hoppings
@@ -333,11 +404,11 @@ def parametric_hopping_hamiltonian(h,cutoff=5,fc=None,rcut=5.0):
         if i1==0 and i2==0 and i3==0: continue
         t = Hopping() # hopping class
         da = a1*i1+a2*i2+a3*i3 # direction
-        r2 = [ri + da for ri in r]
+        r2 = r + da # shifted positions
         if not close_enough(r,r2,rcut=rcut): # check if we can skip this one
 #          print("Skipping hopping",[i1,i2,i3])
           continue
-        t.m = h.spinless2full(parametric_hopping(r,r2,fc))
+        t.m = h.spinless2full(parametric_hopping(r,r2,fc,cutoff=rcut))
         t.dir = [i1,i2,i3] # store direction
         if np.sum(np.abs(t.m))>0.00001: h.hopping.append(t) # append 
   return h
@@ -451,19 +522,6 @@ def pairs2hopping(ps):
 
 
 
-def close_enough(rs1,rs2,rcut=2.0):
-  """CHeck if two sets of positions are at a distance
-  at least rcut"""
-  rcut2 = rcut*rcut # square of the distance
-  for ri in rs1:
-    for rj in rs2:
-      dr = ri - rj # vector
-      dr = dr.dot(dr) # distance
-      if dr<rcut2: return True
-  return False
-
-
-
 def turn_no_multicell(h):
   """Converts a Hamiltonian into the non multicell form"""
   if not h.is_multicell: return h # Hamiltonian is already fine
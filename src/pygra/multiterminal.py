@@ -1,44 +1,50 @@
 # library to calculate transpot in multiterminal devices
 
 import numpy as np
+from scipy.sparse import csc_matrix,coo_matrix,identity,issparse
 from . import neighbor
+from . import algebra
 
 class Device():
   """ Device with leads and scattering part"""
   def __init__(self):
     self.leads = [] # empty list of leads
   def biterminal(self,right_g=None,left_g=None,central_g=None,fun=None,
-                    disorder=0.0):
+                    disorder=0.0,cutoff=None):
     """Create the matrices for a biterminal device, based on geometries"""
+    self.multiterminal([right_g,left_g],central_g,fun=fun,
+                         disorder=disorder,cutoff=cutoff)
+  def multiterminal(self,leads_g,central_g,fun=None,disorder=0.0,
+                      cutoff=None):
+    """Create the matrices for a device with several leads, based on
+    geometries, each lead geometry with its own a1 pointing outwards.
+    The couplings are built from neighbor lists, using the cutoff of
+    the hopping function"""
     if fun is None: # no function provided
-      def fun(r1,r2):
+      def f(r1,r2):
         dr = r1-r2
-        if .7<dr.dot(dr)<1.3: return True
-        else: return False
-    leadr = Lead() # right lead
-    leadl = Lead() # left lead
-    Rr = right_g.r # positions
-    Lr = left_g.r # positions
+        dr2 = np.sum(dr*dr,axis=1) # square distances
+        return ((.7<dr2) & (dr2<1.3)).astype(float)
+      fun = neighbor.vectorized_hopping(f,cutoff=np.sqrt(1.3))
+    def ph(r1,r2): # sparse hopping matrix
+      return neighbor.parametric_hopping(r1,r2,fun,is_sparse=True,
+                                           cutoff=cutoff)
     Cr = central_g.r # positions
-    leadr.intra = neighbor.parametric_hopping(Rr,Rr,fun) # intra term
-    leadl.intra = neighbor.parametric_hopping(Lr,Lr,fun) # intra term
-    intra = neighbor.parametric_hopping(Cr,Cr,fun) # intra term
+    intra = ph(Cr,Cr).tolil() # intra term
     for i in range(intra.shape[0]): # add disorder
       intra[i,i] += disorder*(np.random.random()-.5)
-    self.intra = intra # store
-    leadr.coupling = neighbor.parametric_hopping(Rr,Cr,fun) # coupling
-    leadl.coupling = neighbor.parametric_hopping(Lr,Cr,fun) # coupling
-    # now coupling within the lead
-    Rr_dis = [r-right_g.a1 for r in Rr] # displace
-    Lr_dis = [r-left_g.a1 for r in Lr] # displace
-    leadr.inter = neighbor.parametric_hopping(Rr,Rr_dis,fun) # intra term
-    leadl.inter = neighbor.parametric_hopping(Lr,Lr_dis,fun) # intra term
-    # store positions
-    leadr.r = Rr
-    leadl.r = Lr
+    self.intra = intra.tocsc() # store
     self.r = Cr
-    # store leads
-    self.leads = [leadr,leadl] # store the leads
+    self.leads = [] # empty list
+    for g in leads_g: # loop over leads
+      lead = Lead() # create lead
+      r = g.r # positions
+      lead.intra = np.matrix(ph(r,r).todense()) # intra term
+      lead.coupling = ph(r,Cr) # coupling to the center
+      r_dis = [ri-g.a1 for ri in r] # displace
+      lead.inter = np.matrix(ph(r,r_dis).todense()) # coupling within the lead
+      lead.r = r # store positions
+      self.leads.append(lead) # store the lead
   def write(self):
     """Write positions of the atoms"""
     np.savetxt("CENTRAL.XYZ",self.r) # write central
@@ -48,6 +54,10 @@ class Device():
   def transmission(self,energy=0.0):
     """Calculate the transmission"""
     return landauer(self,energy)
+  def transmission_matrix(self,energies=[0.0],**kwargs):
+    """Transmission between all the pairs of leads for a grid of
+    energies, returns an array (ne,nleads,nleads)"""
+    return landauer_multienergy(self,energies,**kwargs)
   def write_current(self,energy=0.0):
     """Calculate the transmission"""
     den = central_density(self,energy=energy)
@@ -70,16 +80,73 @@ class Lead():
   def get_selfenergy(self,energy,error=0.0001,delta=0.0001):
     """ Get selfenergy"""
     gr = self.get_green(energy,error=error,delta=delta) # get greenfunction
-    t = self.coupling # coupling
+    t = algebra.todense(self.coupling) # coupling
+    t = np.matrix(t) # as matrix
     selfenergy = t.H * gr * t 
     return selfenergy
+  def boundary(self):
+    """Sites of the central part coupled to the lead"""
+    t = csc_matrix(self.coupling) # coupling
+    return np.unique(t.nonzero()[1]) # columns with non zero elements
+  def get_boundary_selfenergy(self,energies,delta=0.0001):
+    """Selfenergy of the lead projected on its boundary sites, for
+    a grid of energies, returns an array (ne,nb,nb). The surface
+    Green functions are stored in the cache of the green module"""
+    from . import green
+    gb,gs = green.green_renormalization_multienergy(self.intra,
+                 self.inter,energies=energies,delta=delta)
+    t = csc_matrix(self.coupling)[:,self.boundary()].toarray() # (nl,nb)
+    return np.conjugate(t.T)[None,:,:]@gs@t[None,:,:] # t^dagger g t
 
 
 def landauer(d,energy,ij=[(0,1)],error=0.000001,delta=0.00001):
   """ Calculate landauer tranmission between leads i,j """
-  Ms = landauer_matrix(d,energy,ij=ij,error=error,delta=delta) # matrix
-  Ts = [m.trace()[0,0] for m in Ms]
-  return Ts
+  Ts = landauer_multienergy(d,[energy],ij=ij,delta=delta)[0]
+  return list(Ts)
+
+
+def landauer_multienergy(d,energies,ij=None,delta=0.00001):
+  """Landauer transmission T_ij between all the pairs of leads, for a
+  grid of energies. For each energy only the columns of the Green
+  function in the sites coupled to the leads are computed, from
+  a sparse LU factorization of E - H - selfenergy.
+  Returns an array (ne,nleads,nleads), or (ne,len(ij)) if ij is given"""
+  from scipy.sparse.linalg import splu
+  energies = np.array(energies,dtype=float).reshape(-1) # energies
+  h = csc_matrix(d.intra,dtype=complex) # central Hamiltonian
+  n = h.shape[0] # dimension
+  iden = identity(n,dtype=complex,format="csc") # identity matrix
+  bs = [l.boundary() for l in d.leads] # boundary sites of each lead
+  ss = [l.get_boundary_selfenergy(energies,delta=delta) for l in d.leads]
+  ball = np.unique(np.concatenate(bs)) # all the boundary sites
+  pos = [np.searchsorted(ball,b) for b in bs] # position in ball
+  nl = len(d.leads) # number of leads
+  nb = len(ball) # number of columns to compute
+  nchunk = algebra.batch_size(n) # columns solved at once
+  out = np.zeros((len(energies),nl,nl)) # transmissions
+  for (ie,e) in enumerate(energies):
+    rows,cols,data = [],[],[] # sum of selfenergies, sparse
+    for (b,s) in zip(bs,ss):
+      rows.append(np.repeat(b,len(b))) ; cols.append(np.tile(b,len(b)))
+      data.append(s[ie].reshape(-1))
+    sigma = coo_matrix((np.concatenate(data),(np.concatenate(rows),
+                 np.concatenate(cols))),shape=(n,n),dtype=complex)
+    m = csc_matrix((e + delta*1j)*iden - h - sigma) # E - H - selfenergy
+    lu = splu(m) # sparse LU factorization
+    gb = np.zeros((nb,nb),dtype=complex) # Green function in boundaries
+    for k in range(0,nb,nchunk): # loop over chunks of columns
+      rhs = np.zeros((n,len(ball[k:k+nchunk])),dtype=complex)
+      rhs[ball[k:k+nchunk],range(rhs.shape[1])] = 1.0 # unit vectors
+      gb[:,k:k+nchunk] = lu.solve(rhs)[ball,:]
+    gammas = [1j*(s[ie]-np.conjugate(s[ie].T)) for s in ss] # spectral
+    for i in range(nl):
+      for j in range(nl):
+        if i==j: continue
+        g = gb[np.ix_(pos[i],pos[j])] # from lead j to lead i
+        t = gammas[i]@g@gammas[j]@np.conjugate(g.T)
+        out[ie,i,j] = np.trace(t).real # transmission
+  if ij is not None: return np.array([out[:,i,j] for (i,j) in ij]).T
+  return out
 
 
 def landauer_matrix(d,energy,ij=[(0,1)],error=0.000001,delta=0.00001):
@@ -91,7 +158,7 @@ def landauer_matrix(d,energy,ij=[(0,1)],error=0.000001,delta=0.00001):
   # identity matrix
   iden = np.identity(d.intra.shape[0])
   # calculate central green function
-  gc = ((energy + delta*1j)*iden -  d.intra - ssum). I
+  gc = ((energy + delta*1j)*iden -  algebra.todense(d.intra) - ssum).I
   # calculate transmission
   ts = [] # empty list
   for (i,j) in ij: # loop over pairs
@@ -115,7 +182,7 @@ def central_density(d,energy,ij=[(0,1)],error=0.000001,delta=0.00001):
   # identity matrix
   iden = np.identity(d.intra.shape[0])
   # calculate central green function
-  gc = ((energy + delta*1j)*iden -  d.intra - ssum). I
+  gc = ((energy + delta*1j)*iden -  algebra.todense(d.intra) - ssum).I
   # calculate transmission
   den = np.array([gc[i,i].imag for i in range(gc.shape[0])])
   return den # return list
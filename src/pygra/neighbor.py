@@ -9,37 +9,54 @@ minimum_hopping = 1e-3
 
 
 
-try: 
-  from . import first_neighborsf90
-  def find_first_neighbor(r1,r2):
-      """Calls the fortran routine"""
-      from . import first_neighborsf90 as fn
-      r1t = np.matrix(r1).T
-      r2t = np.matrix(r2).T
-      nn = fn.number_neighborsf90(r1t,r2t)
-      if nn==0: return []  # if no neighbors found
-      pairs = np.array(fn.first_neighborsf90(r1t,r2t,nn))
-      return pairs.T # return the pairs
-
-
-except:
-  print("ERROR, neighbor fortran routine is not well compiled")
-  def find_first_neighbor(r1,r2):
-     """Calls the fortran routine"""
-     print("Using ultraslow function!!!!!!!!!!")
-     pairs = []
-     for i in range(len(r1)):
-       for j in range(len(r2)):
-         ri = r1[i]
-         rj = r2[j]
-         dr = ri-rj
-         dr = dr.dot(dr)
-         if 0.8<dr<1.2: pairs.append([i,j])
-     return np.array(pairs)
-#  try:
-#      import numba 
-#      from .numbaneighbor import find_first_neighbor
-#  except: pass
+def neighbor_pairs(r1,r2,rmax,rmin=0.0):
+  """Return the pairs of sites of r1 and r2 whose distance d
+  satisfies rmin<d<=rmax, as COO arrays (i,j,d)"""
+  from scipy.spatial import cKDTree
+  r1 = np.array(r1,dtype=float) ; r2 = np.array(r2,dtype=float)
+  if len(r1)==0 or len(r2)==0: # nothing to do
+    return np.zeros(0,dtype=int),np.zeros(0,dtype=int),np.zeros(0)
+  t1,t2 = cKDTree(r1),cKDTree(r2) # spatial index of each set
+  out = t1.sparse_distance_matrix(t2,rmax,output_type="ndarray")
+  ii,jj,ds = out["i"],out["j"],out["v"] # pairs and distances
+  if rmin>0.0: # remove pairs that are too close
+    ii,jj,ds = ii[ds>rmin],jj[ds>rmin],ds[ds>rmin]
+  return ii.astype(int),jj.astype(int),ds
+
+
+def vectorized_hopping(f,cutoff=5.0):
+  """Mark a hopping function as vectorized, f takes two arrays with
+  the positions of the pairs (npairs,3) and returns an array with the
+  hoppings, which vanish beyond the cutoff. The result can still be
+  called with two single positions"""
+  def fun(r1,r2):
+    r1,r2 = np.array(r1),np.array(r2)
+    if r1.ndim==1: return f(r1[None,:],r2[None,:])[0] # single pair
+    return f(r1,r2) # arrays of pairs
+  fun.vectorized = True # vectorized function
+  fun.cutoff = cutoff # range of the hopping
+  return fun
+
+
+def is_vectorized(f):
+  """Check if a hopping function is vectorized"""
+  return getattr(f,"vectorized",False)
+
+
+def find_first_neighbor(r1,r2):
+  """Return the pairs of first neighbors, at distance one"""
+  ii,jj,ds = neighbor_pairs(r1,r2,np.sqrt(1.2),rmin=np.sqrt(0.8))
+  if len(ii)==0: return [] # if no neighbors found
+  pairs = np.array([ii,jj]).T # pairs of neighbors
+  return pairs[np.lexsort((pairs[:,1],pairs[:,0]))] # sorted pairs
+
+
+def close_enough(r1,r2,rcut=2.0):
+  """Check if two sets of positions have a pair closer than rcut"""
+  from scipy.spatial import cKDTree
+  if len(r1)==0 or len(r2)==0: return False
+  ds,js = cKDTree(np.array(r2)).query(np.array(r1),distance_upper_bound=rcut)
+  return np.any(ds<rcut) # at least one pair
 
 
 
@@ -55,11 +72,24 @@ def connections(r1,r2):
 
 
 
-def parametric_hopping(r1,r2,fc,is_sparse=False):
-  """ Generates a parametric hopping based on a function"""
+def parametric_hopping(r1,r2,fc,is_sparse=False,cutoff=None):
+  """ Generates a parametric hopping based on a function, if a
+  cutoff is given only pairs closer than it are evaluated"""
+  if cutoff is None and is_vectorized(fc): cutoff = fc.cutoff
+  if cutoff is not None: # use only the pairs within the cutoff
+    r1,r2 = np.array(r1),np.array(r2)
+    ii,jj,ds = neighbor_pairs(r1,r2,cutoff) # candidate pairs
+    if is_vectorized(fc): # a single call for all the pairs
+      data = np.array(fc(r1[ii],r2[jj]),dtype=complex)
+    else: data = np.array([fc(r1[i],r2[j]) for (i,j) in zip(ii,jj)],
+                        dtype=complex) # hoppings
+    keep = np.abs(data)>0.0 # non zero hoppings
+    m = csc_matrix((data[keep],(ii[keep],jj[keep])),
+                        shape=(len(r1),len(r2)),dtype=complex)
+    if is_sparse: return m
+    else: return np.matrix(m.todense())
   if is_sparse: # sparse matrix
     print("Sparse parametric hopping")
-    m = np.matrix([[0.0j for i in range(len(r2))] for j in range(len(r1))])
     rows,cols,data = [],[],[]
     for i in range(len(r1)):
       for j in range(len(r2)):
@@ -68,13 +98,11 @@ def parametric_hopping(r1,r2,fc,is_sparse=False):
          data.append(val)
          rows.append(i)
          cols.append(j)
-    n = len(r2)
-    m = csc_matrix((data,(rows,cols)),shape=(n,n))
+    m = csc_matrix((data,(rows,cols)),shape=(len(r1),len(r2)))
   #  if not is_sparse: m = m.todense() # dense matrix
     return m
   else:
-    n = len(r2)
-    m = np.matrix(np.zeros((n,n),dtype=np.complex)) # complex matrix
+    m = np.matrix(np.zeros((len(r1),len(r2)),dtype=complex)) # complex matrix
     for i in range(len(r1)):
       for j in range(len(r2)):
         m[i,j] = fc(r1[i],r2[j])
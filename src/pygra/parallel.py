@@ -1,6 +1,7 @@
 # routines to call a function in parallel
 from __future__ import print_function
 import scipy.linalg as lg
+import numpy as np
 from . import algebra
 
 
@@ -12,9 +13,9 @@ try:
   maxcpu = multiprocess.cpu_count()
 except:
     print("Multiprocess not working")
-    def Pool(n=1): # workaround
+    def Pool(n=1,**kwargs): # workaround
             class mpool():
-                def map(self,f,xs):
+                def map(self,f,xs,**kwargs):
                   return [f(x) for x in xs]
                 def terminate(self): return None # dummy function
             return mpool()
@@ -29,21 +30,46 @@ def set_cores(n=1):
     cores = n
 
 
-#mainpool = None
+mainpool = None # persistent pool of workers
+mainpool_cores = 0 # number of cores of the persistent pool
 
-#def initialize(): 
-#  global mainpool
-#  if cores>1:
-#    mainpool = Pool(cores) # create pool
-#  return mainpool
 
-#def finish(): mainpool=None # delete pool
+def set_child():
+    """Executed in each worker when the pool is created"""
+    global is_child
+    is_child = True
+
+
+def initialize():
+  """Return the persistent pool, creating it if necessary"""
+  global mainpool,mainpool_cores
+  if mainpool is not None and mainpool_cores==cores: return mainpool
+  finish() # remove the old pool if the number of cores changed
+  mainpool = Pool(cores,initializer=set_child) # create pool
+  mainpool_cores = cores # store the number of cores
+  return mainpool
+
+
+def finish():
+  """Terminate the persistent pool"""
+  global mainpool,mainpool_cores
+  if mainpool is not None: mainpool.terminate() # clear the pool
+  mainpool = None
+  mainpool_cores = 0
+
+import atexit
+atexit.register(finish) # kill the workers when leaving
+
+
+def get_chunksize(n,cores=None):
+    """Number of tasks sent to a worker at once"""
+    if cores is None: cores = globals()["cores"]
+    return max([1,n//(4*cores)])
 
 
 def multieigh(ms):
   """Diagonalize a bunch of Hamiltonians at once"""
-#  mainpool = initialize()
-  if mainpool is not None: mainpool.map(lg.eigh,ms)
+  if cores>1: return pcall(algebra.eigh,ms)
   else: return [algebra.eigh(m) for m in ms]
 
 
@@ -55,25 +81,12 @@ def pcall_serial(fun,args):
   return [fun(a) for a in args]
 
 
-#def pcall_mp(fun,args,cores=1): return pcall_serial(fun,args)
-
-#try: # try to use the multiprocessing library
-#  from pathos.multiprocessing import Pool
 def pcall_mp(fun,args,cores=cores):
     """Calls a function for every input in args"""
-    mainpool = Pool(cores) # create pool
-#    print("Using",cores,"cores")
-    out = mainpool.map(fun,args) # return list
-    mainpool.terminate() # clear the pool
-    del mainpool # delete pool
+    args = list(args) # convert to list
+    pool = initialize() # persistent pool
+    out = pool.map(fun,args,chunksize=get_chunksize(len(args),cores=cores))
     return out
-#except:
-#  print("Multiprocessing not found, running in a single core")
-#  def pcall_mp(fun,args,cores=1): return pcall_serial(fun,args)
-  
-
-
-
 
 
 def pcall(fun,args): # define the function
@@ -87,9 +100,96 @@ def pcall(fun,args): # define the function
         try: out = pcall_mp(fun,args,cores=cores) # call in parallel
         except:
             print("Something wrong happened in the parallel execution")
+            finish() # the pool may be broken
             out = pcall_serial(fun,args) # serial execution
     is_child = False # main from now on
     return out
   # child process
   else: return pcall_serial(fun,args) # one core, simply iterate
 
+
+
+
+
+try:
+  from multiprocessing import shared_memory
+  has_shared_memory = True
+except: has_shared_memory = False
+
+
+class SharedArray():
+  """Numpy array stored in shared memory, only its name is sent
+  to the workers when pickled"""
+  def __init__(self,a=None,shape=None,dtype=None):
+    if a is not None: shape,dtype = a.shape,a.dtype
+    self.shape,self.dtype = tuple(shape),np.dtype(dtype)
+    nbytes = max([1,int(np.prod(self.shape))*self.dtype.itemsize])
+    self.shm = shared_memory.SharedMemory(create=True,size=nbytes)
+    self.owner = True # this process has to free the memory
+    if a is not None: self.array[...] = a # copy the data
+  @property
+  def array(self):
+    return np.ndarray(self.shape,dtype=self.dtype,buffer=self.shm.buf)
+  def __getstate__(self):
+    return (self.shm.name,self.shape,self.dtype.str)
+  def __setstate__(self,state):
+    name,self.shape,dtype = state
+    self.dtype = np.dtype(dtype)
+    self.shm = shared_memory.SharedMemory(name=name) # attach
+    self.owner = False # the owner takes care of the memory
+  def close(self):
+    self.shm.close()
+    if self.owner: self.shm.unlink() # free the memory
+
+
+
+def eigh_chunk(task):
+  """Diagonalize the Bloch Hamiltonians of a chunk of kpoints,
+  writing the result in shared memory"""
+  from .multicell import stack2hk
+  (hs,dim,n,ks,i0,es,vs) = task
+  from scipy.sparse import csc_matrix
+  dirs,rows,cols,data,indices,indptr,shape = [a.array for a in hs[0:6]]+[hs[6]]
+  data = csc_matrix((data,indices,indptr),shape=shape) # amplitudes
+  hks = stack2hk((dirs,rows,cols,data),ks,dim,n) # Hamiltonians
+  del dirs,rows,cols,data,indices,indptr # release the shared buffers
+  if vs is None: es.array[i0:i0+len(ks)] = np.linalg.eigvalsh(hks)
+  else:
+    e,v = np.linalg.eigh(hks) # diagonalize
+    es.array[i0:i0+len(ks)] = e # store eigenvalues
+    vs.array[i0:i0+len(ks)] = v # store eigenvectors
+  for a in [es,vs] + list(hs[0:6]): # detach from the shared memory
+    if a is not None: a.shm.close()
+  return None
+
+
+def eigh_batch(h,ks,eigvals_only=False):
+  """Diagonalize the Bloch Hamiltonians of many kpoints in parallel,
+  the Hamiltonian is published only once in shared memory"""
+  from .multicell import hopping_stack,eigh_batch
+  if cores==1 or is_child or not has_shared_memory:
+    return eigh_batch(h,ks,eigvals_only=eigvals_only) # serial
+  ks = np.array(ks) # convert to array
+  dirs,rows,cols,data = hopping_stack(h) # stack all the hoppings
+  hs = [SharedArray(a) for a in [dirs,rows,cols,data.data,
+                     data.indices,data.indptr]] + [data.shape]
+  n = h.intra.shape[0] # dimension
+  es = SharedArray(shape=(len(ks),n),dtype=np.float64) # eigenvalues
+  if eigvals_only: vs = None
+  else: vs = SharedArray(shape=(len(ks),n,n),dtype=np.complex128)
+  nc = get_chunksize(len(ks),cores=cores) # kpoints per task
+  tasks = [(hs,h.dimensionality,n,ks[i:i+nc],i,es,vs)
+                    for i in range(0,len(ks),nc)]
+  try: pcall_mp(eigh_chunk,tasks,cores=cores) # compute all
+  except:
+    print("Something wrong happened in the parallel execution")
+    finish() # the pool may be broken
+    for a in [es,vs] + hs[0:6]: # free the memory
+      if a is not None: a.close()
+    return eigh_batch(h,ks,eigvals_only=eigvals_only) # serial
+  eout = es.array.copy() # eigenvalues
+  if vs is not None: vout = vs.array.copy() # eigenvectors
+  for a in [es,vs] + hs[0:6]: # free the memory
+    if a is not None: a.close()
+  if eigvals_only: return eout
+  else: return eout,vout
@@ -1,5 +1,6 @@
 import numpy as np
 from scipy.sparse import coo_matrix,csc_matrix,issparse
+from .neighbor import is_vectorized
 
 
 def add_phase(m1,r1,r2,phasefun,has_spin=False):
@@ -7,13 +8,18 @@ def add_phase(m1,r1,r2,phasefun,has_spin=False):
   m = coo_matrix(m1) # convert to sparse matrix
   row,col = m.row,m.col
   data = m.data +0j
-  for k in range(len(m.data)): # loop over non vanishing elements
-    i = m.row[k]
-    j = m.col[k]
-    if has_spin: i,j = i//2,j//2 # if spinful
-    # peierls phase
-    p = phasefun(r1[i],r2[j]) # function yielding the phase
-    data[k] *= p # add phase
+  if is_vectorized(phasefun): # one call for all elements
+    if has_spin: ii,jj = row//2,col//2 # if spinful
+    else: ii,jj = row,col
+    data = data*phasefun(np.array(r1)[ii],np.array(r2)[jj]) # add phase
+  else:
+    for k in range(len(m.data)): # loop over non vanishing elements
+      i = m.row[k]
+      j = m.col[k]
+      if has_spin: i,j = i//2,j//2 # if spinful
+      # peierls phase
+      p = phasefun(r1[i],r2[j]) # function yielding the phase
+      data[k] *= p # add phase
   out = csc_matrix((data,(row,col)),shape=m1.shape) # convert to csc
   if not issparse(m1): out = out.todense() # dense matrix
   return out
@@ -23,90 +29,96 @@ def add_phase(m1,r1,r2,phasefun,has_spin=False):
 
 
 
-def add_peierls(h,mag_field=0.0,new=False):
-  """ Adds Peierls phase to the Hamiltonian"""
-  if h.has_eh: raise
-  x = h.geometry.x    # x coordinate 
-  y = h.geometry.y    # x coordinate 
-  a1 = h.geometry.a1    # distance to neighboring cell
-  celldis = np.sqrt(a1.dot(a1))
-  from numpy import array
-  norb = h.intra.shape[0]  # number of orbitals
-  if h.is_multicell: raise
-  if new:
-    print("New method to calculate peierls")
-    g = h.geometry # geometry
-    has_spin = h.has_spin # has spin degree of freedom
-    def phasefun(ri,rj): 
-      if callable(mag_field): return mag_field(ri[0],ri[1],rj[0],rj[1])
-      else: raise
-    h.intra = add_phase(h.intra,g.r,g.r,phasefun,has_spin) 
-    if h.dimensionality==2:
-      h.tx = add_phase(h.tx,g.r,g.replicas([1.,0.,0.]),phasefun,has_spin) 
-      h.ty = add_phase(h.ty,g.r,g.replicas([0.,1.,0.]),phasefun,has_spin) 
-      h.txy = add_phase(h.txy,g.r,g.replicas([1.,1.,0.]),phasefun,has_spin) 
-      h.txmy = add_phase(h.txmy,g.r,g.replicas([1.,-1.,0.]),phasefun,has_spin) 
-      return
-  else: # old method
-
-
-    if h.is_sparse: # sparse hamiltonian
-      if True: # zero dimensional
-        m = coo_matrix(h.intra) # convert to sparse matrix
-        row,col = m.row,m.col
-        data = m.data +0j
-        for k in range(len(m.data)): # loop over non vanishing elements
-          i = m.row[k]
-          j = m.col[k]
-          if h.has_spin: i,j = i/2,j/2 # raise if spinful
-          p = peierls(x[i],y[i],x[j],y[j],mag_field) # peierls phase
-          data[k] *= p # add phase
-        h.intra = csc_matrix((data,(row,col)),shape=(norb,norb)) # convert to csc
-      if h.dimensionality==1: # one dimensional
-        # check that celldis is right
-        if np.abs(celldis - h.geometry.a1[0])>0.001: raise
-        def phaseize(inter,numn=1):
-          m = coo_matrix(inter) # convert to sparse matrix
-          row,col = m.row,m.col
-          data = m.data +0j
-          for k in range(len(m.data)): # loop over non vanishing elements
-            i = m.row[k]
-            j = m.col[k]
-            if h.has_spin: i,j = i//2,j//2 # raise if spinful
-            # peierls phase
-            p = peierls(x[i],y[i],x[j]+numn*celldis,y[j],mag_field) 
-            data[k] *= p # add phase
-          return csc_matrix((data,(row,col)),shape=(norb,norb)) # convert to csc
-        # for normal hamiltonians
-        if not h.is_multicell: h.inter = phaseize(h.inter,numn=1) 
-        # for multicell hamiltonians
-        if h.is_multicell: 
-          hopping = [] # empty list
-          for i in range(len(h.hopping)):
-            h.hopping[i].m = phaseize(h.hopping[i].m,numn=h.hopping[i].dir[0]) 
-    else: # not sparse
-      def gaugeize(m,d=0.0):
-        """Add gauge phase to a matrix"""
-        for i in range(len(x)):
-          for j in range(len(x)):
-            p = peierls(x[i],y[i],x[j]+d,y[j],mag_field) # peierls phase
-            if h.has_spin:
-              m[2*i,2*j] *= p
-              m[2*i,2*j+1] *= p
-              m[2*i+1,2*j] *= p
-              m[2*i+1,2*j+1] *= p
-            else:
-              m[i,j] *= p
-      gaugeize(h.intra,d=0.0)  # gaugeize intraterm
-      if h.dimensionality==0: pass # if zero dimensional
-      elif h.dimensionality==1: # if one dimensional
-        if h.is_multicell: raise
-        gaugeize(h.inter,d=celldis) # gaugeize interterm
-      elif h.dimensionality==2: # if bigger dimensional
-        print("WARNING, is your gauge periodic?")
-        gaugeize(h.tx,d=h.geometry.a1[0]) # gaugeize interterm
-      else:
-        raise
+def site_charges(h):
+  """Charge of each of the orbitals of a site, electrons have
+  charge 1 and holes -1, in the order of the Nambu spinor"""
+  if h.check_mode("spinless"): return np.array([1.])
+  elif h.check_mode("spinful"): return np.array([1.,1.])
+  elif h.check_mode("spinless_nambu"): return np.array([1.,-1.])
+  elif h.check_mode("spinful_nambu"): return np.array([1.,1.,-1.,-1.])
+  else: raise
+
+
+def gauge_matrix(m,r1,r2,phasefun,charges=[1.]):
+  """Multiply each element of a matrix by exp(i phi q), with phi the
+  phase of the bond, given by phasefun(r1,r2) for arrays of positions,
+  and q the mean charge of the two orbitals. Only the non vanishing
+  elements are computed, spin and Nambu components come from the index"""
+  charges = np.array(charges,dtype=float)
+  nc = len(charges) # orbitals per site
+  mo = coo_matrix(m) # convert to coo matrix
+  ii,jj = mo.row//nc,mo.col//nc # sites
+  q = (charges[mo.row%nc] + charges[mo.col%nc])/2. # charge of the element
+  phi = phasefun(np.array(r1)[ii],np.array(r2)[jj]) # phases of the bonds
+  data = mo.data*np.exp(1j*q*phi) # add the phases
+  out = csc_matrix((data,(mo.row,mo.col)),shape=mo.shape)
+  if issparse(m): return out
+  else: return np.matrix(out.todense()) # dense matrix
+
+
+def uniform_field(b,gauge="landau"):
+  """Bond phases of a uniform magnetic field in the z direction,
+  for arrays of positions. The Landau gauge gives
+  b*(x1-x2)*(y1+y2)/2, the symmetric one the same field"""
+  def phasefun(r1,r2):
+    rm = (r1+r2)/2. # middle of the bond
+    dr = r1-r2 # bond vector
+    if gauge=="landau": return b*dr[:,0]*rm[:,1]
+    elif gauge=="symmetric":
+      return b*(dr[:,0]*rm[:,1] - dr[:,1]*rm[:,0])/2.
+    else: raise
+  return phasefun
+
+
+def potential_phase(a):
+  """Bond phases of a vector potential a(r), taking arrays of positions
+  (n,3) and returning arrays (n,3), integrated with the middle point"""
+  def phasefun(r1,r2):
+    return np.sum(np.array(a((r1+r2)/2.))*(r1-r2),axis=1)
+  return phasefun
+
+
+def field_phase(b):
+  """Bond phases of a non uniform field in the Landau gauge, b(r1,r2)
+  is called for arrays of positions if vectorized"""
+  def phasefun(r1,r2):
+    if getattr(b,"vectorized",False): bs = np.array(b(r1,r2))
+    else: bs = np.array([b(ri,rj) for (ri,rj) in zip(r1,r2)])
+    return bs*(r1[:,0]-r2[:,0])*(r1[:,1]+r2[:,1])/2.
+  return phasefun
+
+
+def add_gauge_phase(h,phasefun):
+  """Add the phases of a gauge field to all the matrices of a
+  Hamiltonian, phasefun gives the phases for arrays of positions"""
+  g = h.geometry # geometry
+  r = np.array(g.r) # positions
+  charges = site_charges(h) # charges of the orbitals
+  def gauge(m,d): # add the phase to a matrix
+    return gauge_matrix(m,r,np.array(g.replicas(d)),phasefun,charges)
+  h.intra = gauge(h.intra,[0,0,0])
+  if h.dimensionality==0: return
+  if h.is_multicell: # multicell Hamiltonian
+    for t in h.hopping: t.m = gauge(t.m,t.dir)
+  elif h.dimensionality==1: h.inter = gauge(h.inter,[1,0,0])
+  elif h.dimensionality==2:
+    h.tx = gauge(h.tx,[1,0,0])
+    h.ty = gauge(h.ty,[0,1,0])
+    h.txy = gauge(h.txy,[1,1,0])
+    h.txmy = gauge(h.txmy,[1,-1,0])
+  else:
+    h.turn_multicell() # turn to multicell form
+    for t in h.hopping: t.m = gauge(t.m,t.dir)
+
+
+def add_peierls(h,mag_field=0.0,gauge="landau",vector_potential=None,
+                  **kwargs):
+  """Add the Peierls phase of an off-plane magnetic field, uniform or
+  given by a function, or of a vector potential"""
+  if vector_potential is not None: phasefun = potential_phase(vector_potential)
+  elif callable(mag_field): phasefun = field_phase(mag_field)
+  else: phasefun = uniform_field(mag_field,gauge=gauge)
+  add_gauge_phase(h,phasefun)
 
 
 
@@ -135,46 +147,19 @@ def is_number(s):
 def add_inplane_bfield(h,**kwargs):   add_bfield(h,mode="inplane",**kwargs)
 def add_offplane_bfield(h,**kwargs):   add_bfield(h,mode="offplane",**kwargs)
 
-def add_peierls(h,mag_field,**kwargs):
-    add_offplane_bfield(h,b=mag_field*2)
-
-
-
 
 
 def add_bfield(h,b=0.0,phi=0.0,mode="inplane"):
     """Add an in-plane magnetic field"""
     if h.dimensionality>2: raise # not implemented
-    if h.has_spin: gi = lambda i: i//2
-    else: gi = lambda i: i
-    if not h.is_multicell: 
-        h.turn_multicell() # turn to multicell form
     cphi = np.cos(phi*np.pi)
     sphi = np.sin(phi*np.pi)
-    g = h.geometry # get geometry
-    r = g.r # get positions
-    def get_phase(r,dr):
-        if mode=="inplane": return 2*r[2]*(dr[0]*sphi - dr[1]*cphi)
-        elif mode=="offplane": return r[1]*dr[0]/2.
-    def add_phase(m,r1,r2): # add the phase
-        mo = coo_matrix(m) # convert to coo matrix
-        data = mo.data +0.0j
-        k = 0
-        for (i,j,d) in zip(mo.row,mo.col,mo.data): # loop
-            r = (r1[gi(i)] + r2[gi(j)])/2.
-            dr = r1[gi(i)] - r2[gi(j)]
-            p = get_phase(r,dr)
-            data[k] *= np.exp(1j*b*p)
-            k += 1
-        out = csc_matrix((data,(mo.row,mo.col)),shape=mo.shape) 
-        return out.todense() # return matrix
-    # now add the phase to the Hamiltonian
-    h.intra = add_phase(h.intra,r,r) # add the phase
-    for i in range(len(h.hopping)):
-        t = h.hopping[i]
-        h.hopping[i].m = add_phase(t.m,r,g.replicas(t.dir))
+    def phasefun(r1,r2): # phases for arrays of positions
+        r = (r1 + r2)/2.
+        dr = r1 - r2
+        if mode=="inplane": p = 2*r[:,2]*(dr[:,0]*sphi - dr[:,1]*cphi)
+        elif mode=="offplane": p = r[:,1]*dr[:,0]/2.
+        else: raise
+        return b*p
+    add_gauge_phase(h,phasefun) # add the phase to the Hamiltonian
     return h
-
-
-
-
@@ -2,6 +2,7 @@
 from __future__ import print_function
 import scipy.linalg as lg
 import numpy as np
+from . import algebra
 
 
 def rkky_atom(hin,delta=0.001,i=None,filling=0.5):  
@@ -40,16 +41,13 @@ def rkky_atom(hin,delta=0.001,i=None,filling=0.5):
 
 
 
-def rkky0d(h,check=False):
-  """Calculate RKKY interaction for a 0d system"""
+def rkky0d(h,check=False,filling=0.5,temp=1e-7,rows=None):
+  """Calculate RKKY interaction for a 0d system, from the static
+  spin susceptibility obtained with a single diagonalization"""
   if h.dimensionality != 0: raise # only for 0d
-  if h.has_spin: raise # only for spinless
   if h.has_eh: raise # only for electrons
-  m = [] #empty matrix
-  for i in range(h.intra.shape[0]): # loop over sites
-    row = rkky_atom_v1(h,i=i)
-    m.append(row)
-  m = np.array(m)
+  m = rkky_matrix(h,filling=filling,temp=temp,rows=rows)
+  if rows is not None: return m # only some rows
   diff = np.sum(np.abs(m - np.transpose(m)))
   if check: # check that it is symmetric
     if diff>0.01: raise
@@ -60,6 +58,195 @@ def rkky0d(h,check=False):
 
 
 
+def fermi_from_filling(es,filling=0.5):
+  """Fermi energy in between the last occupied and the first
+  empty state"""
+  es = np.sort(es) # sorted energies
+  nfill = int(round(len(es)*filling)) # number of occupied states
+  if nfill<=0: return es[0] - 1.
+  if nfill>=len(es): return es[-1] + 1.
+  return (es[nfill] + es[nfill-1])/2.0 # fermi energy
+
+
+def site_components(h,mode=None):
+  """Signs of the orbitals of each site entering the response,
+  mode None uses orbitals, "charge" or "sz" sum the spin"""
+  if mode is None: return np.array([1.])
+  if not h.has_spin: raise
+  if mode=="charge": return np.array([1.,1.])
+  elif mode=="sz": return np.array([1.,-1.])
+  else: raise
+
+
+def pair_weights(ea,eb,temp=1e-7):
+  """Weights (fa-fb)/(Ea-Eb) of the pairs of states, using the
+  derivative of the occupation for degenerate states"""
+  from .chi import fermi_occupation
+  t = max([temp,1e-12]) # temperature
+  fa,fb = fermi_occupation(ea,t),fermi_occupation(eb,t)
+  de = ea[:,None] - eb[None,:] # energy differences
+  df = fa[:,None] - fb[None,:] # occupation differences
+  ii = np.abs(de)>1e-9 # non degenerate
+  w = -(fa*(1.-fa)/t)[:,None] + 0.*de # degenerate limit
+  w[ii] = df[ii]/de[ii]
+  return w
+
+
+def static_chi_block(ea,va,eb,vb,rows,signs,temp=1e-7):
+  """Sum over the pairs of states a,b of
+  w_ab conj(va(i))vb(i) conj(vb(j))va(j) for the rows i, with the
+  wavefunctions as (nsites,ncomponents,nstates) arrays. For each row
+  the sum over b is a single matrix product"""
+  w = pair_weights(ea,eb,temp=temp) # (na,nb)
+  out = np.zeros((len(rows),va.shape[0]),dtype=complex)
+  vbd = [np.conjugate(vb[:,c,:]).T for c in range(len(signs))] # (nb,n)
+  for (ir,i) in enumerate(rows):
+    p = np.conjugate(va[i,:,:].T*signs[None,:])@vb[i,:,:] # (na,nb)
+    wp = w*p # weight of each pair
+    for (c,s) in enumerate(signs): # loop over components
+      y = wp@vbd[c] # (na,n)
+      out[ir] += s*np.sum(va[:,c,:].T*y,axis=0)
+  return out
+
+
+def static_chi(esa,wa,esb=None,wb=None,rows=None,temp=1e-7,signs=[1.]):
+  """Static susceptibility chi_ij = sum_ab (fa-fb)/(Ea-Eb)
+  conj(wa(i))wb(i) conj(wb(j))wa(j), with the Fermi energy at zero
+  and the eigenvectors as columns. Only pairs with different occupation
+  enter, splitting the states in fully occupied and the rest"""
+  same = esb is None # same set of states
+  if same: esb,wb = esa,wa
+  signs = np.array(signs,dtype=float)
+  nc = len(signs) # number of components
+  wa = wa.reshape((wa.shape[0]//nc,nc,wa.shape[1])) # (nsites,nc,nstates)
+  wb = wb.reshape((wb.shape[0]//nc,nc,wb.shape[1]))
+  if rows is None: rows = range(wa.shape[0]) # all the sites
+  rows = np.array(rows,dtype=int)
+  from .chi import fermi_occupation
+  t = max([temp,1e-12]) # temperature
+  oa = fermi_occupation(esa,t)>1.-1e-10 # fully occupied
+  ob = fermi_occupation(esb,t)>1.-1e-10 # fully occupied
+  ta = np.any(np.abs(fermi_occupation(esa[~oa],t))>1e-10) # thermal states
+  tb = np.any(np.abs(fermi_occupation(esb[~ob],t))>1e-10)
+  def block(ia,ib): # contribution of two sets of states
+    if not np.any(ia) or not np.any(ib): return 0.
+    return static_chi_block(esa[ia],wa[:,:,ia],esb[ib],wb[:,:,ib],
+                              rows,signs,temp=temp)
+  out = np.zeros((len(rows),wa.shape[0]),dtype=complex) # storage
+  if same: # the pairs (a,b) and (b,a) are complex conjugate
+    out += 2.*block(oa,~ob)
+    if ta: out += block(~oa,~ob)
+    return out.real
+  out += block(oa,~ob) + block(~oa,ob)
+  if ta or tb: out += block(~oa,~ob)
+  return out
+
+
+def rkky_matrix(h,rows=None,filling=0.5,temp=1e-7,fermi=None):
+  """RKKY interaction J_ij between the sites of a 0d system, as minus
+  the static spin susceptibility, diagonalizing only once.
+  Spinless Hamiltonians are taken as spin degenerate. Only
+  the rows given are computed, returns an array (nrows,nsites)"""
+  if h.dimensionality != 0: raise # only for 0d
+  from .htk.eigenvectors import get_bloch_eigenvectors
+  (es,ws) = get_bloch_eigenvectors(h,[[0.,0.,0.]]) # diagonalize
+  es,ws = es[0],ws[0]
+  if fermi is None: fermi = fermi_from_filling(es,filling=filling)
+  if h.has_spin: signs,fac = site_components(h,"sz"),-1.
+  else: signs,fac = site_components(h),-2. # spin degenerate
+  return fac*static_chi(es-fermi,ws,rows=rows,temp=temp,signs=signs)
+
+
+def rkky_kpm(h,i=0,fermi=0.0,npol=400,ne=None,temp=1e-7,
+               kernel="jackson"):
+  """RKKY interaction J_ij between the site i and all the sites of a
+  0d system, using the Chebychev expansion of the Green's function,
+  J_ij = (1/pi) Im int f(w) G_ij(w) G_ji(w) dw for each spin channel.
+  Only sparse times dense products are used, so it scales linearly
+  with the size of the system"""
+  if h.dimensionality != 0: raise # only for 0d
+  from scipy.sparse import csr_matrix,identity
+  from . import kpm
+  from .chi import fermi_occupation
+  m = csr_matrix(h.intra,dtype=complex) # sparse matrix
+  n = m.shape[0] # dimension
+  emin,emax = kpm.spectral_bounds(m) # bounds of the spectrum
+  b = (emax+emin)/2. # center of the spectrum
+  a = (emax-emin)/2.*1.01 + 1e-7 # half width, with a safety margin
+  ms = csr_matrix((m - b*identity(n,dtype=complex,format="csr"))/a)
+  m2 = ms*2. # matrix entering the recursion
+  if h.has_spin: signs,fac = site_components(h,"sz"),1.
+  else: signs,fac = site_components(h),2. # spin degenerate
+  nc = len(signs) # number of components
+  vs = np.zeros((n,nc),dtype=complex) # initial vectors, site i
+  for c in range(nc): vs[nc*i+c,c] = 1.
+  mus = np.zeros((npol,n,nc),dtype=complex) # T_n|v>
+  mus[0] = vs
+  am = np.ascontiguousarray(vs) # T_0 |v>
+  a1 = np.zeros(am.shape,dtype=complex) # T_1 |v>
+  kpm.spmm_add(ms,am,a1)
+  mus[1] = a1
+  for j in range(2,npol):
+    am *= -1. # the buffer of the previous vector is reused
+    kpm.spmm_add(m2,a1,am) # recursion relation
+    mus[j] = am
+    am,a1 = a1,am # new variables
+  if kernel=="jackson": g = kpm.jackson_kernel(np.ones(npol))
+  elif kernel=="lorentz": g = kpm.lorentz_kernel(np.ones(npol))
+  else: g = np.ones(npol)
+  g[1:] *= 2. # prefactor of the expansion
+  mus = mus*g[:,None,None] # include the kernel
+  if ne is None: ne = 4*npol # number of energies
+  th = np.pi*(np.arange(ne)+0.5)/ne # Chebychev nodes, x = cos(th)
+  ws = fermi_occupation(a*np.cos(th)+b-fermi,temp) # occupations
+  # sum_n c_n exp(-i n th_k) for all the nodes with a FFT
+  ph = np.exp(-1j*np.pi*np.arange(npol)/(2*ne))[:,None,None]
+  out = np.zeros(n//nc) # storage
+  nchunk = nc*algebra.batch_size(ne*nc*nc,budget=1e6) # orbitals
+  for j in range(0,n,nchunk): # loop over chunks of orbitals
+    mj = mus[:,j:j+nchunk,:] # moments of this chunk
+    gij = np.fft.fft(mj*ph,n=2*ne,axis=0)[0:ne] # G_{js',is}, (ne,nj,nc)
+    gji = np.fft.fft(np.conjugate(mj)*ph,n=2*ne,axis=0)[0:ne] # G_{is,js'}
+    for (c,s) in enumerate(signs): # spin of the site i
+      p = gij[:,:,c]*gji[:,:,c]*(ws/np.sin(th))[:,None] # (ne,nj)
+      p = p.reshape((ne,p.shape[1]//nc,nc))@signs # spin of the site j
+      out[j//nc:j//nc+p.shape[1]] += s*np.sum(p,axis=0).imag
+  return -fac*out/(a*ne) # RKKY row
+
+
+def rkky_periodic(h,nk=10,R=[[0,0,0]],rows=None,temp=1e-7):
+  """RKKY interaction J_ij(R) between the sites of the unit cell and
+  the sites of the cell R of a periodic system, with the Fermi energy
+  at zero. The Bloch states are computed once in a kmesh, and the
+  susceptibility is summed over k for each q of the same mesh.
+  Returns an array (nR,nrows,nsites)"""
+  from .klist import kmesh
+  from .htk.eigenvectors import get_bloch_eigenvectors
+  dim = h.dimensionality # dimensionality
+  ks = np.array(kmesh(dim,nk=nk)) # kpoints
+  (es,ws) = get_bloch_eigenvectors(h,ks) # all the states
+  if h.has_spin: signs,fac = site_components(h,"sz"),-1.
+  else: signs,fac = site_components(h),-2. # spin degenerate
+  ns = h.intra.shape[0]//len(signs) # number of sites
+  nrows = ns if rows is None else len(rows)
+  R = np.array(R,dtype=float) # cells
+  out = np.zeros((len(R),nrows,ns),dtype=complex) # storage
+  shape = (nk,)*dim # shape of the kmesh
+  ik = np.arange(len(ks)).reshape(shape) # indexes of the kpoints
+  for iq in range(len(ks)): # loop over q, in the same mesh
+    q = ks[iq]
+    iq3 = np.unravel_index(iq,shape) # integer coordinates of q
+    ikq = np.roll(ik,[-j for j in iq3],axis=tuple(range(dim))).reshape(-1)
+    cq = 0. # chi(q)
+    for j in range(len(ks)): # sum over k
+      cq = cq + static_chi(es[j],ws[j],es[ikq[j]],ws[ikq[j]],rows=rows,
+                             temp=temp,signs=signs)
+    ph = np.exp(-2j*np.pi*R.dot(q)) # phases
+    out += ph[:,None,None]*cq[None,:,:]
+  return fac*out.real/len(ks)**2 # normalize
+
+
+
 def rkky_atom_v1(hin,delta=0.001,i=None,filling=0.5):  
   if hin.dimensionality != 0: raise # only for 0d
   if i is None: raise # default value
@@ -0,0 +1,177 @@
+# checkpoints of selfconsistent calculations, stored as npz files
+# keyed by a fingerprint of the Hamiltonian and the parameters of the run
+
+import numpy as np
+import hashlib
+import json
+import os
+from .. import algebra
+
+version = 1 # version of the format
+
+
+def fingerprint(h):
+    """Fingerprint of the structure of a Hamiltonian, the geometry,
+    dimension and hopping directions, but not the values of the hoppings,
+    so that runs with different fields can warm-start each other"""
+    g = h.geometry
+    s = hashlib.sha1() # hash
+    s.update(np.round(np.array(g.r,dtype=float),6).tobytes()) # positions
+    if h.dimensionality>0:
+        for a in [g.a1,g.a2,g.a3]:
+            s.update(np.round(np.array(a,dtype=float),6).tobytes())
+    s.update(str((h.dimensionality,h.intra.shape,h.has_spin)).encode())
+    if h.dimensionality>0 and h.is_multicell:
+        ds = sorted([tuple(np.array(t.dir,dtype=int)) for t in h.hopping])
+        s.update(str(ds).encode()) # hopping directions
+    return s.hexdigest()[0:16]
+
+
+def add_matrix(s,m):
+    """Update a hash with a matrix, in a canonical sparse form"""
+    from scipy.sparse import csr_matrix
+    m = csr_matrix(m) # canonical sparse form
+    m.sum_duplicates() ; m.eliminate_zeros() ; m.sort_indices()
+    s.update(str(m.shape).encode()) # dimension
+    s.update(m.indptr.tobytes()) ; s.update(m.indices.tobytes())
+    s.update(np.round(m.data.astype(complex),10).tobytes()) # values
+
+
+def hoppings_hash(h):
+    """Hash of the values of the intracell and intercell matrices"""
+    if h.dimensionality==0: ms = [h.intra]
+    elif h.is_multicell: # sorted by direction
+        ts = sorted(h.hopping,key=lambda t: tuple(np.array(t.dir,dtype=int)))
+        ms = [h.intra] + [t.m for t in ts]
+    elif h.dimensionality==1: ms = [h.intra,h.inter]
+    else: ms = [h.intra,h.tx,h.ty,h.txy,h.txmy]
+    s = hashlib.sha1() # hash
+    for m in ms: add_matrix(s,m)
+    return s.hexdigest()[0:12]
+
+
+def interaction_hash(v):
+    """Hash of an interaction, a dictionary of matrices"""
+    s = hashlib.sha1() # hash
+    for d in sorted(v.keys()): # sorted by direction
+        s.update(np.array(d,dtype=int).tobytes()) ; add_matrix(s,v[d])
+    return s.hexdigest()[0:12]
+
+
+def tolist(o):
+    """Numpy objects in a form that json can write"""
+    return np.array(o).tolist()
+
+
+def params2name(params):
+    """Name of the file for a set of parameters"""
+    s = json.dumps(params,sort_keys=True,default=tolist) # canonical form
+    return hashlib.sha1(s.encode()).hexdigest()[0:12]
+
+
+def dict2arrays(d,prefix):
+    """Transform a dictionary of matrices in arrays"""
+    keys = sorted(d.keys()) # ordered directions
+    return {prefix+"_keys":np.array(keys,dtype=int).reshape((len(keys),3)),
+            prefix+"_values":np.array([algebra.todense(d[k]) for k in keys])}
+
+
+def arrays2dict(f,prefix):
+    """Transform arrays back in a dictionary of matrices"""
+    keys = [tuple(k) for k in f[prefix+"_keys"]]
+    return dict([(k,m) for (k,m) in zip(keys,f[prefix+"_values"])])
+
+
+def get_store(checkpoint):
+    """Return a store, checkpoint can be a store, a folder or True"""
+    if checkpoint is None or checkpoint is False: return None
+    elif checkpoint is True: return CheckpointStore()
+    elif isinstance(checkpoint,str): return CheckpointStore(folder=checkpoint)
+    else: return checkpoint
+
+
+class CheckpointStore():
+    """Store of checkpoints for selfconsistent calculations"""
+    def __init__(self,folder="SCF_CHECKPOINTS"):
+        self.folder = folder
+    def path(self,h,params,v=None):
+        """File of a run, keyed by the structure and the hoppings of the
+        Hamiltonian, by the interaction v and by the parameters"""
+        name = fingerprint(h)+"_"+hoppings_hash(h)+"_" # Hamiltonian
+        if v is not None: name += interaction_hash(v)+"_" # interaction
+        return os.path.join(self.folder,name+params2name(params)+".npz")
+    def save(self,h,mf,params={},v=None,mixer=None,fermi=None,nk=None,
+               iteration=0,error=None):
+        """Save a checkpoint"""
+        os.makedirs(self.folder,exist_ok=True) # create folder
+        out = dict2arrays(mf,"mf") # mean field
+        if mixer is not None and len(mixer.xs)>0: # history of the mixer
+            for (i,(x,r)) in enumerate(zip(mixer.xs,mixer.rs)):
+                out.update(dict2arrays(x,"x"+str(i)))
+                out.update(dict2arrays(r,"r"+str(i)))
+        if mixer is not None:
+            out["mixer"] = np.array([mixer.mix,len(mixer.xs)])
+            out["errors"] = np.array(mixer.errors)
+        out["version"] = version
+        out["params"] = json.dumps(params,sort_keys=True,default=tolist)
+        out["fermi"] = np.nan if fermi is None else fermi
+        out["nk"] = -1 if nk is None else nk
+        out["iteration"] = iteration
+        out["error"] = np.nan if error is None else error
+        name = self.path(h,params,v=v)
+        tmp = name[:-4]+".tmp.npz" # write first a temporal file
+        np.savez_compressed(tmp,**out)
+        os.replace(tmp,name) # so a killed run leaves a valid file
+    def read(self,name,mixer=None):
+        """Read a checkpoint, restoring the history of the mixer"""
+        with np.load(name,allow_pickle=False) as f:
+            if int(f["version"])!=version: raise # incompatible format
+            out = {"mf":arrays2dict(f,"mf"),
+                   "params":json.loads(str(f["params"])),
+                   "fermi":float(f["fermi"]),"nk":int(f["nk"]),
+                   "iteration":int(f["iteration"]),"error":float(f["error"])}
+            if mixer is not None and "mixer" in f:
+                mixer.mix = float(f["mixer"][0])
+                n = int(f["mixer"][1]) # length of the history
+                mixer.xs = [arrays2dict(f,"x"+str(i)) for i in range(n)]
+                mixer.rs = [arrays2dict(f,"r"+str(i)) for i in range(n)]
+                mixer.errors = list(f["errors"])
+        return out
+    def load(self,h,params={},v=None,mixer=None):
+        """Load the checkpoint of exactly these parameters, None if
+        it does not exist"""
+        name = self.path(h,params,v=v)
+        if not os.path.exists(name): return None
+        return self.read(name,mixer=mixer)
+    def closest(self,h,params={}):
+        """Load the stored solution with the same structure and the
+        closest parameters, None if there is none. The values of the
+        hoppings and the interaction are ignored, this is only meant
+        for a warm start"""
+        if not os.path.isdir(self.folder): return None
+        fp = fingerprint(h)+"_" # fingerprint
+        best,dbest = None,np.inf
+        for name in os.listdir(self.folder):
+            if not name.startswith(fp) or name.endswith(".tmp.npz"): continue
+            name = os.path.join(self.folder,name)
+            with np.load(name,allow_pickle=False) as f:
+                p = json.loads(str(f["params"])) # parameters
+            if sorted(p.keys())!=sorted(params.keys()): continue
+            d = params_distance(p,params) # distance
+            if d<dbest: best,dbest = name,d # store
+        if best is None: return None
+        return self.read(best)
+
+
+def params_distance(p1,p2):
+    """Distance between two sets of parameters, each of them
+    relative to its magnitude"""
+    d = 0.
+    for key in p1:
+        try: a,b = np.array(p1[key],dtype=float),np.array(p2[key],dtype=float)
+        except (ValueError,TypeError): a = b = None # not a number
+        if a is None or np.any(np.isnan(a)) or np.any(np.isnan(b)):
+            if p1[key]!=p2[key]: return np.inf # different
+            continue
+        d += np.sum((a-b)**2)/(np.sum(a**2+b**2)/2.+1e-12)
+    return np.sqrt(d)
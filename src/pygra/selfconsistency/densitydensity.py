@@ -6,8 +6,9 @@ import numpy as np
 import time
 import os
 from .. import densitymatrix
+from .. import algebra
 from copy import deepcopy
-from numba import jit
+from scipy.sparse import coo_matrix,csr_matrix
 
 class Interaction():
     def __init__(self,h=None):
@@ -22,86 +23,48 @@ class Interaction():
 
 
 
+def sparse_interaction(v):
+    """Store the interaction dictionary as COO matrices, without zeros"""
+    out = dict()
+    for d in v:
+        m = coo_matrix(v[d]) # sparse matrix
+        m.sum_duplicates() ; m.eliminate_zeros() # only the couplings
+        out[d] = m # store
+    return out
+
+
 def normal_term(v,dm):
     """Return the normal term of the mean field"""
-    out = dm*0.0 # initialize
-    return normal_term_jit(v,dm,out) # return the normal term
+    return (normal_term_ij(v,dm) + normal_term_ji(v,dm) + 
+              normal_term_ii(v,dm) + normal_term_jj(v,dm)).tocsr()
 
 
 
 def normal_term_ii(v,dm):
     """Return the normal term of the mean field"""
-    out = dm*0.0 # initialize
-    return normal_term_ii_jit(v,dm,out) # return the normal term
+    v = coo_matrix(v) ; n = v.shape[0]
+    dd = np.asarray(dm).diagonal() # occupations
+    ds = v@dd # sum_j v_ij dm_jj
+    return csr_matrix((ds,(range(n),range(n))),shape=v.shape,dtype=complex)
 
 
 def normal_term_jj(v,dm):
     """Return the normal term of the mean field"""
-    out = dm*0.0 # initialize
-    return normal_term_jj_jit(v,dm,out) # return the normal term
+    return normal_term_ii(coo_matrix(v).T,dm)
 
 
 def normal_term_ij(v,dm):
     """Return the normal term of the mean field"""
-    out = dm*0.0 # initialize
-    return normal_term_ij_jit(v,dm,out) # return the normal term
+    v = coo_matrix(v) # sparse matrix
+    data = -v.data*np.asarray(dm)[v.col,v.row] # - v_ij dm_ji
+    return csr_matrix((data,(v.row,v.col)),shape=v.shape,dtype=complex)
 
 
 def normal_term_ji(v,dm):
     """Return the normal term of the mean field"""
-    out = dm*0.0 # initialize
-    return normal_term_ji_jit(v,dm,out) # return the normal term
-
-@jit
-def normal_term_jit(v,dm,out):
-    """Return the normal terms, jit function"""
-    n = len(v[0])
-    for i in range(n): # loop
-      for j in range(n): # loop
-        out[i,j] = out[i,j] - v[i,j]*dm[j,i]
-        out[j,i] = out[j,i] - v[i,j]*dm[i,j]
-        out[i,i] = out[i,i] + v[i,j]*dm[j,j]
-        out[j,j] = out[j,j] + v[i,j]*dm[i,i]
-    return out
-
-
-@jit
-def normal_term_ii_jit(v,dm,out):
-    """Return the normal terms, jit function"""
-    n = len(v[0])
-    for i in range(n): # loop
-      for j in range(n): # loop
-        out[i,i] = out[i,i] + v[i,j]*dm[j,j]
-    return out
-
-@jit
-def normal_term_jj_jit(v,dm,out):
-    """Return the normal terms, jit function"""
-    n = len(v[0])
-    for i in range(n): # loop
-      for j in range(n): # loop
-        out[j,j] = out[j,j] + v[i,j]*dm[i,i]
-    return out
-
-
-@jit
-def normal_term_ij_jit(v,dm,out):
-    """Return the normal terms, jit function"""
-    n = len(v[0])
-    for i in range(n): # loop
-      for j in range(n): # loop
-        out[i,j] = out[i,j] - v[i,j]*dm[j,i]
-    return out
-
-
-@jit
-def normal_term_ji_jit(v,dm,out):
-    """Return the normal terms, jit function"""
-    n = len(v[0])
-    for i in range(n): # loop
-      for j in range(n): # loop
-        out[j,i] = out[j,i] - v[i,j]*dm[i,j]
-    return out
+    v = coo_matrix(v) # sparse matrix
+    data = -v.data*np.asarray(dm)[v.row,v.col] # - v_ij dm_ij
+    return csr_matrix((data,(v.col,v.row)),shape=v.shape,dtype=complex)
 
 
 
@@ -109,7 +72,8 @@ def update_hamiltonian(tdict,mf):
     """Update the hoppings with the mean field"""
     out = deepcopy(tdict) # copy
     for key in mf:
-        out[key] = tdict[key] + mf[key] # add contribution
+        if key not in tdict: out[key] = algebra.todense(mf[key]) # new
+        else: out[key] = tdict[key] + mf[key] # add contribution
     return out # return dictionary
 
 
@@ -128,6 +92,75 @@ def mix_mf(mf,mf0,mix=0.8):
 
 
 
+class PulayMixer():
+    """Pulay (DIIS) mixing of mean field dictionaries. Linear mixing is
+    used until the residual is below start, the mixing is reduced and the
+    history restarted if the residual grows or stagnates, and the
+    mixing is increased while the residual decreases"""
+    def __init__(self,mix=0.5,history=8,mixmin=0.02,mixmax=1.0,start=1e-2):
+        self.mix = mix # mixing parameter
+        self.start = start # linear mixing until the residual is below this
+        self.history = history # number of stored iterations
+        self.mixmin,self.mixmax = mixmin,mixmax # bounds for the mixing
+        self.restart()
+        self.errors = [] # residual norms
+    def restart(self):
+        self.xs = [] # input mean fields
+        self.rs = [] # residuals
+    def update(self,mf_in,mf_out):
+        """Return the next input mean field"""
+        todense = lambda m: np.asarray(algebra.todense(m)) # dense array
+        x = dict([(key,todense(mf_in[key]) if key in mf_in else 
+                    0.*todense(mf_out[key])) for key in mf_out]) # input
+        r = dict([(key,todense(mf_out[key]) - x[key]) 
+                    for key in mf_out]) # residual
+        nr = sum([np.prod(r[key].shape) for key in r]) # number of elements
+        e = np.sqrt(dict_dot(r,r)/nr) # rms of the residual
+        if len(self.errors)>0:
+            emin = min(self.errors) # best residual so far
+            nbest = len(self.errors) - np.argmin(self.errors) # steps since
+            if e>2.*emin or (nbest>=self.history and e>emin): # restart
+                self.restart() # the history is not helping
+                self.errors = [e] # forget the previous errors
+                self.mix = max([self.mix/2.,self.mixmin])
+            elif e<self.errors[-1]: # going down, be more agressive
+                self.mix = min([self.mix*1.1,self.mixmax])
+        self.errors.append(e) # store
+        if e>self.start: # far from the solution, only linear mixing
+          self.restart()
+          return dict([(key,x[key] + self.mix*r[key]) for key in x])
+        self.xs.append(x) ; self.rs.append(r) # store
+        self.xs = self.xs[-self.history:] # bounded history
+        self.rs = self.rs[-self.history:] # bounded history
+        n = len(self.rs) # length of the history
+        if n==1: cs = np.array([1.])
+        else: # solve the DIIS equations
+          B = np.zeros((n+1,n+1)) # overlap of residuals
+          for i in range(n):
+            for j in range(i,n):
+              B[i,j] = B[j,i] = dict_dot(self.rs[i],self.rs[j])
+          B[0:n,0:n] /= np.max(np.abs(B[0:n,0:n])) # normalize
+          B[n,0:n] = B[0:n,n] = 1.0 # constraint
+          b = np.zeros(n+1) ; b[n] = 1.0
+          cs = np.linalg.lstsq(B,b,rcond=1e-12)[0][0:n] # coefficients
+          if np.max(np.abs(cs))>1e3: # ill conditioned, restart
+            self.xs,self.rs = self.xs[-1:],self.rs[-1:]
+            cs = np.array([1.])
+        out = dict() # new mean field
+        for key in x:
+          out[key] = sum([c*(xi[key] + self.mix*ri[key]) for (c,xi,ri) 
+                           in zip(cs,self.xs,self.rs)])
+        return out
+
+
+
+def dict_dot(a,b):
+    """Real scalar product of two dictionaries of matrices"""
+    return sum([np.sum(np.multiply(np.conjugate(a[key]),b[key])).real
+                  for key in a])
+
+
+
 def diff_mf(mf0,mf):
     """Difference mean fields"""
     out = 0.0 # initialize
@@ -161,36 +194,30 @@ def set_hoppings(h,hop):
         hopping.append(t) # store
     h.hopping = hopping # store
 
-def get_dm(h,nk=1):
+def get_dm(h,nk=1,smearing=None):
     """Get the density matrix"""
     ds = [(0,0,0)] # directions
     if h.dimensionality>0:
       for t in h.hopping: ds.append(tuple(t.dir)) # store
-    dms = densitymatrix.full_dm(h,ds=ds,nk=nk) # get all the density matrices
+    dms = densitymatrix.full_dm(h,ds=ds,nk=nk,
+              smearing=smearing) # get all the density matrices
     dm = dict()
     for i in range(len(ds)): 
         dm[ds[i]] = dms[i] # store
     return dm # return dictionary with the density matrix
 
 def get_mf(v,dm):
-    """Get the mean field"""
-    zero = dm[(0,0,0)]*0. # zero
+    """Get the mean field, only the non zero couplings of v are used"""
+    n = dm[(0,0,0)].shape[0] # dimension
     mf = dict()
-    for d in v: mf[d] = zero.copy()  # initialize
-    # compute the contribution to the mean field
-    # onsite term
-#    mf[(0,0,0)] = normal_term(v[(0,0,0)],dm[(0,0,0)]) 
+    for d in v: mf[d] = csr_matrix((n,n),dtype=complex)  # initialize
     def dag(m): return m.T.conjugate()
     for d in v: # loop over directions
         d2 = (-d[0],-d[1],-d[2]) # minus this direction
+        if d2 not in mf: mf[d2] = csr_matrix((n,n),dtype=complex)
         # add the normal terms
         m = normal_term_ij(v[d],dm[d2]) # get matrix
-#        print(d)
-#        print(np.abs(m))
-        #print(np.abs(v[d]))
-        #print(np.abs(dm[d2]))
         mf[d] = mf[d] + m # add normal term
-        #if d==(0,0,0): 
         mf[d2] = mf[d2] + dag(m) # add normal term
         m = normal_term_ii(v[d],dm[(0,0,0)]) # get matrix
         mf[(0,0,0)] = mf[(0,0,0)] + m # add normal term
@@ -201,14 +228,12 @@ def get_mf(v,dm):
 def get_dc_energy(v,dm):
     """Compute double counting energy"""
     out = 0.0
+    dd = np.asarray(dm[(0,0,0)]).diagonal() # occupations
     for d in v: # loop over interactions
-        d2 = (-d[0],-d[1],-d[2]) # minus this direction
-        n = v[d].shape[0] # shape
-        for i in range(n): # loop
-          for j in range(n): # loop
-              out -= v[d][i,j]*dm[(0,0,0)][i,i]*dm[(0,0,0)][j,j]
-              c = dm[d][i,j] # cross term
-              out += v[d][i,j]*c*np.conjugate(c) # add contribution
+        m = coo_matrix(v[d]) # sparse matrix
+        c = np.asarray(dm[d])[m.row,m.col] # cross terms
+        out -= np.sum(m.data*dd[m.row]*dd[m.col])
+        out += np.sum(m.data*c*np.conjugate(c)) # add contribution
     print("DC energy",out.real)
     return out.real
 
@@ -223,14 +248,33 @@ mf_file = "MF.pkl"
 
 def generic_densitydensity(h0,mf=None,mix=0.9,v=None,nk=8,solver="plain",
         maxerror=1e-5,filling=None,callback_mf=None,callback_dm=None,
-        load_mf=True,
+        load_mf=True,history=8,verbose=True,checkpoint=None,
+        checkpoint_every=10,params=None,
         callback_h=None,**kwargs):
-    """Perform the SCF mean field"""
+    """Perform the SCF mean field. solver="diis" uses Pulay mixing
+    with a bounded history, the information of each iteration is
+    returned in scf.telemetry. With checkpoint (a CheckpointStore, a
+    folder or True) the run is saved every checkpoint_every iterations,
+    and restarted from the checkpoint of the same Hamiltonian, interaction
+    and params, or warm-started from the closest params of the same
+    structure"""
 #    if not h0.check_mode("spinless"): raise # sanity check
     mf = obj2mf(mf)
     h1 = h0.copy() # initial Hamiltonian
     h1.turn_dense()
     h1.nk = nk # store the number of kpoints
+    v = sparse_interaction(v) # only the non zero couplings
+    from .checkpoint import get_store
+    store = get_store(checkpoint) # store for the checkpoints
+    if params is None: params = dict() # parameters of the run
+    if solver in ["diis","pulay"]: mixer = PulayMixer(mix=mix,history=history)
+    else: mixer = None # linear mixing
+    if store is not None and mf is None: # look for a previous run
+        cp = store.load(h1,params,v=v,mixer=mixer) # restart this run
+        if cp is None: cp = store.closest(h1,params) # or a similar run
+        if cp is not None: 
+            mf = cp["mf"] # initial guess
+            if verbose: print("Starting from checkpoint",cp["params"])
     if mf is None:
       try: 
           if load_mf: mf = inout.load(mf_file) # load the file
@@ -252,40 +296,51 @@ def generic_densitydensity(h0,mf=None,mix=0.9,v=None,nk=8,solver="plain",
       set_hoppings(h,hop) # set the new hoppings in the Hamiltonian
       if callback_h is not None:
           h = callback_h(h) # callback for the Hamiltonian
-      t0 = time.clock() # time
+      t0 = time.perf_counter() # time
       dm = get_dm(h,nk=nk) # get the density matrix
       if callback_dm is not None:
           dm = callback_dm(dm) # callback for the density matrix
-      t1 = time.clock() # time
+      t1 = time.perf_counter() # time
       mf = get_mf(v,dm) # return the mean field
       if callback_mf is not None:
           mf = callback_mf(mf) # callback for the mean field
-      t2 = time.clock() # time
-      print("Time in density matrix = ",t1-t0) # Difference
-      print("Time in the normal term = ",t2-t1) # Difference
+      t2 = time.perf_counter() # time
       scf = SCF() # create object
       scf.hamiltonian = h # store
       scf.mf = mf # store mean field
       if os.path.exists("STOP"): scf.mf = mf0 # use the guess
       scf.dm = dm # store density matrix
       scf.v = v # store interaction
+      scf.timings = {"dm":t1-t0,"mf":t2-t1} # time in each step
       return scf
-    if solver=="plain":
-      do_scf = True
-      while do_scf:
+    def save_checkpoint(scf,it,diff): # save the current state
+      if store is None: return
+      store.save(h1,scf.mf,params=params,v=v,mixer=mixer,nk=nk,iteration=it,
+                  fermi=getattr(scf.hamiltonian,"fermi",None),error=diff)
+    if solver in ["plain","diis","pulay"]:
+      telemetry = [] # information of each iteration
+      while True:
         scf = f(mf) # new vector
         mfnew = scf.mf # new vector
-        t0 = time.clock() # time
+        t0 = time.perf_counter() # time
         diff = diff_mf(mfnew,mf) # mix mean field
-        mf = mix_mf(mfnew,mf,mix=mix) # mix mean field
-        t1 = time.clock() # time
-        print("Time in mixing",t1-t0)
-        print("ERROR",diff)
-        #print("Mixing",dmix)
-        print()
+        if mixer is None: mf = mix_mf(mfnew,mf,mix=mix) # mix mean field
+        else: mf = mixer.update(mf,mfnew) # extrapolate the mean field
+        t1 = time.perf_counter() # time
+        it = {"iteration":len(telemetry),"error":diff,
+              "time_dm":scf.timings["dm"],"time_mf":scf.timings["mf"],
+              "time_mix":t1-t0}
+        if mixer is not None: 
+            it["mix"] = mixer.mix ; it["history"] = len(mixer.xs)
+        telemetry.append(it) # store
+        scf.telemetry = telemetry # store in the object
+        if verbose: print("ERROR",diff)
         if diff<maxerror: 
             inout.save(scf.mf,mf_file) # save the mean field
+            save_checkpoint(scf,len(telemetry),diff) # converged solution
             return scf
+        if len(telemetry)%checkpoint_every==0: # save from time to time
+            save_checkpoint(scf,len(telemetry),diff)
     else: # use different solvers
         scf = f(mf) # perform one iteration
         fmf2a = get_mf2array(scf) # convert MF to array
@@ -316,6 +371,7 @@ def generic_densitydensity(h0,mf=None,mix=0.9,v=None,nk=8,solver="plain",
         mf = fa2mf(x) # transform to MF
         scf = f(mf) # compute the SCF with the solution
         inout.save(scf.mf,mf_file) # save the mean field
+        save_checkpoint(scf,0,None) # store the solution
         return scf # return the mean field
 
 
@@ -324,6 +380,7 @@ def get_mf2array(scf):
     nt = len(scf.mf) # number of terms in the dictionary
     n = scf.mf[(0,0,0)].shape[0]
     def fmf2a(mf):
+        mf = dict([(key,algebra.todense(mf[key])) for key in mf]) # dense
         print(mf[(0,0,0)].real)
         out = [mf[key].real for key in mf] # to plain array
         out += [mf[key].imag for key in mf] # to plain array
@@ -363,6 +420,7 @@ def densitydensity(h,filling=0.5,**kwargs):
         h.shift_fermi(-fermi) # shift by the fermi energy
         return h
 #    callback_h = None
+    kwargs["params"] = dict(kwargs.get("params") or {},filling=filling)
     scf = generic_densitydensity(h,callback_h=callback_h,**kwargs)
     # Now compute the total energy
     h = scf.hamiltonian
@@ -391,6 +449,7 @@ def hubbard(h,U=1.0,**kwargs):
         zero[2*i,2*i+1] = U # Hubbard interaction
     v = dict() # dictionary
     v[(0,0,0)] = zero 
+    kwargs["params"] = dict(kwargs.get("params") or {},U=U)
     return densitydensity(h,v=v,**kwargs)
 
 
@@ -424,6 +483,37 @@ def Vinteraction(h,V1=0.0,V2=0.0,U=0.0,**kwargs):
         for i in range(n):
             v[(0,0,0)][2*i,2*i+1] += U # add
         #    v[(0,0,0)][2*i+1,2*i] += U/2. # add
+    kwargs["params"] = dict(kwargs.get("params") or {},U=U,V1=V1,V2=V2)
+    return densitydensity(h,v=v,**kwargs)
+
+
+
+def coulomb(h,vc=1.0,U=0.0,rcut=8.0,screening=4.0,vfun=None,ewald=False,
+              **kwargs):
+    """Wrapper to perform a mean field calculation with long range
+    density-density interactions, see coulomb.coulomb_kernel.
+    With ewald=True the interaction is folded in the unit cell, so that
+    only the Hartree term is exact and the Fock term is approximate"""
+    if h.has_eh: raise # not implemented
+    h = h.get_multicell() # multicell Hamiltonian
+    h.turn_dense()
+    from ..coulomb import coulomb_kernel
+    # both orderings of each pair are present, hence the 1/2
+    vs = coulomb_kernel(h.geometry,vfun=vfun,vc=vc,rcut=rcut,
+            screening=screening,ewald=ewald)
+    v = dict() # dictionary
+    for d in vs: 
+        m = vs[d].toarray()/2. # dense matrix
+        if h.has_spin: m = np.kron(m,np.ones((2,2))) # all the spin channels
+        v[d] = m.astype(complex) # store
+    if (0,0,0) not in v: v[(0,0,0)] = h.intra*0. # initialize
+    if h.has_spin:
+        n = h.intra.shape[0]//2 # number of sites
+        for i in range(n): v[(0,0,0)][2*i,2*i+1] += U # Hubbard term
+    name = None if vfun is None else getattr(vfun,"__name__",
+                                              type(vfun).__name__) # kernel
+    kwargs["params"] = dict(kwargs.get("params") or {},vc=vc,U=U,rcut=rcut,
+                              screening=screening,ewald=ewald,vfun=name)
     return densitydensity(h,v=v,**kwargs)
 
 
@@ -1,5 +1,7 @@
 import numpy as np
 from scipy.sparse import csc_matrix
+from .neighbor import vectorized_hopping
+from .neighbor import neighbor_pairs
 
 try:
     from . import specialhoppingf90
@@ -15,74 +17,62 @@ def twisted(cutoff=5.0,ti=0.3,lambi=8.0,
   """Hopping for twisted bilayer graphene"""
   cutoff2 = cutoff**2 # cutoff in distance
   def fun(r1,r2):
-    rr = (r1-r2) # distance
-    rr = rr.dot(rr) # distance
-    if rr>cutoff2: return 0.0 # too far
-    if rr<0.001: return 0.0 # same atom
-    dx = r1[0]-r2[0]
-    dy = r1[1]-r2[1]
-    dz = r1[2]-r2[2]
+    dr = r1-r2 # distance vectors
+    dx,dy,dz = dr[:,0],dr[:,1],dr[:,2]
+    rr = dx*dx + dy*dy + dz*dz # square distance
+    keep = (rr<=cutoff2)*(rr>=0.001) # not too far and not the same atom
+    rr = np.where(keep,rr,1.0) # avoid dividing by zero
     r = np.sqrt(rr)
-#    if r2>100.0: return 0.0 # too far
-    if (r-1.0)<-0.1: 
-      print(r)
-      raise
+    if np.any(keep*((r-1.0)<-0.1)): raise # sites too close
     out = -(dx*dx + dy*dy)/rr*np.exp(-lamb*(r-1.0))*np.exp(-lambz*dz*dz)
-    out += -ti*(dz*dz)/rr*np.exp(-lambi*(r-dl))
+    out = out - ti*(dz*dz)/rr*np.exp(-lambi*(r-dl))
     #### fix for magnetic field
     cphi = np.cos(phi*np.pi)
     sphi = np.sin(phi*np.pi)
-    r = (r1+r2)/2.
-    dr = r1-r2
-    p = 2*r[2]*(dr[0]*sphi - dr[1]*cphi)
-    out *= np.exp(1j*b*p)
+    zm = (r1[:,2]+r2[:,2])/2. # average z
+    p = 2*zm*(dx*sphi - dy*cphi)
+    out = out*np.exp(1j*b*p)
     #####
-    return out
-  return fun
+    return out*keep
+  return vectorized_hopping(fun,cutoff=cutoff)
 
 
 def twisted_matrix(cutoff=5.0,ti=0.3,lambi=8.0,
         lamb=12.0,dl=3.0,lambz=10.0,**kwargs):
   """Function capable of returning the hopping matrix
   for twisted bilayer graphene"""
-  if use_fortran:
-    from . import specialhoppingf90
-    def funhop(r1,r2):
-      """Function that returns a hopping matrix"""
-      nr = len(r1) # 
-      nmax = len(r1)*int(10*cutoff**2) # maximum number of hoppings
-      (ii,jj,ts,nout) = specialhoppingf90.twistedhopping(r1,r2,nmax,
-                                  cutoff,ti,lamb,lambi,lambz,1e-5,dl)
-      if nout>nmax: raise # sanity check
-      ts = ts[0:nout]
-      ii = ii[0:nout]
-      jj = jj[0:nout]
-      out = csc_matrix((ts,(ii-1,jj-1)),shape=(nr,nr),dtype=np.complex) # matrix
-      return out
-  else:
-    print("Using Python function in twisted")
-    def funhop(r1,r2):
-      fh = twisted(cutoff=cutoff,ti=ti,lambi=lambi,lamb=lamb,dl=dl,**kwargs)
-      m = np.array([[fh(r1i,r2j) for r1i in r1] for r2j in r2],dtype=np.complex)
-      m = csc_matrix(m,dtype=np.complex).T
-      m.eliminate_zeros()
-      return m
-#      raise
+  def funhop(r1,r2):
+    """Function that returns a hopping matrix"""
+    ii,jj,ts = twisted_pairs(r1,r2,cutoff=cutoff,ti=ti,lambi=lambi,
+                lamb=lamb,dl=dl,lambz=lambz,**kwargs) # pairs within cutoff
+    return csc_matrix((ts,(ii,jj)),shape=(len(r1),len(r2)),
+                        dtype=complex) # matrix
   return funhop # function
 
 
 
 
+def twisted_pairs(r1,r2,cutoff=5.0,**kwargs):
+  """Hoppings for twisted bilayer graphene between the pairs of
+  sites closer than the cutoff, returns COO arrays (i,j,t)"""
+  r1 = np.array(r1) ; r2 = np.array(r2)
+  ii,jj,ds = neighbor_pairs(r1,r2,cutoff,rmin=np.sqrt(0.001)) # pairs
+  fun = twisted(cutoff=cutoff,**kwargs) # hopping function
+  return ii,jj,fun(r1[ii],r2[jj])
+
+
 def multilayer(ti=0.3,dz=3.0):
     """Return hopping for a multilayer"""
     def fhop(ri,rj):
       """Function to compute the hopping"""
-      dr = ri-rj ; dr2 = dr.dot(dr) # distance
-      if abs(1.0-dr2)<0.01: return 1.0 # first neighbors
+      dr = ri-rj ; dr2 = np.sum(dr*dr,axis=1) # distance
+      out = np.zeros(len(dr2)) # output
+      out[np.abs(1.0-dr2)<0.01] = 1.0 # first neighbors
       # interlayer hopping (distance between the layers is 3)
-      if abs(dz**2-dr2)<0.01 and abs(dz-abs(dr[2]))<0.01: return ti
-      return 0.0 # else
-    return fhop
+      inter = (np.abs(dz**2-dr2)<0.01)*(np.abs(dz-np.abs(dr[:,2]))<0.01)
+      out[inter] = ti
+      return out
+    return vectorized_hopping(fhop,cutoff=max(1.1,abs(dz)+0.1))
 
 
 
@@ -104,16 +94,13 @@ def phase_C3(g,phi=0.0):
     def fun(r1,r2):
         """Function to compute hoppings"""
         dr = r1-r2
-        if 0.99<dr.dot(dr)<1.01: # first neighbors
-            zi = dr[0]+1j*dr[1]
-            for zj in zs: # one of the three directions
-                d = np.abs(zi/zj-1.0)
-                print(d)
-                if d<1e-2: 
-                    return np.exp(1j*phi)
-            else: return np.exp(-1j*phi)
-        return 0.0
-    return fun
+        dr2 = np.sum(dr*dr,axis=1) # square distance
+        zi = dr[:,0]+1j*dr[:,1]
+        # one of the three directions
+        pos = np.any([np.abs(zi/zj-1.0)<1e-2 for zj in zs],axis=0)
+        out = np.where(pos,np.exp(1j*phi),np.exp(-1j*phi))
+        return out*((0.99<dr2)*(dr2<1.01)) # first neighbors
+    return vectorized_hopping(fun,cutoff=1.1)
 
 
 
@@ -17,8 +17,13 @@ arpack_maxiter = 10000
 def fermi_surface(h,write=True,output_file="FERMI_MAP.OUT",
                     e=0.0,nk=50,nsuper=1,reciprocal=True,
                     delta=None,refine_delta=1.0,operator=None,
-                    mode='full',num_waves=2,info=True):
+                    mode='full',num_waves=2,info=True,levels=4):
   """Calculates the Fermi surface of a 2d system"""
+  if mode=="adaptive": # refine only close to the Fermi surface
+    nk0 = max([2,nk//2**levels]) # initial grid, nk is the finest one
+    return fermi_surface_adaptive(h,write=write,output_file=output_file,
+              e=e,nk=nk0,levels=levels,nsuper=nsuper,reciprocal=reciprocal,
+              delta=delta,operator=operator)
   if operator is None:
     operator = np.matrix(np.identity(h.intra.shape[0]))
   if h.dimensionality!=2: raise  # continue if two dimensional
@@ -85,6 +90,40 @@ def fermi_surface(h,write=True,output_file="FERMI_MAP.OUT",
 
 
 
+def fermi_surface_adaptive(h,write=True,output_file="FERMI_MAP.OUT",
+                    e=0.0,nk=16,levels=4,nsuper=1,reciprocal=True,
+                    delta=None,operator=None,nkmap=None,**kwargs):
+  """Calculates the Fermi surface of a 2d system, refining the kmesh
+  only where the spectral weight is large. Returns the scattered
+  kpoints and weights, and writes an interpolated map"""
+  from .klist import adaptive_kmesh,interpolate_kmap
+  if h.dimensionality!=2: raise  # continue if two dimensional
+  if reciprocal: R = np.array(h.geometry.get_k2K()) # get matrix
+  else:  R = np.identity(3) # get identity
+  if delta is None: delta = 2.*nsuper/(nk*2**levels) # finest spacing
+  if operator is not None: operator = np.array(operator) # as array
+  def f(rs): # spectral weight in a set of kpoints
+    ks = np.concatenate([rs,np.zeros((len(rs),1))],axis=1)@R.T # kpoints
+    if operator is None: # only the eigenvalues
+      es = parallel.eigh_batch(h,ks,eigvals_only=True)
+      ws = np.ones(es.shape) # weights
+    else: # expectation value of the operator
+      es,vs = parallel.eigh_batch(h,ks)
+      ws = np.einsum("kin,ij,kjn->kn",np.conjugate(vs),operator,vs).real
+    return np.sum(ws*delta/((e-es)**2+delta**2),axis=1) # weights
+  bounds = [[-nsuper,nsuper],[-nsuper,nsuper]] # box
+  rs,ds = adaptive_kmesh(f,bounds=bounds,nk=nk,levels=levels,**kwargs)
+  if write:  # optionally, write in file
+    np.savetxt(output_file.replace(".OUT","_ADAPTIVE.OUT"),
+                 np.array([rs[:,0],rs[:,1],ds]).T) # scattered data
+    if nkmap is None: nkmap = min([nk*2**levels,200]) # size of the map
+    xs,ys,zs = interpolate_kmap(rs,ds,nk=nkmap,bounds=bounds)
+    np.savetxt(output_file,np.array([xs,ys,zs]).T) # uniform map
+  return (rs[:,0],rs[:,1],ds) # return result
+
+
+
+
 def boolean_fermi_surface(h,write=True,output_file="BOOL_FERMI_MAP.OUT",
                     e=0.0,nk=50,nsuper=1,reciprocal=False,
                     delta=None):
@@ -255,7 +294,7 @@ def ev2d(h,nk=50,nsuper=1,reciprocal=False,
 def ev(h,operator=None,nk=30,**kwargs):
   """Calculate the expectation value of a certain number of operators"""
   from .densitymatrix import full_dm
-  dm = full_dm(h,nk=nk,use_fortran=True,**kwargs)
+  dm = full_dm(h,nk=nk,**kwargs)
   if operator is None: # no operator given on input
     operator = [] # empty list
   elif not isinstance(operator,list): # if it is not a list
@@ -297,6 +336,10 @@ def total_energy(h,nk=10,nbands=None,use_kpm=False,random=False,
     from .klist import kmesh
     kp = kmesh(h.dimensionality,nk=nk)
     etot = np.mean(parallel.pcall(enek,kp)) # compute total energy
+  elif mode=="ibz": # irreducible wedge of the mesh
+    from .klist import irreducible_kmesh
+    kp,ws = irreducible_kmesh(h,nk=nk)
+    etot = np.sum(np.array(parallel.pcall(enek,kp))*ws) # total energy
   elif mode=="random":
     kp = [np.random.random(3) for i in range(nk)] # random points
     etot = np.mean(parallel.pcall(enek,kp)) # compute total eenrgy
@@ -7,7 +7,9 @@ from . import sculpt
 
 def non_orthogonal_supercell(gin,m,ncheck=2,mode="fill",reducef=lambda x: x):
   """Generate a non orthogonal supercell based on a tranformation
-  matrix of the unit vectors, pretty much as VESTA does"""
+  matrix of the unit vectors, pretty much as VESTA does. The cells
+  inside the new one come from the triangular form of the integer
+  matrix, ncheck and reducef are kept for compatibility"""
   # workaround
   g = gin.copy()
   if g.dimensionality==0: return
@@ -31,79 +33,79 @@ def non_orthogonal_supercell(gin,m,ncheck=2,mode="fill",reducef=lambda x: x):
     raise
   c = vnew/vold
   c = int(round(abs(c)))
-  # now create replicas until there as c times as many atoms in the
-  # unit cell
-  if mode=="fill": # look for atoms until everything is filled
-    rs = []
-    k2K = go.get_k2K().I # matrix transformation
-    R = np.matrix([go.a1,go.a2,go.a3]).T # transformation matrix
-    L = R.I # inverse matrix
-    d0 = -np.random.random()*0.1 # accuracy
-    d0 = -0.122132112 # some random number
-    d1 = 1.0 + d0 # accuracy
-    from .geometry import neighbor_cells
-# get as many cells as necessary
-    cneigh = reducef(c) # cells to generate given the volume increase c
-    cneigh = int(round(cneigh)) # integer
-    inds = neighbor_cells(cneigh,dim=g.dimensionality) 
-    sl = [] # list for the sublattice
-    for (i,j,k) in inds: # loop
-          ii = 0 # start count
-          for ir in range(len(g.r)): # loop over positions
-            ri = g.r[ir] # get the position
-            store = False
-            rj = ri + i*g.a1 + j*g.a2 + k*g.a3 # new position
-            rn = L*np.matrix(rj).T  # transform
-            rn = np.array([rn.T[0,ii] for ii in range(3)]) # convert to array
-            n1,n2,n3 = rn[0],rn[1],rn[2]
-            if g.dimensionality==3 and d0<n1<d1 and d0<n2<d1 and d0<n3<d1:
-                store = True
-            if g.dimensionality==2 and d0<n1<d1 and d0<n2<d1: 
-                store = True
-            if g.dimensionality==1 and d0<n1<d1: 
-                store = True
-            if store:
-                rs.append(rj)
-                if g.has_sublattice: sl.append(g.sublattice[ir])
-#          if len(rs)==len(g.r)*c:
-#            print("All the atoms found")
-#            break
-#    print(rs)
-    go.r = np.array(rs) # store
-    if go.has_sublattice: go.sublattice = sl # store sublattice
-    if len(rs)!=len(g.r)*c: 
-      print("Not all the atoms have been found")
-      print("New atoms",len(rs))
-      print("Expected atoms",len(g.r)*c)
-      print("Volume of the cell increase",c)
-      raise
-  elif mode=="brute":
-    if g.dimensionality==1:
-      rs3 = replicate3d(g.r,g.a1,g.a2,g.a3,c,1,1) # new positions
-    if g.dimensionality==2:
-      rs3 = replicate3d(g.r,g.a1,g.a2,g.a3,c,c,1) # new positions
-    if g.dimensionality==3:
-      rs3 = replicate3d(g.r,g.a1,g.a2,g.a3,c,c,c) # new positions
-    while True: # infinite loop, stop when scf reached
-      rs1 = np.array(rs3) # store the first iteration
-#      print(rs1)
-      for i in range(-ncheck,ncheck+1):
-        for j in range(-ncheck,ncheck+1):
-          for k in range(-ncheck,ncheck+1):
-            if i==0 and j==0 and k==0: continue
-            rs2 = [ri + i*go.a1 + j*go.a2 + k*go.a3 for ri in rs1] # shift by this vector
-            rs1 = return_unique(rs1,rs2) # return the unique positions
-#            print(len(rs1),i,j,k)
-      if len(rs1)==len(rs3): break
-      rs3 = np.array(rs1) 
-    go.r = np.array(rs1) # store new positions
-    if go.has_sublattice: go.get_sublattice()
+  # now create the replicas of the c cells inside the new one
+  if mode in ["fill","brute"]: # place the atoms using the integer lattice
+    dim = g.dimensionality # dimensionality
+    mi = np.array(np.round(np.array(m)),dtype=int)[0:dim,0:dim]
+    if np.max(np.abs(mi-np.array(m)[0:dim,0:dim]))>1e-6: raise # not integer
+    cells = lattice_translations(mi) # cells in the new unit cell
+    A = np.array([a1,a2,a3]) # old lattice vectors
+    rs,index = replicate_sites(g.r,cells,A) # all the positions
+    An = np.array([go.a1,go.a2,go.a3]) # new lattice vectors
+    rs = wrap_positions(rs,An,dim=dim) # inside the new unit cell
+    go.r = rs # store
+    copy_site_attributes(g,go,index) # sublattice and names
+    if len(rs)!=len(g.r)*c: raise # this should not happen
   go.r2xyz() # update coordinates
   go.center()
   go.get_fractional()
   return go # return new geometry
   
 
+def hermite_normal_form(m):
+  """Upper triangular form of an integer matrix, with positive diagonal,
+  whose rows generate the same lattice as the rows of m. Only unimodular
+  row operations are used"""
+  h = np.array(m,dtype=int).copy() # integer matrix
+  d = h.shape[0] # dimension
+  for c in range(d): # loop over columns
+    while True: # Euclid algorithm in this column
+      rows = [r for r in range(c,d) if h[r,c]!=0] # non vanishing
+      if len(rows)==0: raise # singular matrix
+      p = min(rows,key=lambda r: abs(h[r,c])) # smallest pivot
+      h[[c,p]] = h[[p,c]] # swap rows
+      for r in range(c+1,d): h[r] -= (h[r,c]//h[c,c])*h[c]
+      if np.all(h[c+1:,c]==0): break # column done
+    if h[c,c]<0: h[c] *= -1 # positive diagonal
+  return h
+
+
+def lattice_translations(m):
+  """Integer translations of the old lattice that are not equivalent
+  in the lattice generated by the rows of m, exactly one for each old
+  unit cell inside the new one. With the triangular form they are a
+  box given by the diagonal. Returns an array (ncells,3)"""
+  h = hermite_normal_form(m) # triangular form
+  ns = [range(h[i,i]) for i in range(len(h))] + [[0] for i in range(3-len(h))]
+  cells = np.array(np.meshgrid(*ns,indexing="ij")) # all the cells
+  return cells.reshape((3,-1)).T
+
+
+def replicate_sites(rs,cells,A):
+  """Positions of the sites in all the cells, with the lattice vectors
+  as rows of A, and the index of the original site of each of them"""
+  rs = np.array(rs) # positions
+  ts = np.array(cells).dot(A) # translation vectors
+  out = (ts[:,None,:] + rs[None,:,:]).reshape((-1,3)) # all the positions
+  index = np.tile(np.arange(len(rs)),len(ts)) # original site
+  return out,index
+
+
+def wrap_positions(rs,A,dim=3,d0=-0.122132112):
+  """Bring the positions inside the unit cell with lattice vectors the
+  rows of A, so that the fractional coordinates are in [d0,1+d0)"""
+  f = np.array(rs).dot(np.linalg.inv(A)) # fractional coordinates
+  n = np.floor(f[:,0:dim] - d0) # cells to shift
+  return rs - n.dot(A[0:dim]) # shift
+
+
+def copy_site_attributes(g,go,index):
+  """Copy the attributes of the sites, for new sites coming from
+  the sites index of the old geometry"""
+  if g.has_sublattice: go.sublattice = np.array(g.sublattice)[index]
+  if g.atoms_have_names: go.atoms_names = [g.atoms_names[i] for i in index]
+
+
 # from numba import jit
 
 
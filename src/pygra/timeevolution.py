@@ -14,6 +14,7 @@ def evolve_local_state(h,i=0,ts=np.linspace(0.,20.,300),
     # get the function that does time evolution
     if mode=="green": evol = evolve_green(h,i=i)
     elif mode=="chi": evol = evolve_chi(h,i=i,ts=ts)
+    elif mode=="kpm": evol = evolve_kpm(h,i=i,ts=ts)
     g = h.geometry
     os.system("rm -rf MULTITIMEEVOLUTION") # remove folder
     os.system("mkdir MULTITIMEEVOLUTION") # create folder
@@ -65,3 +66,26 @@ def evolve_chi(h,i=0,ts=[0]):
         out = np.array([c@np.exp(1j*es*t) for c in cs])
         return np.abs(out)
     return evol
+
+
+
+
+def evolve_state(h,v0,ts=[0.],**kwargs):
+    """Evolve one or several states (columns of v0) with
+    exp(-iHt), using the Chebychev expansion of the propagator.
+    Only the sparse Hamiltonian is used, so memory scales as O(N)"""
+    if h.dimensionality!=0: raise # only for 0d
+    from .kpm import evolve
+    return evolve(h.intra,v0,ts,**kwargs) # (nt,n) or (nt,n,nv)
+
+
+
+def evolve_kpm(h,i=0,ts=[0.]):
+    """Return the evolution of a state localized in a site,
+    all the times are computed in a single Chebychev recursion"""
+    v0 = np.zeros(h.intra.shape[0],dtype=complex) # zero dimensional
+    v0[i] = 1.0
+    ws = evolve_state(h,v0,ts=ts) # wavefunctions at all times
+    ds = dict([(t,np.abs(w)**2) for (t,w) in zip(ts,ws)]) # densities
+    def evol(t): return ds[t]
+    return evol
@@ -114,6 +114,94 @@ def berry_curvature(h,k,dk=0.01,window=None,max_waves=None):
   return phi
 
 
+def occupied_subspaces(h,ks,window=None,max_waves=None,operator=None):
+  """Occupied states of a set of kpoints, each kpoint is diagonalized
+  once. Returns an array (nk,n,nocc) if all the kpoints have the same
+  number of states, and a list of (n,nocc) arrays otherwise"""
+  ks = np.array(ks) # kpoints
+  if max_waves is None: # batched diagonalization of all the kpoints
+    es,vs = multicell.eigh_batch(h,ks)
+  else: # sparse diagonalization of each kpoint
+    hkgen = h.get_hk_gen() # Hamiltonian generator
+    def diag(k):
+      e,v = slg.eigsh(csc_matrix(hkgen(k)),k=max_waves,which="SA",
+                      sigma=0.0,tol=arpack_tol,maxiter=arpack_maxiter)
+      return e,v
+    out = [diag(k) for k in ks] # diagonalize
+    es = [o[0] for o in out] ; vs = [o[1] for o in out]
+  if operator is not None: # projector on an operator
+    if type(operator)==str: # matrix operator, as a function
+      operator = h.get_operator(operator,return_matrix=True)
+    if callable(operator): op = operator # function, O@m
+    else: # matrix
+      om = np.array(algebra.todense(operator)) # dense matrix
+      op = lambda m,k=None: om@m
+  wfs = [] # occupied states
+  for (k,e,v) in zip(ks,es,vs): # loop over kpoints
+    if window is None: w = v[:,e<0.] # below the Fermi energy
+    else: w = v[:,(-abs(window)<e)*(e<0.)] # inside the energy window
+    if operator is not None: # keep the positive sector of the operator
+      eo,vo = np.linalg.eigh(np.conjugate(w.T)@op(w,k=k)) # projected
+      w = w@vo[:,eo>0.] # new states
+    wfs.append(w) # store
+  if len(set([w.shape[1] for w in wfs]))==1: return np.array(wfs)
+  else: return wfs
+
+
+def lattice_fluxes(wfs,shape,periodic=True):
+  """Berry fluxes through the plaquettes of a grid of kpoints, using
+  the lattice gauge links of the occupied subspaces wfs of each node
+  (ordered as the flattened grid of the given shape)"""
+  n1,n2 = shape
+  if type(wfs)==np.ndarray: # all the nodes have the same dimension
+    w = wfs.reshape((n1,n2)+wfs.shape[1:]) # as a grid
+    def link(w1,w2): # normalized link variables, same convention as uij
+      d = np.linalg.det(np.transpose(w1,(0,1,3,2))@np.conjugate(w2))
+      return d/(np.abs(d)+1e-300) # phase of the determinant
+    if periodic: # the grid closes on itself
+      ux = link(w,np.roll(w,-1,axis=0)) # links along the first direction
+      uy = link(w,np.roll(w,-1,axis=1)) # links along the second direction
+      p = ux*np.roll(uy,-1,axis=0)*np.conjugate(np.roll(ux,-1,axis=1)*uy)
+    else: # open grid
+      ux = link(w[:-1,:],w[1:,:]) # links along the first direction
+      uy = link(w[:,:-1],w[:,1:]) # links along the second direction
+      p = ux[:,:-1]*uy[1:,:]*np.conjugate(ux[:,1:]*uy[:-1,:])
+    return np.angle(p) # fluxes
+  else: # different number of states, loop over plaquettes
+    w = [[wfs[i*n2+j] for j in range(n2)] for i in range(n1)]
+    if periodic: m1,m2 = n1,n2
+    else: m1,m2 = n1-1,n2-1
+    out = np.zeros((m1,m2)) # fluxes
+    for i in range(m1):
+      for j in range(m2):
+        ws = [w[i][j],w[(i+1)%n1][j],w[(i+1)%n1][(j+1)%n2],w[i][(j+1)%n2]]
+        if len(set([x.shape[1] for x in ws]))!=1: continue # skip
+        m = np.identity(ws[0].shape[1],dtype=complex)
+        for (a,b) in zip(ws,ws[1:]+ws[:1]): m = m@(a.T@np.conjugate(b))
+        out[i,j] = np.angle(np.linalg.det(m)) # flux
+    return out
+
+
+def fhs_berry_curvature(h,nk=20,window=None,max_waves=None,operator=None):
+  """Berry curvature in a mesh of the Brillouin zone, using the
+  Fukui-Hatsugai-Suzuki lattice method. Returns the centers of the
+  plaquettes and the curvature, normalized as berry_curvature"""
+  if h.dimensionality != 2: raise # only for 2d
+  ks = np.array([[x,y,0.] for x in np.linspace(0.,1.,nk,endpoint=False)
+                   for y in np.linspace(0.,1.,nk,endpoint=False)])
+  wfs = occupied_subspaces(h,ks,window=window,max_waves=max_waves,
+                             operator=operator) # occupied states
+  fs = lattice_fluxes(wfs,(nk,nk),periodic=True) # fluxes
+  kc = ks + np.array([.5,.5,0.])/nk # centers of the plaquettes
+  return kc,fs.reshape(-1)*nk*nk # Berry curvature
+
+
+def fhs_chern(h,nk=20,**kwargs):
+  """Chern number with the Fukui-Hatsugai-Suzuki method"""
+  kc,bs = fhs_berry_curvature(h,nk=nk,**kwargs)
+  return np.sum(bs)/(2.*np.pi*nk*nk)
+
+
 def occ_states_generator(h,k,window=None,max_waves=None):
   """Return a function that generates the occupied wavefunctions"""
   hk_gen = h.get_hk_gen() # get hamiltonian generator
@@ -180,16 +268,10 @@ def precise_chern(h,dk=0.01, mode="Wilson",delta=0.0001,operator=None):
   return chern
 
 
-def hall_conductivity(h,dk=-1,n=1000):
-  c = 0.0 
-  nk = int(np.sqrt(n)) # estimate
-  if dk<0: dk = 1./float(2*nk) # automatic dk
-  for i in range(n):
-    k = np.random.random(2) # random kpoint
-    c += berry_curvature(h,k,dk=dk)
-  c = c/(2*np.pi*n) # normalize
-  return c
-
+def hall_conductivity(h,nk=10,**kwargs):
+  """Hall conductivity in units of e^2/h, integrating the Berry
+  curvature in a mesh of nk x nk kpoints with mesh_chern"""
+  return mesh_chern(h,nk=nk,**kwargs)
 
 
 
@@ -215,7 +297,9 @@ def mesh_chern(h,dk=-1,nk=10,delta=0.0001,mode="Wilson",operator=None):
       ks.append([x,y]) # create kpoints
 #  tr = timing.Testimator("CHERN NUMBER")
   ik = 0
-  bs = parallel.pcall(fberry,ks) # compute all the Berry curvatures
+  if mode=="Wilson": # lattice method, one diagonalization per kpoint
+    ks,bs = fhs_berry_curvature(h,nk=nk) # plaquettes and curvatures
+  else: bs = parallel.pcall(fberry,ks) # compute all the Berry curvatures
 #  for k in ks: # loop
 #    tr.remaining(ik,len(ks))
 #    ik += 1 # increase
@@ -237,9 +321,15 @@ def mesh_chern(h,dk=-1,nk=10,delta=0.0001,mode="Wilson",operator=None):
 
 
 def berry_map(h,dk=-1,nk=40,reciprocal=True,nsuper=1,window=None,
-               max_waves=None,mode="Wilson",delta=0.001,operator=None):
+               max_waves=None,mode="Wilson",delta=0.001,operator=None,
+               adaptive=False,levels=3):
   """ Calculates the chern number of a 2d system """
   if operator is not None: mode="Green" # Green function mode
+  if adaptive: # refine the kmesh where the Berry curvature is large
+    if mode!="Wilson": raise ValueError("adaptive berry_map only "+
+                                         "implemented for mode=Wilson")
+    return berry_map_adaptive(h,nk=nk,levels=levels,reciprocal=reciprocal,
+              nsuper=nsuper,window=window,max_waves=max_waves,dk=dk)
   c = 0.0
   ks = [] # array for kpoints
   if dk<0: dk = 5./float(2*nk) # automatic dk
@@ -253,6 +343,19 @@ def berry_map(h,dk=-1,nk=40,reciprocal=True,nsuper=1,window=None,
   for x in np.linspace(-nsuper,nsuper,nk,endpoint=False):
     for y in np.linspace(-nsuper,nsuper,nk,endpoint=False):
         ks.append([x,y,0.])
+  if mode=="Wilson": # lattice method, plaquettes centered in the kpoints
+    dx = 2.*nsuper/nk # step of the grid
+    xs = -nsuper - dx/2. + dx*np.arange(nk+1) # corners of the plaquettes
+    kg = np.array([[x,y,0.] for x in xs for y in xs]) # grid of corners
+    kg = np.array(R@kg.T).T # change of basis
+    wfs = occupied_subspaces(h,kg,window=window,max_waves=max_waves)
+    fs = lattice_fluxes(wfs,(nk+1,nk+1),periodic=False) # fluxes
+    area = abs(np.linalg.det(np.array(R)[0:2,0:2]))*dx*dx # plaquette area
+    bs = fs.reshape(-1)/area # Berry curvature
+    for (b,k) in zip(bs,ks): # write everything
+      fo.write(str(k[0])+"   "+str(k[1])+"     "+str(b)+"\n")
+    fo.close() # close file
+    return
   tr = timing.Testimator("BERRY CURVATURE",maxite=len(ks))
   def fp(ki): # function to compute the Berry curvature
       if parallel.cores == 1: tr.iterate()
@@ -273,6 +376,32 @@ def berry_map(h,dk=-1,nk=40,reciprocal=True,nsuper=1,window=None,
 
 
 
+def berry_map_adaptive(h,nk=40,levels=3,reciprocal=True,nsuper=1,
+                         window=None,max_waves=None,dk=-1,nkmap=None):
+  """Berry curvature map sampled in an adaptive kmesh, refined
+  where the Berry curvature is large. Writes the scattered data in
+  BERRY_MAP_ADAPTIVE.OUT and an interpolated map in BERRY_MAP.OUT"""
+  from .klist import adaptive_kmesh,interpolate_kmap
+  from . import parallel
+  nk0 = max([1,nk//2**levels]) # initial grid
+  if dk<0: dk = 5./float(2*nk0*2**levels) # automatic dk
+  if reciprocal: R = np.array(h.geometry.get_k2K())
+  else: R = np.identity(3)
+  def f(rs): # Berry curvature in a set of kpoints
+    ks = np.concatenate([rs,np.zeros((len(rs),1))],axis=1)@R.T
+    fb = lambda k: berry_curvature(h,k,dk=dk,window=window,
+                                     max_waves=max_waves)
+    return np.array(parallel.pcall(fb,ks))
+  bounds = [[-nsuper,nsuper],[-nsuper,nsuper]] # box
+  rs,bs = adaptive_kmesh(f,bounds=bounds,nk=nk0,levels=levels)
+  np.savetxt("BERRY_MAP_ADAPTIVE.OUT",np.array([rs[:,0],rs[:,1],bs]).T)
+  if nkmap is None: nkmap = nk0*2**levels # size of the map
+  xs,ys,zs = interpolate_kmap(rs,bs,nk=nkmap,bounds=bounds)
+  np.savetxt("BERRY_MAP.OUT",np.array([xs,ys,zs]).T) # uniform map
+  return rs,bs
+
+
+
 
 
 def smooth_gauge(w1,w2):
@@ -291,36 +420,43 @@ def smooth_gauge(w1,w2):
 
 
 
-def z2_vanderbilt(h,nk=30,nt=100,nocc=None,full=False):
-  """ Calculate Z2 invariant according to Vanderbilt algorithm"""
-  out = [] # output list
+def wilson_loops(h,nk=30,nt=100,nocc=None,full=False):
+  """Spectrum of the Wilson loops along the first reciprocal direction,
+  for a set of values t of the second one. Returns the values of t and
+  the Wannier centers (phases) as an array (nt,nocc)"""
   path = np.linspace(0.,1.,nk) # set of kpoints
-  fo = open("WANNIER_CENTERS.OUT","w")
   if full:  ts = np.linspace(0.,1.0,nt,endpoint=False)
   else:  ts = np.linspace(0.,0.5,nt,endpoint=False)
-  wfall = [[occ_states2d(h,np.array([k,t,0.,])) for k in path] for t in ts] 
-  # select a continuos gauge for the first wave
-  for it in range(len(ts)-1): # loop over ts
-    wfall[it+1][0] = smooth_gauge(wfall[it][0],wfall[it+1][0]) 
-  for it in range(len(ts)): # loop over t points
-    row = [] # empty list for this row
-    t = ts[it] # select the t point
-    wfs = wfall[it] # get set of waves 
-    for i in range(len(wfs)-1):
-      wfs[i+1] = smooth_gauge(wfs[i],wfs[i+1]) # transform into a smooth gauge
-#      m = uij(wfs[i],wfs[i+1]) # matrix of wavefunctions
-    m = uij(wfs[0],wfs[len(wfs)-1]) # matrix of wavefunctions
-    evals = lg.eigvals(m) # eigenvalues of the rotation 
-    x = np.angle(evals) # phase of the eigenvalues
-    fo.write(str(t)+"    ") # write pumping variable
-    row.append(t) # store
-    for ix in x: # loop over phases
-      fo.write(str(ix)+"  ")
-      row.append(ix) # store
-    fo.write("\n")
-    out.append(row) # store
-  fo.close()
-  return np.array(out).transpose() # transpose the map
+  n = h.intra.shape[0] # dimension of the Hamiltonian
+  nct = algebra.batch_size(nk*n*n) # values of t per chunk
+  xs = [] # Wannier centers
+  for it in range(0,len(ts),nct): # loop over chunks of t
+    tc = ts[it:it+nct] # values of t in this chunk
+    ks = np.array([[k,t,0.] for t in tc for k in path]) # kpoints
+    es,vs = parallel.eigh_batch(h,ks) # diagonalize all of them
+    if nocc is None: # occupied states below the Fermi energy
+      no = np.sum(es<0.,axis=1) # occupied states
+      if np.max(no)!=np.min(no): raise # the system is not gapped
+      nocc = no[0]
+    ws = vs[:,:,0:nocc].reshape((len(tc),nk,n,nocc)) # occupied states
+    # link matrices between consecutive kpoints, the last one closes
+    # the loop (the end of the path is equivalent to the origin)
+    ms = np.conjugate(np.transpose(ws,(0,1,3,2)))@np.roll(ws,-1,axis=1)
+    u,s,v = np.linalg.svd(ms) # unitary part of the links
+    ms = u@v # parallel transport
+    wl = ms[:,0] # initialize the Wilson loops
+    for i in range(1,nk): wl = wl@ms[:,i] # chain of links
+    xs.append(np.angle(np.linalg.eigvals(wl))) # phases of the eigenvalues
+  xs = np.concatenate(xs) # all the values of t
+  return ts,xs
+
+
+def z2_vanderbilt(h,nk=30,nt=100,nocc=None,full=False,write=True):
+  """ Calculate Z2 invariant according to Vanderbilt algorithm"""
+  ts,xs = wilson_loops(h,nk=nk,nt=nt,nocc=nocc,full=full) # Wannier centers
+  out = np.concatenate([np.array([ts]).T,xs],axis=1) # t and the centers
+  if write: np.savetxt("WANNIER_CENTERS.OUT",out) # write in a file
+  return out.transpose() # transpose the map
 
 
 def z2_invariant(h,nk=20,nt=20,nocc=None):
@@ -684,15 +820,6 @@ def chern_density(h,nk=10,operator=None,delta=0.02,dk=0.02,
 
 
 
-
-
-
-
-hall_conductivity = chern
-
-
-
-
 def get_operator(h,op):
     """ Wrapper for operators """
     if op is None: return None
@@ -190,32 +190,97 @@ def read_between(a,b,input_file):
 
 
 
+def read_hoppings(input_file="hr_truncated.dat",is_real=False,cutoff=0.0,
+                    sparse=False,nchunk=1000000):
+  """Reads the hoppings of a wannier90 hr.dat or tb.dat file, or of a
+  truncated hr file without header, in a single pass. The rows are grouped
+  by lattice vector with array operations, divided by the degeneracy of
+  the lattice vector, and hoppings smaller than cutoff are dropped.
+  Returns a dictionary with a matrix for each lattice vector"""
+  from itertools import islice
+  from scipy.sparse import csr_matrix
+  f = open(input_file,"r") # open the file
+  first = f.readline() # first line
+  while first.lstrip().startswith("#") or first.strip()=="": # comments
+    if first=="": raise ValueError("No hoppings in "+input_file)
+    first = f.readline()
+  ndeg = None # degeneracies of the lattice vectors
+  is_tb = False # tb.dat format
+  try: # truncated file, no header
+    np.array(first.split(),dtype=float)
+    pending = [first]
+  except ValueError: # file with header
+    pending = []
+    l1 = f.readline().split()
+    if len(l1)==3: # tb.dat, with the lattice vectors
+      f.readline() ; f.readline() # the other two vectors
+      l1 = f.readline().split() ; is_tb = True
+    if len(l1)!=1 or not l1[0].isdigit(): # not the number of orbitals
+      raise ValueError("Unknown format of "+input_file)
+    nw = int(l1[0]) # number of wannier orbitals
+    nr = int(f.readline().split()[0]) # number of lattice vectors
+    ndeg = [] # degeneracies
+    while len(ndeg)<nr: ndeg += [int(x) for x in f.readline().split()]
+    ndeg = np.array(ndeg,dtype=float)
+  store = dict() # pieces of the matrix of each lattice vector
+  def add(rs,ii,jj,ts): # store a piece of data
+    if cutoff>0.0: # drop small hoppings
+      ic = np.abs(ts)>cutoff
+      rs,ii,jj,ts = rs[ic],ii[ic],jj[ic],ts[ic]
+    if len(ts)==0: return
+    cut = np.flatnonzero(np.any(rs[1:]!=rs[:-1],axis=1)) + 1 # new vectors
+    i0s = np.concatenate([[0],cut]) ; i1s = np.concatenate([cut,[len(rs)]])
+    for (i0,i1) in zip(i0s,i1s): # loop over rows with the same vector
+      key = tuple(rs[i0])
+      if key not in store: store[key] = []
+      store[key].append((ii[i0:i1],jj[i0:i1],ts[i0:i1]))
+  if is_tb: # blocks with a lattice vector and its matrix
+    for ir in range(nr):
+      l = f.readline().split()
+      while len(l)==0: l = f.readline().split() # skip blank lines
+      r = np.array(l,dtype=int) # lattice vector
+      lines = list(islice(f,nw*nw)) # all the elements
+      d = np.fromstring(" ".join(lines),dtype=float,sep=" ").reshape((-1,4))
+      ts = d[:,2] + (0. if is_real else 1j*d[:,3])
+      rs = np.zeros((len(d),3),dtype=int) + r
+      add(rs,d[:,0].astype(int)-1,d[:,1].astype(int)-1,ts/ndeg[ir])
+  else: # rows with lattice vector, orbitals and hopping
+    irow = 0 # index of the row
+    while True:
+      lines = pending + list(islice(f,nchunk)) ; pending = []
+      if len(lines)==0: break
+      d = np.fromstring(" ".join(lines),dtype=float,sep=" ") # fast parser
+      ncol = len(lines[0].split()) # number of columns
+      d = d.reshape((-1,ncol))
+      ts = d[:,5] + (0. if (is_real or ncol<7) else 1j*d[:,6]) # hoppings
+      if ndeg is not None: # divide by the degeneracy
+        ts = ts/ndeg[(irow + np.arange(len(d)))//(nw*nw)]
+      irow += len(d) # update the counter
+      add(d[:,0:3].astype(int),d[:,3].astype(int)-1,d[:,4].astype(int)-1,ts)
+  f.close()
+  if len(store)==0: raise # nothing read
+  norb = max([max(np.max(p[0]),np.max(p[1])) for key in store 
+                 for p in store[key]]) + 1 # number of orbitals
+  if ndeg is not None: norb = nw
+  out = dict() # output dictionary
+  for key in store:
+    ii = np.concatenate([p[0] for p in store[key]])
+    jj = np.concatenate([p[1] for p in store[key]])
+    ts = np.concatenate([p[2] for p in store[key]])
+    m = csr_matrix((ts,(ii,jj)),shape=(norb,norb),dtype=complex)
+    if not sparse: m = np.matrix(m.todense()) # dense matrix
+    out[key] = m # store
+  return out
+
+
+
 def read_hamiltonian(input_file="hr_truncated.dat",is_real=False):
   """Reads an output hamiltonian from wannier"""
-  mt = np.genfromtxt(input_file) # get file
-  m = mt.transpose() # transpose matrix
-  # read the hamiltonian matrices
-  class Hopping: pass # create empty class
-  tlist = []
+  ts = read_hoppings(input_file,is_real=is_real) # read all the hoppings
+  norb = ts[list(ts.keys())[0]].shape[0] # number of orbitals
   def get_t(i,j,k):
-    norb = np.max([np.max(np.abs(m[3])),np.max(np.abs(m[4]))])
-    norb = int(norb)
-    mo = np.matrix(np.zeros((norb,norb),dtype=np.complex))  
-    for l in mt: # look into the file
-      if i==int(l[0]) and j==int(l[1]) and k==int(l[2]):
-        if is_real:
-          mo[int(l[3])-1,int(l[4])-1] = l[5] # store element
-        else:
-          mo[int(l[3])-1,int(l[4])-1] = l[5] + 1j*l[6] # store element
-    return mo # return the matrix
-#  for i in range(-nmax,nmax):
-#    for j in range(-nmax,nmax):
-#      for k in range(-nmax,nmax):
-#        t = Hopping() # create hopping
-#        t.dir = [i,j,k] # direction
-#        t.m = get_t(i,j,k) # read the matrix
-#        tlist.append(t) # store hopping
-  # the previous is not used yet...
+    if (i,j,k) in ts: return ts[(i,j,k)] # return the matrix
+    else: return np.matrix(np.zeros((norb,norb),dtype=complex))
   g = geometry.kagome_lattice() # create geometry
   h = g.get_hamiltonian() # build hamiltonian
   h.intra = get_t(0,0,0)
@@ -235,42 +300,22 @@ def read_hamiltonian(input_file="hr_truncated.dat",is_real=False):
 
 def read_multicell_hamiltonian(input_file="hr_truncated.dat",
                                 ncells=None,win_file="wannier.win",
-                                dim=2,skip_win=False,path=None):
+                                dim=2,skip_win=False,path=None,
+                                cutoff=0.0,sparse=False):
   """Reads an output hamiltonian from wannier"""
   if path is not None: 
       inipath = os.getcwd() # current path
       os.chdir(path) # go there
-  mt = np.genfromtxt(input_file) # get file
-  m = mt.transpose() # transpose matrix
+  ts = read_hoppings(input_file,cutoff=cutoff,sparse=sparse) # all hoppings
   if ncells is None: # use all the hoppings
-    nmax = int(np.max([np.max(m[i])for i in range(3)]))
+    nmax = int(np.max(np.array(list(ts.keys()))))
     ncells = [nmax,nmax,nmax]
-  # read the hamiltonian matrices
-  class Hopping: pass # create empty class
   tlist = []
-  def get_t(i,j,k):
-    norb = np.max([np.max(np.abs(m[3])),np.max(np.abs(m[4]))])
-    norb = int(norb)
-    mo = np.matrix(np.zeros((norb,norb),dtype=np.complex))  
-    found = False
-    for l in mt: # look into the file
-      if i==int(l[0]) and j==int(l[1]) and k==int(l[2]):
-        mo[int(l[3])-1,int(l[4])-1] = l[5] + 1j*l[6] # store element
-        found  = True # matrix has been found
-    if found:  return mo # return the matrix
-    else: return None # return nothing if not found
-  for i in range(-ncells[0],ncells[0]+1):
-    for j in range(-ncells[1],ncells[1]+1):
-      for k in range(-ncells[2],ncells[2]+1):
-        if (i,j,k)==(0,0,0): continue # skip intracell
-        matrix = get_t(i,j,k) # read the matrix
-        if matrix is None: continue
-        else: # store hopping
-          t = Hopping() # create hopping
-          t.dir = [i,j,k] # direction
-          t.m = get_t(i,j,k) # read the matrix
-          tlist.append(t) # store hopping
-  # the previous is not used yet...
+  for key in sorted(ts.keys()): # loop over lattice vectors
+    if key==(0,0,0): continue # skip intracell
+    if any([abs(key[i])>ncells[i] for i in range(3)]): continue
+    tlist.append(multicell.Hopping(d=list(key),m=ts[key])) # store hopping
+  norb = ts[list(ts.keys())[0]].shape[0] # number of orbitals
   g = geometry.kagome_lattice() # create geometry
   h = g.get_hamiltonian() # build hamiltonian
   h.is_multicell = True
@@ -281,10 +326,12 @@ def read_multicell_hamiltonian(input_file="hr_truncated.dat",
   if not skip_win: # do not skip readin wannier.win
     h.geometry = read_geometry(input_file=win_file) # read the geometry of the system
     h.geometry.center() # center the geometry
-  h.intra = get_t(0,0,0)
+  if (0,0,0) in ts: h.intra = ts[(0,0,0)]
+  elif sparse: h.intra = coo_matrix((norb,norb),dtype=complex).tocsr()
+  else: h.intra = np.matrix(np.zeros((norb,norb),dtype=complex))
   if not skip_win: # do not skip reading wannier.win
-    if len(h.geometry.r)!=len(h.intra): 
-      print("Dimensions do not match",len(g.r),len(h.intra))
+    if len(h.geometry.r)!=h.intra.shape[0]: 
+      print("Dimensions do not match",len(g.r),h.intra.shape[0])
       print(h.geometry.r)
   #  raise # error if dimensions dont match
   h.dimensionality = dim 
@@ -303,9 +350,6 @@ def read_multicell_hamiltonian(input_file="hr_truncated.dat",
 
 
 
-
-
-
 def get_klist(input_file="wannier.win",nkpoints=500):
   """ Get the klist for bands calculation"""
   ll = read_between("begin kpoint_path","end kpoint_path",input_file)
@@ -588,21 +632,11 @@ def get_atomic_projection(specie,input_file="wannier.win",has_spin=False):
 
 def read_supercell_hamiltonian(input_file="hr_truncated.dat",is_real=False,nsuper=1):
   """Reads an output hamiltonian for a supercell from wannier"""
-  mt = np.genfromtxt(input_file) # get file
-  m = mt.transpose() # transpose matrix
-  # read the hamiltonian matrices
-  class Hopping: pass # create empty class
-  tlist = []
+  ts = read_hoppings(input_file,is_real=is_real) # read all the hoppings
+  norb = ts[list(ts.keys())[0]].shape[0] # number of orbitals
   def get_t(i,j,k):
-    norb = int(np.max([np.max(np.abs(m[3])),np.max(np.abs(m[4]))]))
-    mo = np.matrix(np.zeros((norb,norb),dtype=np.complex))  
-    for l in mt: # look into the file
-      if i==int(l[0]) and j==int(l[1]) and k==int(l[2]):
-        if is_real:
-          mo[int(l[3])-1,int(l[4])-1] = l[5] # store element
-        else:
-          mo[int(l[3])-1,int(l[4])-1] = l[5] + 1j*l[6] # store element
-    return mo # return the matrix
+    if (i,j,k) in ts: return ts[(i,j,k)] # return the matrix
+    else: return np.matrix(np.zeros((norb,norb),dtype=complex))
   # this function will be called in a loop
   g = geometry.kagome_lattice() # create geometry
   h = g.get_hamiltonian() # build hamiltonian
@@ -0,0 +1,61 @@
+import unittest
+import numpy as np
+import sys
+import os
+import shutil
+import tempfile
+sys.path.append("../../src/") # add the library
+from pygra import geometry
+from pygra.selfconsistency import densitydensity
+from pygra.selfconsistency import checkpoint
+
+error = 1e-5 # acceptable accuracy
+
+def geth(b):
+    g = geometry.honeycomb_lattice()
+    h = g.get_hamiltonian()
+    h.add_zeeman([0.,0.,b])
+    return h
+
+def scf(h,**kwargs):
+    return densitydensity.hubbard(h,U=2.0,nk=4,load_mf=False,verbose=False,
+                                    maxerror=1e-8,**kwargs)
+
+class Test(unittest.TestCase):
+    def test_1(self):
+        """Different Zeeman fields are stored in different checkpoints,
+        and a run restarts from its own one"""
+        folder = tempfile.mkdtemp()
+        try:
+          store = checkpoint.CheckpointStore(folder=folder)
+          h1,h2 = geth(0.1),geth(0.3)
+          self.assertTrue(store.path(h1,{})!=store.path(h2,{}))
+          self.assertTrue(checkpoint.fingerprint(h1)==
+                            checkpoint.fingerprint(h2))
+          s1 = scf(h1,checkpoint=store)
+          s2 = scf(h2,checkpoint=store) # warm start from the first one
+          self.assertTrue(len(os.listdir(folder))==2)
+          s3 = scf(h1,checkpoint=store) # restart from its own checkpoint
+          s4 = scf(h2) # no checkpoint
+          diff = abs(s1.total_energy-s3.total_energy)
+          diff += abs(s2.total_energy-s4.total_energy)
+          print("Error = ",diff)
+          self.assertTrue(diff<error)
+          self.assertTrue(len(s3.telemetry)<len(s1.telemetry))
+        finally: shutil.rmtree(folder)
+    def test_2(self):
+        """Different interactions are stored in different checkpoints"""
+        store = checkpoint.CheckpointStore(folder="")
+        h = geth(0.1)
+        n = h.intra.shape[0]
+        v1 = {(0,0,0):np.identity(n)} # two interactions
+        v2 = {(0,0,0):2*np.identity(n)}
+        p1,p2 = store.path(h,{},v=v1),store.path(h,{},v=v2)
+        self.assertTrue(p1!=p2)
+        self.assertTrue(p1==store.path(h,{},v={(0,0,0):np.identity(n)}))
+        p = {"U":1.0,"vfun":None} # parameters with no numeric value
+        d = checkpoint.params_distance(p,dict(p,U=1.1))
+        self.assertTrue(0.<d<1.)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,39 @@
+import unittest
+import numpy as np
+import sys
+sys.path.append("../../src/") # add the library
+from pygra import geometry
+from pygra import chi
+from pygra import algebra
+
+error = 1e-10 # acceptable accuracy
+
+def elementchi(e,v,i,j,es,delta):
+    """Response function with the loop over pairs of states"""
+    out = 0j*es
+    for a in range(len(e)):
+      for b in range(len(e)):
+        fa,fb = float(e[a]<0.),float(e[b]<0.) # occupations
+        w = np.conjugate(v[i,a])*v[i,b]*np.conjugate(v[j,b])*v[j,a]
+        out = out + (fb-fa)*w/(e[a]-e[b]-es+1j*delta)
+    return out
+
+class Test(unittest.TestCase):
+    def test_1(self):
+        g = geometry.chain()
+        g = g.supercell(8)
+        g.dimensionality = 0
+        h = g.get_hamiltonian(has_spin=False)
+        h.add_onsite(lambda r: 0.3*np.sin(1.3*r[0]))
+        m = h.get_hk_gen()([0.,0.,0.])
+        e,v = np.linalg.eigh(np.array(algebra.todense(m)))
+        es = np.linspace(-2.,2.,30)
+        cs = chi.chargechi_row(h,i=2,es=es,delta=0.05)
+        diff = max([np.max(np.abs(cs[j]-elementchi(e,v,2,j,es,0.05)))
+                     for j in range(len(e))])
+        print("Error = ",diff)
+        passed = diff<error
+        self.assertTrue(passed)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,23 @@
+import unittest
+import numpy as np
+import sys
+sys.path.append("../../src/") # add the library
+from pygra import geometry
+from pygra import coulomb
+
+error = 1e-7 # acceptable accuracy
+
+class Test(unittest.TestCase):
+    def test_1(self):
+        """The Ewald sum does not depend on the splitting parameter"""
+        for g in [geometry.honeycomb_lattice(),geometry.cubic_lattice()]:
+          g = g.supercell(2)
+          g.r[0] = g.r[0] + np.array([0.1,0.2,0.3]) # break the symmetry
+          g.r2xyz() ; g.get_fractional()
+          vs = [coulomb.ewald_matrix(g,eta=eta) for eta in [0.6,1.0,1.5]]
+          diff = max([np.max(np.abs(v-vs[0])) for v in vs])
+          print("Error = ",diff)
+          self.assertTrue(diff<error)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,37 @@
+import unittest
+import numpy as np
+import sys
+sys.path.append("../../src/") # add the library
+from pygra import geometry
+from pygra import spectrum
+from pygra import topology
+
+error = 1e-7 # acceptable accuracy
+
+class Test(unittest.TestCase):
+    def test_1(self):
+        """Adaptive Fermi surface against the uniform kmesh"""
+        g = geometry.triangular_lattice()
+        h = g.get_hamiltonian()
+        h.add_onsite(-1.)
+        nk,levels,delta = 32,2,0.05 # finest grid and broadening
+        spectrum.fermi_surface(h,nk=nk+1,delta=delta,info=False,
+                                 output_file="FERMI_MAP.OUT")
+        m = np.genfromtxt("FERMI_MAP.OUT") # uniform kmesh
+        d0 = dict([((round(x,8),round(y,8)),z) for (x,y,z) in m])
+        xs,ys,ds = spectrum.fermi_surface(h,nk=nk,levels=levels,
+                      delta=delta,mode="adaptive",write=False)
+        diff = max([abs(d0[(round(x,8),round(y,8))]-d) 
+                      for (x,y,d) in zip(xs,ys,ds)])
+        diff += abs(np.max(ds)-np.max(m[:,2])) # the maximum is sampled
+        print("Error = ",diff,len(ds),len(m))
+        self.assertTrue(diff<error)
+        self.assertTrue(len(ds)<len(m))
+    def test_2(self):
+        """Adaptive Berry maps only with the lattice method"""
+        h = geometry.honeycomb_lattice().get_hamiltonian()
+        self.assertRaises(ValueError,topology.berry_map,h,adaptive=True,
+                            mode="Green")
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,55 @@
+import unittest
+import numpy as np
+import sys
+sys.path.append("../../src/") # add the library
+from pygra import keldysh
+
+error = 1e-10 # acceptable accuracy
+
+n = 6 # dimension of the central part
+omega = 0.4 # frequency
+delta = 0.01 # analytic continuation
+
+def selfenergy(i):
+    """Wide band selfenergy in a single site"""
+    def f(e):
+      m = np.zeros((n,n),dtype=complex)
+      m[i,i] = -0.5j + 0.1*e
+      return np.matrix(m)
+    return f
+
+def dense_current(e,ham,trl,tauz,self_l,self_r,nh):
+    """Current density inverting the full Floquet matrix"""
+    fh = keldysh.floquet_hamiltonian(ham,trl,omega,n=nh)
+    iden = np.matrix(np.identity(fh.shape[0],dtype=complex))
+    ftauz = keldysh.floquet_tauz(tauz,n=nh)
+    sl = keldysh.floquet_selfenergy(self_l,e,omega,n=nh)
+    sr = keldysh.floquet_selfenergy(self_r,e,omega,n=nh)
+    sll = keldysh.floquet_selfenergy(self_l,e,omega,n=nh,less=True)
+    srl = keldysh.floquet_selfenergy(self_r,e,omega,n=nh,less=True)
+    gr = (iden*(e+1j*delta) - fh - sl - sr).I # retarded Green function
+    gless = gr*(sll+srl)*gr.H # less Green function
+    return ((gr*sll + gless*sl.H)*ftauz).trace()[0,0].real
+
+class Test(unittest.TestCase):
+    def test_1(self):
+        """Block tridiagonal solver against the dense Floquet inverse"""
+        np.random.seed(1)
+        m = np.random.random((n,n))-.5 + 1j*(np.random.random((n,n))-.5)
+        ham = np.matrix(m + np.conjugate(m.T))
+        trl = np.matrix(np.zeros((n,n),dtype=complex))
+        trl[0,1],trl[n-1,n-2] = 0.3,0.2
+        tauz = np.matrix(np.diag([1.,-1.]*(n//2)).astype(complex))
+        self_l,self_r = selfenergy(0),selfenergy(n-1)
+        diff = 0.
+        for nh in [1,3,5]:
+          for e in [-0.3,0.13]:
+            c0 = dense_current(e,ham,trl,tauz,self_l,self_r,nh)
+            c1 = keldysh.floquet_current_density(e,ham,trl,omega,
+                    self_l,self_r,tauz,n=nh,delta=delta)
+            diff = max([diff,abs(c0-c1)])
+        print("Error = ",diff)
+        self.assertTrue(diff<error)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,24 @@
+import unittest
+import numpy as np
+import sys
+sys.path.append("../../src/") # add the library
+from pygra import geometry
+
+error = 1e-10 # acceptable accuracy
+
+class Test(unittest.TestCase):
+    def test_1(self):
+        g = geometry.honeycomb_lattice()
+        h = g.get_hamiltonian()
+        h.add_rashba(0.2)
+        h.add_zeeman([0.,0.2,0.])
+        ks = np.random.random((20,3))
+        hks = h.get_hk_batch(ks) # all the Hamiltonians at once
+        f = h.get_hk_gen()
+        diff = np.max([np.max(np.abs(hks[i]-f(k))) for (i,k) in enumerate(ks)])
+        print("Error = ",diff)
+        passed = diff<error
+        self.assertTrue(passed)
+
+if __name__ == '__main__':
+    unittest.main()
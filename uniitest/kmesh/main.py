@@ -0,0 +1,43 @@
+import unittest
+import numpy as np
+import sys
+sys.path.append("../../src/") # add the library
+from pygra import geometry
+from pygra import klist
+from pygra import algebra
+
+error = 1e-7 # acceptable accuracy
+
+def kmesh_average(h,ks,ws):
+    """Average of the sorted eigenvalues in a set of weighted kpoints"""
+    hk = h.get_hk_gen() # Hamiltonian generator
+    es = [np.linalg.eigvalsh(algebra.todense(hk(k))) for k in ks]
+    return np.sum(np.array(es)*np.array(ws)[:,None],axis=0)
+
+class Test(unittest.TestCase):
+    def test_1(self):
+        """Irreducible and full kmesh give the same averages"""
+        g = geometry.honeycomb_lattice()
+        h = g.get_hamiltonian()
+        h.add_sublattice_imbalance(0.2)
+        nk = 6
+        ks,ws = klist.irreducible_kmesh(h,nk=nk)
+        kf = klist.kmesh(2,nk=nk) # full kmesh
+        e1 = kmesh_average(h,ks,ws)
+        e2 = kmesh_average(h,kf,np.ones(len(kf))/len(kf))
+        diff = np.max(np.abs(e1-e2)) + abs(np.sum(ws)-1.)
+        print("Error = ",diff,len(ks),len(kf))
+        self.assertTrue(diff<error)
+        self.assertTrue(len(ks)<len(kf))
+    def test_2(self):
+        """Sparse Bloch Hamiltonians in the check of the operations"""
+        h = geometry.cubic_lattice().get_hamiltonian()
+        h.turn_sparse()
+        ks,ws = klist.irreducible_kmesh(h,nk=4)
+        diff = abs(np.sum(ws)-1.)
+        print("Error = ",diff,len(ks))
+        self.assertTrue(diff<error)
+        self.assertTrue(len(ks)<4**3)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,45 @@
+import unittest
+import numpy as np
+import sys
+sys.path.append("../../src/") # add the library
+from pygra import geometry
+from pygra import kpm
+
+error = 1e-8 # acceptable accuracy
+
+def getm():
+    g = geometry.honeycomb_lattice().supercell(3)
+    h = g.get_hamiltonian()
+    h.add_rashba(0.3)
+    h.add_onsite(lambda r: 0.2*np.cos(r[0]))
+    return np.array(h.intra)/6. # rescaled matrix
+
+class Test(unittest.TestCase):
+    def test_1(self):
+        """Moments of a block of vectors, against the scalar recursion"""
+        m = getm()
+        vs = np.random.random((m.shape[0],4)) + 1j*np.random.random((m.shape[0],4))
+        mus = kpm.kpm_moments_block(vs,m,n=20)
+        mus0 = sum([kpm.python_kpm_moments(vs[:,i],m,n=20) 
+                      for i in range(vs.shape[1])])
+        diff = np.max(np.abs(mus-mus0))
+        print("Error = ",diff)
+        self.assertTrue(diff<error)
+    def test_2(self):
+        """Moments of an operator, against the explicit polynomials"""
+        m = getm()
+        A = np.diag(np.random.random(m.shape[0])) # operator
+        vs = np.random.random((m.shape[0],3)) + 1j*np.random.random((m.shape[0],3))
+        mus = kpm.kpm_moments_block(vs,m,n=20,A=A)
+        md = np.array(m) # dense matrix
+        t0,t1 = vs,md@vs # first Chebychev polynomials
+        mus0 = [np.trace(vs.T.conjugate()@A@t0),np.trace(vs.T.conjugate()@A@t1)]
+        for i in range(2,20):
+          t0,t1 = t1,2*md@t1 - t0 # recursion relation
+          mus0.append(np.trace(vs.T.conjugate()@A@t1))
+        diff = np.max(np.abs(mus-np.array(mus0)))
+        print("Error = ",diff)
+        self.assertTrue(diff<error)
+
+if __name__ == '__main__':
+    unittest.main()
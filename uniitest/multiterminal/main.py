@@ -0,0 +1,57 @@
+import unittest
+import numpy as np
+import sys
+sys.path.append("../../src/") # add the library
+from pygra import geometry
+from pygra import multiterminal
+
+error = 1e-6 # acceptable accuracy
+
+def getg(rs,a1=[1.,0.,0.]):
+    """Geometry with the given positions"""
+    g = geometry.chain()
+    g.r = np.array(rs,dtype=float)
+    g.r2xyz()
+    g.a1 = np.array(a1,dtype=float)
+    return g
+
+def getd(**kwargs):
+    """Device with three leads"""
+    gc = getg([[x,y,0.] for x in range(4) for y in range(2)])
+    gl = getg([[-1.,y,0.] for y in range(2)],a1=[-1.,0.,0.])
+    gr = getg([[4.,y,0.] for y in range(2)],a1=[1.,0.,0.])
+    gt = getg([[x,2.,0.] for x in range(1,3)],a1=[0.,1.,0.])
+    d = multiterminal.Device()
+    d.multiterminal([gl,gr,gt],gc,**kwargs)
+    return d
+
+class Test(unittest.TestCase):
+    def test_1(self):
+        """Transmissions against the dense Green function"""
+        np.random.seed(1)
+        d = getd(disorder=0.5)
+        ij = [(0,1),(1,0),(0,2),(2,1)]
+        es = [-1.3,-0.2,0.7]
+        ts = multiterminal.landauer_multienergy(d,es,ij=ij,delta=1e-4)
+        diff = 0.
+        for (ie,e) in enumerate(es):
+          ms = multiterminal.landauer_matrix(d,e,ij=ij,delta=1e-4)
+          t0 = np.array([np.trace(m) for m in ms]) # dense transmissions
+          diff = max([diff,np.max(np.abs(ts[ie]-t0))])
+        print("Error = ",diff,np.max(ts))
+        self.assertTrue(diff<error)
+    def test_2(self):
+        """Hopping function of a single pair, without cutoff"""
+        def fun(r1,r2):
+          dr = r1-r2
+          return float(.7<dr.dot(dr)<1.3) # first neighbors
+        d0,d1 = getd(),getd(fun=fun)
+        es = [-1.3,-0.2,0.7]
+        ts0 = multiterminal.landauer_multienergy(d0,es,delta=1e-4)
+        ts1 = multiterminal.landauer_multienergy(d1,es,delta=1e-4)
+        diff = np.max(np.abs(ts0-ts1))
+        print("Error = ",diff,np.max(ts1))
+        self.assertTrue(diff<error)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,46 @@
+import unittest
+import numpy as np
+import sys
+sys.path.append("../../src/") # add the library
+from pygra import geometry
+from pygra import algebra
+
+error = 1e-10 # acceptable accuracy
+
+def peierls(x1,y1,x2,y2,b):
+    """Phase of a single hopping in the Landau gauge"""
+    return np.exp(1j*b*(x1-x2)*(y1+y2)/2.0)
+
+def scalar_phase(m,r1,r2,b,nc=1):
+    """Add the phase element by element"""
+    m = np.array(algebra.todense(m)).copy()
+    for (i,j) in zip(*np.nonzero(m)):
+      ri,rj = r1[i//nc],r2[j//nc] # positions of the sites
+      m[i,j] *= peierls(ri[0],ri[1],rj[0],rj[1],b)
+    return m
+
+class Test(unittest.TestCase):
+    def test_1(self):
+        """Vectorized phases against the scalar formula"""
+        g = geometry.honeycomb_lattice()
+        g = g.supercell(2)
+        b = 0.07 # magnetic field
+        for has_spin in [False,True]:
+          h0 = g.get_hamiltonian(has_spin=has_spin)
+          if has_spin: h0.add_rashba(0.2)
+          h0.turn_multicell()
+          h = h0.copy()
+          h.add_peierls(b)
+          nc = 2 if has_spin else 1 # orbitals per site
+          diff = np.max(np.abs(scalar_phase(h0.intra,g.r,g.r,b,nc=nc) - 
+                                 algebra.todense(h.intra)))
+          for (t0,t) in zip(h0.hopping,h.hopping):
+            m0 = scalar_phase(t0.m,g.r,g.replicas(t0.dir),b,nc=nc)
+            diff = max([diff,np.max(np.abs(m0-algebra.todense(t.m)))])
+          dh = np.max(np.abs(algebra.todense(h.intra-h0.intra))) # change
+          print("Error = ",diff,dh)
+          self.assertTrue(diff<error)
+          self.assertTrue(dh>1e-3)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,28 @@
+import unittest
+import numpy as np
+import sys
+sys.path.append("../../src/") # add the library
+from pygra import geometry
+from pygra.selfconsistency import densitydensity
+
+error = 1e-5 # acceptable accuracy
+
+def scf(h,**kwargs):
+    return densitydensity.hubbard(h,U=2.0,nk=4,load_mf=False,verbose=False,
+                                    maxerror=1e-8,**kwargs)
+
+class Test(unittest.TestCase):
+    def test_1(self):
+        """Pulay and linear mixing converge to the same solution"""
+        g = geometry.honeycomb_lattice()
+        h = g.get_hamiltonian()
+        h.add_zeeman([0.,0.,0.1])
+        s0 = scf(h,solver="plain")
+        s1 = scf(h,solver="diis")
+        diff = abs(s0.total_energy-s1.total_energy)
+        print("Error = ",diff)
+        self.assertTrue(diff<error)
+        self.assertTrue(len(s1.telemetry)<len(s0.telemetry))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,30 @@
+import unittest
+import numpy as np
+import sys
+sys.path.append("../../src/") # add the library
+from pygra import geometry
+from pygra import heterostructures
+
+error = 1e-6 # acceptable accuracy
+
+def getht():
+    g = geometry.square_ribbon(3)
+    h = g.get_hamiltonian()
+    hs = [h.copy() for i in range(4)] # central cells
+    for (i,hi) in enumerate(hs): # add some disorder
+      hi.add_onsite(lambda r: 0.3*np.cos(3*r[1]+i))
+    return heterostructures.create_leads_and_central_list(h,h,hs)
+
+class Test(unittest.TestCase):
+    def test_1(self):
+        """Recursive Green function transmission against the dense one"""
+        ht = getht()
+        es = np.linspace(-2.5,2.5,7)
+        ts = ht.landauer_rgf(energies=es,delta=1e-6)
+        ts0 = [ht.landauer(energy=e,delta=1e-6) for e in es]
+        diff = np.max(np.abs(ts-np.array(ts0)))
+        print("Error = ",diff)
+        self.assertTrue(diff<error)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,27 @@
+import unittest
+import numpy as np
+import sys
+sys.path.append("../../src/") # add the library
+from pygra import geometry
+from pygra import rkky
+
+error = 1e-6 # acceptable accuracy, finite differences
+
+class Test(unittest.TestCase):
+    def test_1(self):
+        """Static susceptibility against the finite difference"""
+        g = geometry.chain()
+        g = g.supercell(10)
+        g.dimensionality = 0
+        h = g.get_hamiltonian(has_spin=False)
+        h.add_onsite(lambda r: 0.4*np.cos(1.7*r[0]+0.3))
+        m = rkky.rkky_matrix(h,filling=0.4,rows=[0,3])
+        diff = 0.
+        for (ir,i) in enumerate([0,3]):
+          m0 = rkky.rkky_atom_v1(h,delta=1e-5,i=i,filling=0.4)
+          diff = max([diff,np.max(np.abs(m[ir]-m0))])
+        print("Error = ",diff,np.max(np.abs(m)))
+        self.assertTrue(diff<error)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -16,6 +16,29 @@ def geth(n1,n2,g0):
     return h
 
 
+def brute_supercell(g,m,n=8):
+    """Fractional coordinates, modulo the new cell, of all the sites of
+    the old lattice inside the new cell, enumerating the old cells"""
+    A = np.array([g.a1,g.a2]) # old vectors
+    An = np.array(m)[0:2,0:2].dot(A)[:,0:2] # new vectors, in plane
+    out = []
+    for i in range(-n,n+1):
+      for j in range(-n,n+1):
+        for r in g.r:
+          f = np.linalg.solve(An.T,(r-g.r[0]+i*A[0]+j*A[1])[0:2])
+          if np.all(f>-1e-7) and np.all(f<1.-1e-7): out.append(f)
+    return np.array(out)
+
+def fractional_mod(g,r0):
+    """Fractional coordinates of the sites, relative to r0, modulo the cell"""
+    An = np.array([g.a1,g.a2])[:,0:2] # new vectors, in plane
+    f = np.linalg.solve(An.T,(np.array(g.r)-r0)[:,0:2].T).T
+    return f - np.floor(f+1e-7)
+
+def sorted_rows(f):
+    f = np.round(f,6) + 0. # avoid -0.
+    return f[np.lexsort(f.T[::-1])]
+
 
 class Test(unittest.TestCase):
     def test_1(self):
@@ -28,6 +51,17 @@ class Test(unittest.TestCase):
         print("Error = ",diff)
         passed = diff<error
         self.assertTrue(passed)
+    def test_2(self):
+        """Non orthogonal supercells against the enumeration of cells"""
+        g = geometry.honeycomb_lattice()
+        for m in [[[2,1,0],[-1,3,0],[0,0,1]],[[3,0,0],[2,-2,0],[0,0,1]]]:
+          go = g.supercell(m)
+          f0 = sorted_rows(brute_supercell(g,m))
+          f1 = sorted_rows(fractional_mod(go,go.r[0]))
+          self.assertTrue(f0.shape==f1.shape)
+          diff = np.max(np.abs(f0-f1))
+          print("Error = ",diff,len(go.r))
+          self.assertTrue(diff<error)
 
 if __name__ == '__main__':
     unittest.main()
@@ -0,0 +1,42 @@
+import unittest
+import numpy as np
+import sys
+sys.path.append("../../src/") # add the library
+from pygra import islands
+from pygra import magnetism
+from pygra import algebra
+from pygra import susceptibility
+
+error = 1e-4 # acceptable accuracy
+
+def get_sz(h):
+    """Magnetization of each site"""
+    e,v = np.linalg.eigh(np.array(algebra.todense(h.intra)))
+    d = np.sum(np.abs(v[:,e<0.])**2,axis=1) # occupied states
+    return d[0::2] - d[1::2]
+
+class Test(unittest.TestCase):
+    def test_1(self):
+        """Dominant correlation against local exchange perturbations"""
+        g = islands.get_geometry(name="honeycomb",n=2,nedges=3,rot=np.pi/3)
+        g.dimensionality = 0
+        h = g.get_hamiltonian(has_spin=True)
+        h.add_onsite(lambda r: 0.3*np.sin(3.1*r[0]+1.7*r[1]))
+        filling = 32./66. # non degenerate Fermi level
+        h0 = h.copy() ; h0.set_filling(filling)
+        n,dm = len(g.r),1e-5
+        cs = [] # rows of the susceptibility
+        for i in range(n):
+          hi = h0.copy()
+          ms = [[0.,0.,0.] for j in range(n)] ; ms[i] = [0.,0.,dm]
+          magnetism.add_magnetism(hi,ms) # local exchange field
+          cs.append(-(get_sz(hi)-get_sz(h0))/dm)
+        cs = np.array(cs) ; cs = (cs + cs.T)/2.
+        v0 = np.linalg.eigh(cs)[1][:,-1] # biggest eigenvector
+        v = susceptibility.dominant_correlation(h,filling=filling)
+        diff = 1. - abs(np.dot(v,v0))
+        print("Error = ",diff)
+        self.assertTrue(diff<error)
+
+if __name__ == '__main__':
+    unittest.main()
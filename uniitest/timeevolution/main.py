@@ -0,0 +1,44 @@
+import unittest
+import numpy as np
+import sys
+sys.path.append("../../src/") # add the library
+import scipy.linalg as lg
+from pygra import islands
+from pygra import kpm
+from pygra import timeevolution
+
+error = 1e-7 # acceptable accuracy
+
+def geth():
+    g = islands.get_geometry(name="honeycomb",n=3,nedges=6)
+    h = g.get_hamiltonian()
+    h.add_rashba(0.3)
+    h.add_zeeman([0.,0.,0.2])
+    return h
+
+class Test(unittest.TestCase):
+    def test_1(self):
+        """Chebychev propagator against the exponential of the matrix"""
+        h = geth()
+        m = np.array(h.intra) # dense matrix
+        ts = np.linspace(0.,10.,6)
+        vs = np.random.random((m.shape[0],3)) + 1j*np.random.random((m.shape[0],3))
+        ws = kpm.evolve(h.intra,vs,ts)
+        diff = np.max([np.max(np.abs(ws[i]-lg.expm(-1j*m*t)@vs)) 
+                         for (i,t) in enumerate(ts)])
+        print("Error = ",diff)
+        self.assertTrue(diff<error)
+    def test_2(self):
+        """Evolution of a local state in the kpm mode"""
+        h = geth()
+        m = np.array(h.intra) # dense matrix
+        ts = np.linspace(0.,10.,6)
+        evol = timeevolution.evolve_kpm(h,i=2,ts=ts)
+        v0 = np.zeros(m.shape[0]) ; v0[2] = 1.0 # local state
+        diff = np.max([np.max(np.abs(evol(t)-np.abs(lg.expm(-1j*m*t)@v0)**2)) 
+                         for t in ts])
+        print("Error = ",diff)
+        self.assertTrue(diff<error)
+
+if __name__ == '__main__':
+    unittest.main()
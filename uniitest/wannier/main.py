@@ -0,0 +1,65 @@
+import unittest
+import numpy as np
+import sys
+sys.path.append("../../src/") # add the library
+from pygra import wannier
+from pygra import algebra
+
+error = 1e-10 # acceptable accuracy
+
+path = "../../testing/wannier/" # folder with the files
+
+def genfromtxt_hoppings(d,ndeg=None):
+    """Hoppings of each lattice vector from the rows of the file"""
+    nw = int(np.max(d[:,3:5])) # number of orbitals
+    out = dict()
+    for (ir,l) in enumerate(d):
+      key = tuple(l[0:3].astype(int))
+      if key not in out: out[key] = np.zeros((nw,nw),dtype=complex)
+      t = l[5] + 1j*l[6] # hopping
+      if ndeg is not None: t = t/ndeg[ir//(nw*nw)]
+      out[key][int(l[3])-1,int(l[4])-1] += t
+    return out
+
+def difference(ts0,ts1):
+    """Maximum difference between two sets of hoppings"""
+    out = 0.
+    for key in ts0:
+      m = np.array(algebra.todense(ts1[key])) if key in ts1 else 0.
+      out = max([out,np.max(np.abs(ts0[key]-m))])
+    return out
+
+class Test(unittest.TestCase):
+    def test_1(self):
+        """Truncated files starting with a comment"""
+        for name in ["hr_truncated.dat","MoS2/hr_truncated.dat"]:
+          ts0 = genfromtxt_hoppings(np.genfromtxt(path+name))
+          ts1 = wannier.read_hoppings(path+name)
+          diff = difference(ts0,ts1)
+          print("Error = ",diff)
+          self.assertTrue(diff<error)
+    def test_2(self):
+        """File in the hr.dat format, with degeneracies"""
+        name = path+"wannier_hr.dat"
+        lines = open(name).readlines()
+        nw,nr = int(lines[1]),int(lines[2]) # orbitals and vectors
+        nl = int(np.ceil(nr/15.)) # lines with degeneracies
+        ndeg = np.array(" ".join(lines[3:3+nl]).split(),dtype=float)
+        d = np.genfromtxt(name,skip_header=3+nl)
+        ts0 = genfromtxt_hoppings(d,ndeg=ndeg)
+        ts1 = wannier.read_hoppings(name)
+        diff = difference(ts0,ts1)
+        print("Error = ",diff,len(ts1))
+        self.assertTrue(diff<error)
+        self.assertTrue(len(ts0)==len(ts1))
+    def test_3(self):
+        """Hamiltonian from a folder with a commented hr_truncated.dat"""
+        h = wannier.read_multicell_hamiltonian(path=path+"MoS2",
+                                                 skip_win=True)
+        ts0 = genfromtxt_hoppings(np.genfromtxt(path+"MoS2/hr_truncated.dat"))
+        diff = np.max(np.abs(ts0[(0,0,0)]-algebra.todense(h.intra)))
+        print("Error = ",diff)
+        self.assertTrue(diff<error)
+
+if __name__ == '__main__':
+    unittest.main()